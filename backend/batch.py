@@ -0,0 +1,223 @@
+"""
+Headless batch runs and parameter sweeps.
+
+Usage: python -m backend.batch LAYOUT [--ticks 2000] [--warmup 200]
+           [--param NAME=VALUES ...] [--seeds 0-4] [--workers N] [--out sweep.npz]
+
+LAYOUT is one of:
+    grid:ROWSxCOLS              create_city_grid
+    json:city_layouts/X.json    a layout file (a bare .json path works too)
+    pattern:NAME                manhattan, roundabout or t_intersection
+    osm:SOUTH,WEST,NORTH,EAST   a map already in the OSM cache
+
+Each --param takes a comma-separated list (0.1,0.2,0.3) or a range
+start:stop:count (0.05:0.5:10) for one of PARAMETERS. Every combination
+of the values is run once per seed, spread over a process pool. Each run
+records get_statistics() every --sample ticks after the warmup and
+averages it into one row. The rows are written column by column to
+--out: an .npz with one array per column, or a .csv. --series also
+writes every sample, with its run number, next to it.
+"""
+import argparse
+import csv
+import itertools
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .map_loader import CityMapLoader
+from .model import ENGINES, SimulationModel
+from .osm_generator import OSMGenerator
+
+logger = logging.getLogger("UrbanFlow")
+
+# Settings a sweep can vary, with how each is applied to a built model
+PARAMETERS = {
+    "p_slowdown": lambda m, v: setattr(m, "p_slowdown", float(v)),
+    "car_spawn_rate": lambda m, v: setattr(m, "car_spawn_rate", float(v)),
+    "max_v_global": lambda m, v: setattr(m, "max_v_global", int(v)),
+    "green_duration": lambda m, v: m.set_light_timing(int(v)),
+    "yellow_duration": lambda m, v: m.set_light_timing(m.light_green_duration, int(v)),
+    "demand_rate": lambda m, v: m.set_demand(rate=float(v)) if v > 0 else m.clear_demand(),
+}
+PATTERNS = {
+    "manhattan": CityMapLoader.create_manhattan_grid,
+    "roundabout": CityMapLoader.create_roundabout,
+    "t_intersection": CityMapLoader.create_t_intersection,
+}
+# Statistics averaged into each run's row
+MEASURES = ("speed", "density", "flow", "vehicleCount", "throughput", "queued")
+
+
+def build_layout(model: SimulationModel, layout: str):
+    """Load the map named by a LAYOUT spec (see the module docstring) into model."""
+    kind, _, arg = layout.partition(":")
+    if not arg and kind.endswith(".json"):
+        kind, arg = "json", kind
+    if kind == "grid":
+        rows, _, cols = arg.lower().partition("x")
+        model.create_city_grid(int(rows), int(cols or rows))
+    elif kind == "json":
+        CityMapLoader.load_from_json(model, arg)
+    elif kind == "pattern":
+        if arg not in PATTERNS:
+            raise ValueError(f"Unknown pattern '{arg}', expected one of {sorted(PATTERNS)}")
+        PATTERNS[arg](model)
+    elif kind == "osm":
+        south, west, north, east = (float(x) for x in arg.split(","))
+        bounds = {"south": south, "west": west, "north": north, "east": east}
+        if not OSMGenerator.load_cached(model, bounds):
+            raise ValueError(f"No cached OSM map for {bounds}")
+    else:
+        raise ValueError(f"Unknown layout '{layout}'")
+    if not model.edges:
+        raise ValueError(f"Layout '{layout}' has no roads")
+
+
+def parse_values(text: str) -> list:
+    """A --param value list: a,b,c or start:stop:count."""
+    if ":" in text:
+        start, stop, count = text.split(":")
+        return np.linspace(float(start), float(stop), int(count)).round(6).tolist()
+    return [float(v) for v in text.split(",")]
+
+
+def parse_seeds(text: str) -> list:
+    """0-4, 1,5,9 or a count (5 means seeds 0 to 4)."""
+    if "-" in text:
+        lo, hi = text.split("-")
+        return list(range(int(lo), int(hi) + 1))
+    if "," in text:
+        return [int(s) for s in text.split(",")]
+    return list(range(int(text)))
+
+
+def run_one(job: dict) -> tuple:
+    """One replication: returns its summary row and its samples."""
+    seed = job["seed"]
+    model = SimulationModel(engine=job["engine"], seed=seed, max_cars=job["max_cars"])
+    build_layout(model, job["layout"])
+    for name, value in job["params"].items():
+        PARAMETERS[name](model, value)
+
+    samples = []
+    started = time.perf_counter()
+    for tick in range(1, job["ticks"] + 1):
+        model.step()
+        if tick > job["warmup"] and (tick - job["warmup"]) % job["sample"] == 0:
+            stats = model.get_statistics()
+            samples.append([tick] + [stats[k] for k in MEASURES])
+    elapsed = time.perf_counter() - started
+
+    means = np.mean(np.array(samples, dtype=np.float64)[:, 1:], axis=0) if samples else np.zeros(len(MEASURES))
+    row = dict(job["params"], seed=seed)
+    row.update(zip(MEASURES, means.tolist()))
+    row.update(
+        completed=model.trips["completed"],
+        crossings=model.stats.crossings,
+        ticks_per_sec=job["ticks"] / elapsed if elapsed > 0 else 0.0
+    )
+    return row, samples
+
+
+def sweep(layout: str, grid: dict, seeds: list, ticks: int = 2000, warmup: int = 200, sample: int = 10,
+          engine: str = "numpy", max_cars: int = 10000, workers: int = None, progress=None):
+    """
+    Run every combination of the values in grid (name -> list) for every
+    seed. Returns the summary rows in job order and, per row, its samples.
+    """
+    unknown = set(grid) - set(PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown parameters: {sorted(unknown)}, expected some of {sorted(PARAMETERS)}")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+    names = list(grid)
+    jobs = [
+        {"layout": layout, "params": dict(zip(names, values)), "seed": seed, "ticks": ticks,
+         "warmup": warmup, "sample": max(1, sample), "engine": engine, "max_cars": max_cars}
+        for values in itertools.product(*(grid[n] for n in names))
+        for seed in seeds
+    ]
+    # Fail on a bad layout here rather than once per worker
+    build_layout(SimulationModel(max_cars=0), layout)
+
+    rows, series = [], []
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        results = map(run_one, jobs)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(run_one, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
+    try:
+        for i, (row, samples) in enumerate(results):
+            rows.append(row)
+            series.append(samples)
+            if progress:
+                progress(i + 1, len(jobs), row)
+    finally:
+        if workers > 1:
+            pool.shutdown(cancel_futures=True)
+    return rows, series
+
+
+def write_columns(path: str, columns: dict):
+    """Write equal-length columns as an .npz (one array each) or a .csv."""
+    if path.endswith(".csv"):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(zip(*columns.values()))
+    else:
+        np.savez_compressed(path, **{k: np.asarray(v) for k, v in columns.items()})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument("layout")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUES")
+    parser.add_argument("--seeds", default="1")
+    parser.add_argument("--ticks", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--sample", type=int, default=10, help="ticks between recorded samples")
+    parser.add_argument("--engine", default="numpy", choices=ENGINES)
+    parser.add_argument("--max-cars", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--out", default="sweep.npz")
+    parser.add_argument("--series", action="store_true", help="also write every sample")
+    args = parser.parse_args(argv)
+
+    grid = {}
+    for spec in args.param:
+        name, _, values = spec.partition("=")
+        grid[name.strip()] = parse_values(values)
+
+    def progress(done, total, row):
+        print(f"[{done}/{total}] " + " ".join(f"{k}={v:.4g}" for k, v in row.items()), flush=True)
+
+    try:
+        rows, series = sweep(args.layout, grid, parse_seeds(args.seeds), args.ticks, args.warmup, args.sample,
+                             args.engine, args.max_cars, args.workers, progress)
+    except ValueError as e:
+        parser.error(str(e))
+
+    write_columns(args.out, {k: [row[k] for row in rows] for k in rows[0]})
+    print(f"Wrote {len(rows)} runs to {args.out}")
+    if args.series:
+        root, ext = os.path.splitext(args.out)
+        path = f"{root}_series{ext}"
+        columns = {"run": [i for i, samples in enumerate(series) for _ in samples]}
+        flat = [s for samples in series for s in samples]
+        for j, name in enumerate(("tick",) + MEASURES):
+            columns[name] = [s[j] for s in flat]
+        write_columns(path, columns)
+        print(f"Wrote {len(flat)} samples to {path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main())
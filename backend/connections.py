@@ -0,0 +1,209 @@
+import asyncio
+import itertools
+import json
+import logging
+from collections import deque
+from typing import Callable
+
+from fastapi import WebSocket
+
+from .frames import Encoded, KEYFRAME
+
+logger = logging.getLogger("UrbanFlow")
+
+# Ids naming clients to the shards, which keep their views
+_client_ids = itertools.count(1)
+
+
+class ClientConnection:
+    """
+    One WebSocket viewer with its own outbox and sender task.
+
+    Control messages (init, errors) are always delivered. Update frames
+    are counted against the manager's max_pending; once a client has that
+    many unsent, they are dropped and replaced with a single keyframe.
+    With has_view, it gets the payloads its shard culled for its id.
+    """
+
+    def __init__(self, websocket: WebSocket, fmt: str):
+        self.id = next(_client_ids)
+        self.websocket = websocket
+        self.format = fmt
+        self.outbox = deque()
+        self.pending_frames = 0
+        self.dropped_frames = 0
+        self.needs_keyframe = False
+        self.has_view = False
+        self.ready = asyncio.Event()
+        self.task = None
+
+    def push(self, payload, droppable: bool = False):
+        self.outbox.append((payload, droppable))
+        if droppable:
+            self.pending_frames += 1
+        self.ready.set()
+
+    def drop_frames(self):
+        """Discard unsent update frames, keeping control messages in order."""
+        self.dropped_frames += self.pending_frames
+        self.outbox = deque(item for item in self.outbox if not item[1])
+        self.pending_frames = 0
+
+    async def run(self, send_timeout: float):
+        while True:
+            if not self.outbox:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+            payload, droppable = self.outbox.popleft()
+            if droppable:
+                self.pending_frames -= 1
+            if isinstance(payload, bytes):
+                send = self.websocket.send_bytes(payload)
+            else:
+                send = self.websocket.send_text(payload)
+            await asyncio.wait_for(send, send_timeout)
+
+
+class ConnectionManager:
+    """
+    Fans messages out to every connected viewer without awaiting any of them.
+
+    Each message is serialized once per wire format and queued per client;
+    a sender task per client drains its queue, so a slow viewer only delays
+    itself. Clients whose send fails or times out are pruned.
+    """
+
+    def __init__(self, max_pending: int = 4, send_timeout: float = 10.0):
+        self.max_pending = max_pending
+        self.send_timeout = send_timeout
+        self.clients: dict[WebSocket, ClientConnection] = {}
+        # Frames dropped for any client, including ones since disconnected
+        self.dropped_frames = 0
+
+    @property
+    def active_connections(self) -> list[WebSocket]:
+        return list(self.clients)
+
+    async def connect(self, websocket: WebSocket, fmt: str = "json"):
+        await websocket.accept()
+        self.attach(websocket, fmt)
+
+    def attach(self, websocket: WebSocket, fmt: str = "json"):
+        """Start serving an already accepted socket."""
+        client = ClientConnection(websocket, fmt)
+        self.clients[websocket] = client
+        client.task = asyncio.create_task(self._sender(client))
+
+    def disconnect(self, websocket: WebSocket):
+        client = self.clients.pop(websocket, None)
+        if client is not None and client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    async def _sender(self, client: ClientConnection):
+        try:
+            await client.run(self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping client: send blocked for over {self.send_timeout}s")
+            await self._close(client)
+        except Exception as e:
+            logger.info(f"Dropping client: {e!r}")
+            await self._close(client)
+        finally:
+            self.disconnect(client.websocket)
+
+    async def _close(self, client: ClientConnection):
+        try:
+            await client.websocket.close()
+        except Exception:
+            # Already closed by the peer or the server; nothing left to release.
+            pass
+
+    def send(self, websocket: WebSocket, message: dict):
+        """Queue a control message for one client, behind anything already queued."""
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.push(json.dumps(message))
+
+    def request_keyframe(self, websocket: WebSocket):
+        """Send this client a keyframe in place of its next delta."""
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.needs_keyframe = True
+
+    def client_id(self, websocket: WebSocket) -> int | None:
+        client = self.clients.get(websocket)
+        return None if client is None else client.id
+
+    def set_view(self, websocket: WebSocket, has_view: bool):
+        """Whether the shard holds a view for this client; either way it restarts from a keyframe."""
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.has_view = has_view
+            client.needs_keyframe = True
+
+    def wants(self) -> tuple[list, dict]:
+        """
+        What the shard should encode frames for: the wire formats of clients
+        seeing the whole map, and the format of each client with a view, by id.
+        """
+        clients = self.clients.values()
+        formats = sorted({c.format for c in clients if not c.has_view})
+        return formats, {c.id: c.format for c in clients if c.has_view}
+
+    def wants_keyframe(self) -> bool:
+        """Whether the next broadcast will need a resync keyframe for someone."""
+        return any(
+            c.needs_keyframe or c.pending_frames >= self.max_pending
+            for c in self.clients.values()
+        )
+
+    def broadcast(self, message: dict | Encoded, resync: Callable[[], Encoded | None] | None = None):
+        """
+        Queue a message for every client. Update frames arrive already
+        serialized for each client's format and view, so nothing is encoded
+        here. `resync` supplies a keyframe of the same tick for clients that
+        fell behind or asked for one; without it the oldest frames are
+        simply dropped.
+        """
+        if not isinstance(message, Encoded):
+            payload = json.dumps(message)
+            for client in self.clients.values():
+                client.push(payload)
+            return
+
+        for client in self.clients.values():
+            frame = message
+            if client.pending_frames >= self.max_pending:
+                if resync is None:
+                    client.outbox.remove(next(item for item in client.outbox if item[1]))
+                    client.pending_frames -= 1
+                    client.dropped_frames += 1
+                    self.dropped_frames += 1
+                else:
+                    self.dropped_frames += client.pending_frames
+                    client.drop_frames()
+                    client.needs_keyframe = True
+            if client.needs_keyframe and resync is not None:
+                frame = resync() or message
+                if frame.kind != KEYFRAME:
+                    # No keyframe of this tick to offer; skip the delta and retry next frame.
+                    continue
+            payload = frame.payload(client.format, client.id if client.has_view else None)
+            if payload is None:
+                # Joined after the frame was asked for; start it at the next keyframe.
+                client.needs_keyframe = True
+                continue
+            if frame.kind == KEYFRAME:
+                client.needs_keyframe = False
+            client.push(payload, droppable=True)
+
+    def stats(self) -> dict:
+        clients = list(self.clients.values())
+        return {
+            "clients": len(clients),
+            "queued_frames": sum(c.pending_frames for c in clients),
+            "dropped_frames": self.dropped_frames
+        }
@@ -1,21 +1,24 @@
 import numpy as np
 
 class Node:
+    __slots__ = (
+        "id", "index", "x", "y", "type", "sink", "in_edges", "out_edges",
+        "green_duration", "yellow_duration"
+    )
+
     def __init__(self, id: str, x: float, y: float, type: str = "intersection"):
         self.id = id
+        self.index = 0
         self.x = x
         self.y = y
         self.type = type 
+        self.sink = False
         self.in_edges = []
         self.out_edges = []
         
-        self.signal_state_ns = "green"  
-        self.signal_state_ew = "red"   
-        self.signal_timer = 0
-        
+        # Default signal plan; the running state lives in SignalController
         self.green_duration = 30
         self.yellow_duration = 5
-        self.red_duration = 30  
         
     def to_dict(self):
         """Serialize node for frontend"""
@@ -23,45 +26,113 @@ class Node:
             "id": self.id,
             "x": self.x,
             "y": self.y,
-            "type": self.type,
-            "signal_ns": self.signal_state_ns,
-            "signal_ew": self.signal_state_ew
+            "type": self.type
         }
 
 class Edge:
-    def __init__(self, id: str, from_node: Node, to_node: Node, length: int, speed_limit: int = 5, direction: str = "horizontal"):
+    __slots__ = ("id", "index", "from_node", "to_node", "length", "speed_limit", "direction", "points", "lanes", "cells")
+
+    def __init__(self, id: str, from_node: Node, to_node: Node, length: int, speed_limit: int = 5, direction: str = "horizontal",
+                 points: list = None, lanes: int = 1):
         self.id = id
+        self.index = 0
         self.from_node = from_node
         self.to_node = to_node
         self.length = length 
         self.speed_limit = speed_limit
         self.direction = direction  
+        # Bends between the end nodes of a road folded from several segments
+        self.points = points or []
+        self.lanes = max(1, int(lanes))
         
-        self.cells = [None] * length
+        # cells[lane][position], lane 0 rightmost
+        self.cells = [[None] * length for _ in range(self.lanes)]
+
+    def approaches_east_west(self) -> bool:
+        """Whether the last stretch into to_node runs more east-west than north-south."""
+        if self.points:
+            x, y = self.points[-1]
+        else:
+            x, y = self.from_node.x, self.from_node.y
+        return abs(self.to_node.x - x) > abs(self.to_node.y - y)
 
     def to_dict(self):
-        return {
+        data = {
             "id": self.id,
             "from": {"x": self.from_node.x, "y": self.from_node.y},
             "to": {"x": self.to_node.x, "y": self.to_node.y},
             "length": self.length,
             "direction": self.direction,
-            "cells": [(c.to_dict() if c else None) for c in self.cells]
+            "lanes": self.lanes,
+            "cells": [[(c.to_dict() if c else None) for c in lane] for lane in self.cells]
         }
+        if self.points:
+            data["points"] = [{"x": x, "y": y} for x, y in self.points]
+        return data
 
 class Car:
-    def __init__(self, id: str, velocity: int = 0, max_v: int = 5):
+    __slots__ = ("id", "index", "velocity", "max_v", "position", "lane", "current_edge", "dest", "entered")
+
+    def __init__(self, id: int, velocity: int = 0, max_v: int = 5):
         self.id = id
+        self.index = 0
         self.velocity = velocity
         self.max_v = max_v
         self.position = 0 
+        self.lane = 0
         self.current_edge: Edge = None
-        self.color = "yellow"
+        # Index of the node this car's trip ends at, or -1 to turn at random
+        self.dest = -1
+        # Tick the car entered current_edge on
+        self.entered = 0
+
+    @property
+    def key(self) -> str:
+        """String id used on the wire"""
+        return f"car_{self.id}"
 
     def to_dict(self):
         return {
-            "id": self.id,
+            "id": self.key,
             "v": self.velocity,
             "p": self.position,
+            "l": self.lane,
             "edge_id": self.current_edge.id if self.current_edge else None
         }
+
+class CarPool:
+    """
+    Preallocated Car objects with free-list reuse.
+    Active cars are kept dense in `active` (car.index is the slot), so
+    releasing a car is an O(1) swap with the last entry.
+    """
+
+    def __init__(self, capacity: int = None):
+        self.capacity = capacity
+        self.active: list = []
+        self.free: list = [Car(0) for _ in range(capacity or 0)]
+
+    def acquire(self) -> Car | None:
+        if self.free:
+            car = self.free.pop()
+        elif self.capacity is None:
+            car = Car(0)
+        else:
+            return None
+        car.index = len(self.active)
+        self.active.append(car)
+        return car
+
+    def release(self, car: Car):
+        last = self.active.pop()
+        if last is not car:
+            self.active[car.index] = last
+            last.index = car.index
+        car.current_edge = None
+        self.free.append(car)
+
+    def clear(self):
+        for car in self.active:
+            car.current_edge = None
+        self.free.extend(self.active)
+        self.active.clear()
@@ -0,0 +1,355 @@
+import json
+import struct
+import numpy as np
+from .model import SimulationModel
+
+KEYFRAME = 0
+DELTA = 1
+AGGREGATE = 2
+
+# magic, kind, tick, base tick, car count, removed count, JSON tail length
+BINARY_HEADER = struct.Struct("<4sBxxxIIIII")
+BINARY_MAGIC = b"UFB2"
+
+FORMATS = ("json", "binary")
+
+# A view switches from cars to per-edge aggregates when more edges than
+# this are in it, or when it is drawn at fewer pixels per map unit than
+# DETAIL_SCALE (a car would be under about 9 pixels long).
+DETAIL_EDGES = 1500
+DETAIL_SCALE = 0.35
+
+
+class View:
+    """
+    What one client can see: edges is a mask over the edge list, nodes the
+    ids whose lights it gets, and aggregate whether it is zoomed out far
+    enough to get per-edge aggregates in place of cars.
+    """
+
+    __slots__ = ("edges", "nodes", "aggregate")
+
+    def __init__(self, edge_count: int, edges: np.ndarray, nodes: list, scale: float):
+        self.edges = np.zeros(edge_count, dtype=bool)
+        self.edges[edges] = True
+        self.nodes = set(nodes)
+        self.aggregate = len(edges) > DETAIL_EDGES or scale < DETAIL_SCALE
+
+    def fits(self, edge_ids: list) -> bool:
+        """Whether the view was taken of a map with this edge list's size."""
+        return len(self.edges) == len(edge_ids)
+
+    def lights(self, lights: list) -> list:
+        return [light for light in lights if light["id"] in self.nodes]
+
+
+class Frame:
+    """
+    One simulation update, encoded on demand and at most once per wire format.
+
+    Binary layout (little-endian): a BINARY_HEADER, then car ids (uint32),
+    edge indices into the init state's edge list (uint32), removed car ids
+    (uint32), positions (uint16), velocities (uint8), lanes (uint8), zero padding to a
+    4-byte boundary and a UTF-8 JSON tail with stats and lights.
+    """
+
+    def __init__(self, kind: int, tick: int, base: int, stats: dict, lights: list,
+                 cars: np.ndarray, removed: np.ndarray, edge_ids: list, prev_edges: np.ndarray = None):
+        self.kind = kind
+        self.tick = tick
+        self.base = base
+        self.stats = stats
+        self.lights = lights
+        self.cars = cars
+        self.removed = removed
+        self.edge_ids = edge_ids
+        # In deltas, the edge each car was on in the base frame (-1 if new)
+        self.prev_edges = prev_edges
+        self._json = None
+        self._bytes = None
+
+    def cull(self, view: View) -> "Frame":
+        """
+        This frame as seen through view: only cars on its edges, and in
+        deltas the cars that drove out of it as removed.
+        """
+        if not view.fits(self.edge_ids):
+            return self
+        cars, removed = self.cars, self.removed
+        visible = view.edges[cars[:, 1]]
+        if self.kind == DELTA:
+            prev = self.prev_edges
+            left = ~visible & (prev >= 0) & view.edges[np.maximum(prev, 0)]
+            removed = np.concatenate([removed, cars[left, 0]])
+        return Frame(self.kind, self.tick, self.base, self.stats, view.lights(self.lights),
+                     cars[visible], removed, self.edge_ids)
+
+    def to_dict(self) -> dict:
+        edge_ids = self.edge_ids
+        cars = [
+            {"id": f"car_{car_id}", "v": v, "p": p, "l": l, "edge_id": edge_ids[e]}
+            for car_id, e, p, v, l in self.cars.tolist()
+        ]
+        if self.kind == KEYFRAME:
+            return {
+                "type": "update",
+                "keyframe": True,
+                "tick": self.tick,
+                "stats": self.stats,
+                "cars": cars,
+                "lights": self.lights
+            }
+        return {
+            "type": "delta",
+            "base": self.base,
+            "tick": self.tick,
+            "stats": self.stats,
+            "cars": cars,
+            "removed": [f"car_{car_id}" for car_id in self.removed.tolist()],
+            "lights": self.lights
+        }
+
+    def to_json(self) -> str:
+        if self._json is None:
+            self._json = json.dumps(self.to_dict(), separators=(",", ":"))
+        return self._json
+
+    def to_bytes(self) -> bytes:
+        if self._bytes is None:
+            cars = self.cars
+            tail = json.dumps({"stats": self.stats, "lights": self.lights}, separators=(",", ":")).encode("utf-8")
+            columns = b"".join([
+                cars[:, 0].astype("<u4").tobytes(),
+                cars[:, 1].astype("<u4").tobytes(),
+                self.removed.astype("<u4").tobytes(),
+                cars[:, 2].astype("<u2").tobytes(),
+                cars[:, 3].astype("u1").tobytes(),
+                cars[:, 4].astype("u1").tobytes()
+            ])
+            header = BINARY_HEADER.pack(
+                BINARY_MAGIC, self.kind, self.tick, self.base or 0,
+                len(cars), len(self.removed), len(tail)
+            )
+            self._bytes = header + columns + bytes(-len(columns) % 4) + tail
+        return self._bytes
+
+    def encode(self, fmt: str):
+        return self.to_bytes() if fmt == "binary" else self.to_json()
+
+
+class AggregateFrame:
+    """
+    Per-edge traffic in place of cars, for zoomed-out views: the cars on
+    each occupied edge and their mean speed, and the lights that changed
+    with the frame of the same tick.
+
+    Binary layout: a BINARY_HEADER with the edge count in place of the
+    car count, then edge indices (uint32), car counts (uint16), mean
+    speeds in fiftieths (uint8), padding and the JSON tail as in Frame.
+    """
+
+    kind = AGGREGATE
+
+    def __init__(self, tick: int, stats: dict, lights: list, edges: np.ndarray, counts: np.ndarray,
+                 speeds: np.ndarray, edge_ids: list):
+        self.tick = tick
+        self.stats = stats
+        self.lights = lights
+        self.edges = edges
+        self.counts = counts
+        self.speeds = speeds
+        self.edge_ids = edge_ids
+        self._json = None
+        self._bytes = None
+
+    def cull(self, view: View) -> "AggregateFrame":
+        if not view.fits(self.edge_ids):
+            return self
+        visible = view.edges[self.edges]
+        return AggregateFrame(self.tick, self.stats, view.lights(self.lights), self.edges[visible],
+                              self.counts[visible], self.speeds[visible], self.edge_ids)
+
+    def to_dict(self) -> dict:
+        edge_ids = self.edge_ids
+        return {
+            "type": "aggregate",
+            "tick": self.tick,
+            "stats": self.stats,
+            "edges": [
+                [edge_ids[e], n, round(v, 2)]
+                for e, n, v in zip(self.edges.tolist(), self.counts.tolist(), self.speeds.tolist())
+            ],
+            "lights": self.lights
+        }
+
+    def to_json(self) -> str:
+        if self._json is None:
+            self._json = json.dumps(self.to_dict(), separators=(",", ":"))
+        return self._json
+
+    def to_bytes(self) -> bytes:
+        if self._bytes is None:
+            tail = json.dumps({"stats": self.stats, "lights": self.lights}, separators=(",", ":")).encode("utf-8")
+            columns = b"".join([
+                self.edges.astype("<u4").tobytes(),
+                np.minimum(self.counts, 0xFFFF).astype("<u2").tobytes(),
+                np.clip(np.rint(self.speeds * 50), 0, 255).astype("u1").tobytes()
+            ])
+            header = BINARY_HEADER.pack(BINARY_MAGIC, AGGREGATE, self.tick, 0, len(self.edges), 0, len(tail))
+            self._bytes = header + columns + bytes(-len(columns) % 4) + tail
+        return self._bytes
+
+    def encode(self, fmt: str):
+        return self.to_bytes() if fmt == "binary" else self.to_json()
+
+
+class Encoded:
+    """
+    A frame serialized where it was encoded, so the event loop only
+    forwards bytes: payloads holds it whole per wire format, views the
+    culled (or aggregated) payload of each client with a view, by id.
+    """
+
+    __slots__ = ("kind", "tick", "payloads", "views")
+
+    def __init__(self, kind: int, tick: int, payloads: dict, views: dict):
+        self.kind = kind
+        self.tick = tick
+        self.payloads = payloads
+        self.views = views
+
+    def payload(self, fmt: str, view_id: int | None = None):
+        """What a client gets, or None if it was not encoded for it."""
+        if view_id in self.views:
+            return self.views[view_id]
+        return self.payloads.get(fmt)
+
+
+def serialize(frame: Frame | None, formats, views: dict, known: dict,
+              aggregates: AggregateFrame | None = None) -> Encoded | None:
+    """
+    Encode frame for every format in formats and for each client in views
+    (client id to format) through its View in known. Clients whose view is
+    unknown get the whole frame; zoomed-out ones get aggregates if given.
+    """
+    if frame is None:
+        return None
+    formats = set(formats)
+    culled = {}
+    for view_id, fmt in views.items():
+        view = known.get(view_id)
+        if view is None:
+            formats.add(fmt)
+        elif view.aggregate and aggregates is not None:
+            culled[view_id] = aggregates.cull(view).encode(fmt)
+        else:
+            culled[view_id] = frame.cull(view).encode(fmt)
+    return Encoded(frame.kind, frame.tick, {fmt: frame.encode(fmt) for fmt in formats}, culled)
+
+
+class DeltaEncoder:
+    """
+    Builds the update Frames for WebSocket clients.
+
+    Every keyframe_interval frames (not ticks, which may run faster), a
+    keyframe carries every car and light. In between, a delta carries
+    only cars that spawned, moved, changed speed, lane or edge, the ids of cars
+    that left, and lights whose state changed since the previous frame.
+    Each delta names the tick it applies to in "base".
+    """
+
+    def __init__(self, keyframe_interval: int = 50):
+        self.keyframe_interval = keyframe_interval
+        self.reset()
+
+    def reset(self):
+        """Make the next frame a keyframe (after a map load, reset or resync)."""
+        self.force_keyframe = True
+        self.last_tick = None
+        self.last_keyframe = None
+        self.frames_since_keyframe = 0
+        self.prev = np.zeros((0, 5), dtype=np.int64)
+        self.prev_lights = {}
+        self.edge_ids = []
+        self.last_frame = None
+        self._resync = None
+
+    def encode(self, model: SimulationModel, extra_stats: dict | None = None) -> Frame:
+        cars = model.car_columns()
+        cars = cars[np.argsort(cars[:, 0], kind="stable")]
+        lights = model.get_lights()
+        stats = model.get_statistics()
+        if extra_stats:
+            stats.update(extra_stats)
+
+        keyframe = (
+            self.force_keyframe
+            or self.last_keyframe is None
+            or self.frames_since_keyframe >= self.keyframe_interval
+            or model.tick_count < self.last_tick
+        )
+
+        if keyframe:
+            self.edge_ids = [e.id for e in model.edges.values()]
+            frame = Frame(KEYFRAME, model.tick_count, None, stats, lights,
+                          cars, np.zeros(0, dtype=np.int64), self.edge_ids)
+            self.force_keyframe = False
+            self.last_keyframe = model.tick_count
+            self.frames_since_keyframe = 0
+        else:
+            changed, removed, prev_edges = self._car_delta(cars)
+            changed_lights = [
+                light for light in lights
+                if self.prev_lights.get(light["id"]) != (light["ns"], light["ew"])
+            ]
+            frame = Frame(DELTA, model.tick_count, self.last_tick, stats, changed_lights,
+                          cars[changed], removed, self.edge_ids, prev_edges[changed])
+
+        self.prev = cars
+        self.prev_lights = {light["id"]: (light["ns"], light["ew"]) for light in lights}
+        self.last_tick = model.tick_count
+        self.last_frame = frame
+        self.frames_since_keyframe += 1
+        return frame
+
+    def resync_frame(self) -> Frame | None:
+        """
+        A keyframe of the latest encoded tick for a single client that fell
+        behind, built at most once per tick and without touching the delta
+        chain the other clients are following.
+        """
+        frame = self.last_frame
+        if frame is None or frame.kind == KEYFRAME:
+            return frame
+        if self._resync is None or self._resync.tick != frame.tick:
+            lights = [
+                {"id": node_id, "ns": ns, "ew": ew}
+                for node_id, (ns, ew) in self.prev_lights.items()
+            ]
+            self._resync = Frame(KEYFRAME, frame.tick, None, frame.stats, lights,
+                                 self.prev, np.zeros(0, dtype=np.int64), self.edge_ids)
+        return self._resync
+
+    def _car_delta(self, cars: np.ndarray):
+        prev = self.prev
+        _, cur_i, prev_i = np.intersect1d(cars[:, 0], prev[:, 0], assume_unique=True, return_indices=True)
+
+        changed = np.ones(len(cars), dtype=bool)
+        changed[cur_i] = (cars[cur_i, 1:] != prev[prev_i, 1:]).any(axis=1)
+
+        gone = np.ones(len(prev), dtype=bool)
+        gone[prev_i] = False
+
+        prev_edges = np.full(len(cars), -1, dtype=np.int64)
+        prev_edges[cur_i] = prev[prev_i, 1]
+        return changed, prev[gone, 0], prev_edges
+
+    def aggregate_frame(self) -> AggregateFrame | None:
+        """The occupied edges of the latest encoded tick, for zoomed-out views."""
+        frame = self.last_frame
+        if frame is None:
+            return None
+        cars = self.prev
+        edges, inverse, counts = np.unique(cars[:, 1], return_inverse=True, return_counts=True)
+        speeds = np.bincount(inverse, weights=cars[:, 3], minlength=len(edges)) / np.maximum(counts, 1)
+        return AggregateFrame(frame.tick, frame.stats, frame.lights, edges, counts, speeds, self.edge_ids)
@@ -0,0 +1,119 @@
+import math
+import numpy as np
+
+# Turning movements, as seen by a driver keeping right
+RIGHT, STRAIGHT, LEFT = 0, 1, 2
+# Movements each lane may take at a node, by lane position on a multi-lane edge
+RIGHTMOST_LANE = (RIGHT, STRAIGHT)
+LEFTMOST_LANE = (STRAIGHT, LEFT)
+MIDDLE_LANE = (STRAIGHT,)
+
+
+def resolve_merges(source: np.ndarray, target: np.ndarray, free: np.ndarray, wait: np.ndarray, tick: int) -> np.ndarray:
+    """
+    Decide which cars waiting at a stop line cross into their next edge.
+
+    Car i waits at the end of lane slot source[i] (see LaneMap) to enter
+    lane slot target[i] (-1 for nowhere), whose first cell is free[i]
+    once this tick's movement along the lanes is done. Each target takes
+    at most one car. Cars competing for a target form its merge queue:
+    the lane that has lost the most merges in a row goes first (wait), and
+    lanes that have waited equally take turns by tick. The outcome
+    does not depend on the order of the cars. wait is updated in place.
+    Returns a boolean mask of the cars that cross.
+    """
+    win = np.zeros(len(source), dtype=bool)
+    if not len(source):
+        return win
+    ok = np.flatnonzero(free & (target >= 0))
+    if len(ok):
+        # One sort key: target, then longest wait, then this tick's turn.
+        n = len(wait)
+        w = wait[source[ok]]
+        turn = (source[ok] - tick) % n
+        key = (target[ok] * (int(w.max()) + 1) + (w.max() - w)) * n + turn
+        queue = ok[np.argsort(key)]
+        t = target[queue]
+        first = np.ones(len(queue), dtype=bool)
+        first[1:] = t[1:] != t[:-1]
+        win[queue[first]] = True
+    wait[source] += 1
+    wait[source[win]] = 0
+    return win
+
+
+def turn_between(edge_in, edge_out) -> int:
+    """The movement from edge_in onto edge_out at their shared node: RIGHT, STRAIGHT or LEFT (also U-turns)."""
+    node = edge_in.to_node
+    x, y = edge_in.points[-1] if edge_in.points else (edge_in.from_node.x, edge_in.from_node.y)
+    ax, ay = node.x - x, node.y - y
+    x, y = edge_out.points[0] if edge_out.points else (edge_out.to_node.x, edge_out.to_node.y)
+    bx, by = x - node.x, y - node.y
+    # y grows downwards, so a clockwise (right) turn has a positive cross product
+    angle = math.atan2(ax * by - ay * bx, ax * bx + ay * by)
+    if abs(angle) <= math.pi / 4:
+        return STRAIGHT
+    if angle > 0 and angle < 3 * math.pi / 4:
+        return RIGHT
+    return LEFT
+
+
+class LaneMap:
+    """
+    Lane numbering and lane-aware turning for a road network.
+
+    Every lane of every edge gets a slot, lane_base[edge] + lane, with
+    lane 0 the rightmost. Cars turning at random pick among the exits
+    their lane serves: the rightmost lane turns right or goes straight,
+    the leftmost lane turns left or goes straight, lanes in between go
+    straight, and a single lane serves every exit. A lane with none of
+    its movements available serves every exit. Cars enter the rightmost
+    lane after a right turn, the leftmost after a left turn, and keep
+    their lane (or the nearest one) going straight.
+    """
+
+    def __init__(self, model):
+        self.edges = list(model.edges.values())
+        n = len(self.edges)
+        self.lanes = np.array([e.lanes for e in self.edges], dtype=np.int64)
+        self.lane_base = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(self.lanes, out=self.lane_base[1:])
+        self.lane_count = int(self.lane_base[-1])
+
+        pair_key, pair_turn = [], []
+        # Per lane slot, the edge indices of the exits it serves
+        self.lane_exits: list = []
+        for edge in self.edges:
+            exits = edge.to_node.out_edges
+            turns = [turn_between(edge, out) for out in exits]
+            pair_key.extend(edge.index * n + out.index for out in exits)
+            pair_turn.extend(turns)
+            for lane in range(edge.lanes):
+                if edge.lanes == 1:
+                    allowed = None
+                elif lane == 0:
+                    allowed = RIGHTMOST_LANE
+                elif lane == edge.lanes - 1:
+                    allowed = LEFTMOST_LANE
+                else:
+                    allowed = MIDDLE_LANE
+                served = [out.index for out, t in zip(exits, turns) if allowed is None or t in allowed]
+                self.lane_exits.append(served or [out.index for out in exits])
+
+        order = np.argsort(pair_key)
+        self.pair_key = np.array(pair_key, dtype=np.int64)[order]
+        self.pair_turn = np.array(pair_turn, dtype=np.int64)[order]
+        self.exit_ptr = np.zeros(self.lane_count + 1, dtype=np.int64)
+        np.cumsum([len(x) for x in self.lane_exits], out=self.exit_ptr[1:])
+        self.exit_idx = np.array([e for x in self.lane_exits for e in x], dtype=np.int64)
+
+    def entry_lanes(self, edges: np.ndarray, lanes: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """The lane a car in lane lanes[i] of edges[i] enters targets[i] by (0 where the target is -1)."""
+        if not len(edges):
+            return np.zeros(0, dtype=np.int64)
+        to = np.maximum(targets, 0)
+        k = np.minimum(np.searchsorted(self.pair_key, edges * len(self.edges) + to), len(self.pair_key) - 1)
+        turn = self.pair_turn[k]
+        last = self.lanes[to] - 1
+        lane = np.where(turn == RIGHT, 0, np.where(turn == LEFT, last, np.minimum(lanes, last)))
+        return np.where(targets >= 0, lane, 0)
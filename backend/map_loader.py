@@ -2,7 +2,6 @@ from typing import List, Dict, Tuple
 from .core import Node, Edge
 from .model import SimulationModel
 import json
-import random
 
 class CityMapLoader:
     """
@@ -29,7 +28,8 @@ class CityMapLoader:
             "name": "City Name",
             "intersections": [
                 {"id": "A", "x": 100, "y": 100, "type": "signalized"},
-                {"id": "B", "x": 300, "y": 100, "type": "signalized"}
+                {"id": "B", "x": 300, "y": 100, "type": "signalized"},
+                {"id": "C", "x": 300, "y": 300, "type": "geometry", "sink": true}
             ],
             "roads": [
                 {"from": "A", "to": "B", "lanes": 2, "length": 200}
@@ -40,10 +40,11 @@ class CityMapLoader:
                 "yellow_duration": 5
             }
         }
+        
+        Dead-end intersections are sinks automatically; "sink": true marks
+        any other node where vehicles should leave the map.
         """
-        model.nodes.clear()
-        model.edges.clear()
-        model.cars.clear()
+        model.reset()
         
         for intersection in config.get("intersections", []):
             node_id = intersection["id"]
@@ -59,7 +60,9 @@ class CityMapLoader:
             lanes = road.get("lanes", 1)
             length = road.get("length", None)
             
-            model.add_edge(from_id, to_id, length)
+            model.add_edge(from_id, to_id, length, lanes=lanes)
+        
+        model.mark_sinks(i["id"] for i in config.get("intersections", []) if i.get("sink"))
         
         patterns = config.get("traffic_patterns", {})
         model.car_spawn_rate = patterns.get("spawn_rate", 0.05)
@@ -76,9 +79,7 @@ class CityMapLoader:
         Creates a Manhattan-style grid (rectangular blocks, not square).
         Typical of NYC-style layouts.
         """
-        model.nodes.clear()
-        model.edges.clear()
-        model.cars.clear()
+        model.reset()
         
         offset_x = 100
         offset_y = 100
@@ -106,12 +107,14 @@ class CityMapLoader:
                     model.add_edge(current, down, road_length, "vertical")
                     model.add_edge(down, current, road_length, "vertical")
         
+        # Cars leave the grid at its edge; there are no dead ends to do it
+        model.mark_sinks(f"m{r}_{c}" for r in range(rows) for c in range(cols)
+                         if r in (0, rows - 1) or c in (0, cols - 1))
+        
         edge_list = list(model.edges.keys())
         if edge_list:
             num_cars = min(12, max(5, len(edge_list) // 4))
-            for _ in range(num_cars):
-                edge_id = random.choice(edge_list)
-                model.spawn_car(edge_id)
+            model.spawn_initial_cars(num_cars)
     
     @staticmethod
     def create_roundabout(model: SimulationModel, center_x: int = 400, center_y: int = 300,
@@ -122,9 +125,7 @@ class CityMapLoader:
         """
         import math
         
-        model.nodes.clear()
-        model.edges.clear()
-        model.cars.clear()
+        model.reset()
         
         circle_nodes = []
         num_circle_nodes = num_exits * 2
@@ -142,6 +143,7 @@ class CityMapLoader:
             road_length = max(8, int((2 * math.pi * radius) / num_circle_nodes / 9))
             model.add_edge(circle_nodes[i], circle_nodes[next_i], road_length, "horizontal")
         
+        entry_ids = []
         for i in range(0, num_circle_nodes, num_circle_nodes // num_exits):
             angle = (2 * math.pi * i) / num_circle_nodes
             
@@ -149,23 +151,24 @@ class CityMapLoader:
             entry_x = center_x + entry_dist * math.cos(angle)
             entry_y = center_y + entry_dist * math.sin(angle)
             entry_id = f"entry_{i}"
+            entry_ids.append(entry_id)
             model.add_node(entry_id, int(entry_x), int(entry_y), type="intersection")
             
             exit_id = f"exit_{i}"
             exit_x = center_x + entry_dist * math.cos(angle)
             exit_y = center_y + entry_dist * math.sin(angle)
             
-            road_length = max(15, int(entry_dist - radius) / 9)
+            road_length = max(15, int((entry_dist - radius) / 9))
             model.add_edge(entry_id, circle_nodes[i], road_length, "horizontal")
             
             model.add_edge(circle_nodes[i], entry_id, road_length, "horizontal")
         
+        model.mark_sinks(entry_ids)
+        
         edge_list = list(model.edges.keys())
         if edge_list:
             num_cars = min(10, max(4, len(edge_list) // 3))
-            for _ in range(num_cars):
-                edge_id = random.choice(edge_list)
-                model.spawn_car(edge_id)
+            model.spawn_initial_cars(num_cars)
     
     @staticmethod
     def create_t_intersection(model: SimulationModel, center_x: int = 400, center_y: int = 300):
@@ -173,9 +176,7 @@ class CityMapLoader:
         Creates a T-intersection layout.
         Common in suburban areas.
         """
-        model.nodes.clear()
-        model.edges.clear()
-        model.cars.clear()
+        model.reset()
         
         model.add_node("center", center_x, center_y, type="intersection")
         model.add_node("north", center_x, center_y - 180, type="geometry")
@@ -196,9 +197,9 @@ class CityMapLoader:
         model.add_edge("center", "west", horizontal_length, "horizontal")
         model.add_edge("west", "center", horizontal_length, "horizontal")
         
+        model.mark_sinks()
+        
         edge_list = list(model.edges.keys())
         if edge_list:
             num_cars = min(8, len(edge_list))
-            for _ in range(num_cars):
-                edge_id = random.choice(edge_list)
-                model.spawn_car(edge_id)
\ No newline at end of file
+            model.spawn_initial_cars(num_cars)
\ No newline at end of file
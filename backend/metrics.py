@@ -0,0 +1,176 @@
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+# Upper bounds in seconds of the timing buckets, 10us doubling up to ~10s
+BUCKETS = tuple(10e-6 * 2 ** i for i in range(21))
+
+
+class Histogram:
+    """Counts of timings per BUCKETS bucket (the last one unbounded), with their sum."""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def merge(self, other: "Histogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (the largest bound past the last)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return BUCKETS[-1]
+
+    def summary(self) -> dict:
+        """Count, mean and p50/p95/p99 in milliseconds."""
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum * 1e3 / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.5) * 1e3, 3),
+            "p95_ms": round(self.quantile(0.95) * 1e3, 3),
+            "p99_ms": round(self.quantile(0.99) * 1e3, 3)
+        }
+
+
+class PhaseTimer:
+    """
+    A Histogram per named phase. Callers time a phase themselves with
+    perf_counter() and observe() the difference, which keeps the cost to
+    two clock reads and a bisect per phase.
+    """
+
+    def __init__(self):
+        self.phases: dict[str, Histogram] = {}
+
+    def observe(self, phase: str, seconds: float):
+        histogram = self.phases.get(phase)
+        if histogram is None:
+            histogram = self.phases[phase] = Histogram()
+        histogram.observe(seconds)
+
+    def merge(self, other: "PhaseTimer"):
+        for phase, histogram in other.phases.items():
+            self.phases.setdefault(phase, Histogram()).merge(histogram)
+
+    def summary(self) -> dict:
+        return {phase: h.summary() for phase, h in sorted(self.phases.items())}
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in labels.items()) + "}"
+
+
+def prometheus_text(timings: list, counters: dict, gauges: dict) -> str:
+    """
+    The Prometheus text exposition of phase timings, counters and gauges.
+    timings is a list of (labels, PhaseTimer); counters and gauges map a
+    metric name to (help, [(labels, value), ...]).
+    """
+    lines = [
+        "# HELP urbanflow_phase_seconds Time spent in each phase of the simulation and server loop.",
+        "# TYPE urbanflow_phase_seconds histogram"
+    ]
+    for labels, timer in timings:
+        for phase, h in sorted(timer.phases.items()):
+            base = {**labels, "phase": phase}
+            seen = 0
+            for bound, n in zip(BUCKETS, h.counts):
+                seen += n
+                lines.append(f"urbanflow_phase_seconds_bucket{_labels({**base, 'le': f'{bound:.6g}'})} {seen}")
+            lines.append(f"urbanflow_phase_seconds_bucket{_labels({**base, 'le': '+Inf'})} {h.count}")
+            lines.append(f"urbanflow_phase_seconds_sum{_labels(base)} {h.sum:.9g}")
+            lines.append(f"urbanflow_phase_seconds_count{_labels(base)} {h.count}")
+    for kind, metrics in (("counter", counters), ("gauge", gauges)):
+        for name, (help, samples) in metrics.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def summarize(timings: list, counters: dict, gauges: dict) -> dict:
+    """The prometheus_text() inputs as JSON: phase summaries per process, counter totals, gauges by label."""
+    phases = {}
+    for labels, timer in timings:
+        phases[",".join(str(v) for v in labels.values())] = timer.summary()
+    return {
+        "phases": phases,
+        "counters": {name: sum(v for _, v in samples) for name, (_, samples) in counters.items()},
+        "gauges": {
+            name: {",".join(str(v) for v in labels.values()): value for labels, value in samples}
+            for name, (_, samples) in gauges.items()
+        }
+    }
+
+
+class Sampler:
+    """
+    A sampling profiler over every thread of this process. While running,
+    a daemon thread records the stack of each other thread every interval
+    seconds; folded() returns them as "outer;...;inner count" lines, the
+    input of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self):
+        self.stacks = Counter()
+        self.samples = 0
+        self.thread = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds: float, interval: float = 0.005):
+        """Sample for seconds, discarding the previous profile. Raises RuntimeError if already running."""
+        if self.running:
+            raise RuntimeError("A profile is already being taken")
+        self.stacks = Counter()
+        self.samples = 0
+        self.thread = threading.Thread(target=self._run, args=(seconds, interval), name="sampler", daemon=True)
+        self.thread.start()
+
+    def _run(self, seconds: float, interval: float):
+        me = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(interval)
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
@@ -1,15 +1,31 @@
-import random
+from bisect import bisect_left
+from time import perf_counter
+import numpy as np
 from typing import List, Dict
-from .core import Node, Edge, Car
+from .core import Node, Edge, Car, CarPool
+from .junctions import LaneMap, resolve_merges
+from .metrics import PhaseTimer
+from .routing import Demand, Rerouter, Router
+from .signals import DEFAULT_CONTROL, SignalController, SignalPlan, green_wave
+from .snapshot import restore as restore_snapshot, snapshot as take_snapshot
+from .spatial import EdgeIndex
+from .stats import TrafficStats
+from .vector_engine import VectorEngine
+
+ENGINES = ("python", "numpy")
+# Independent random streams, so that e.g. spawning more cars leaves the
+# slowdown draws of the cars already there unchanged
+RNG_STREAMS = ("spawn", "slowdown", "routing")
 
 class SimulationModel:
-    def __init__(self):
+    def __init__(self, engine: str = "python", seed: int = None, max_cars: int = 10000):
         self.nodes: Dict[str, Node] = {}
         self.edges: Dict[str, Edge] = {}
-        self.cars: List[Car] = []
+        self.pool = CarPool(max_cars)
+        self.cars: List[Car] = self.pool.active
         self.tick_count = 0
+        self.next_car_id = 0
         self.running = False
-        self.traffic_light_interval = 30
         
         self.p_slowdown = 0.3
         self.max_v_global = 5
@@ -17,14 +33,176 @@ class SimulationModel:
         
         self.light_green_duration = 30
         self.light_yellow_duration = 5
+        # Node id -> SignalPlan for signals not on their default plan
+        self.signal_plans: Dict[str, SignalPlan] = {}
+        self.signal_control = dict(DEFAULT_CONTROL)
+        # Running speed, density and flow aggregates, loop detectors and history
+        self.stats = TrafficStats()
+        # Time spent in each phase of step(); hosts may share one between models
+        self.timings = PhaseTimer()
+        self._merge_wait: np.ndarray = None
+        self._lane_map: LaneMap = None
+        self._edge_index: EdgeIndex = None
+        self._signals: SignalController = None
+        
+        self.reseed(seed)
+        self.demand: Demand = None
+        self.rerouter: Rerouter = None
+        self.trips = {"spawned": 0, "completed": 0, "dropped": 0, "rerouted": 0}
+        # Cache key of the map this graph was built from, if it came from one
+        self.map_key = None
+        self._router: Router = None
+        self.engine = "python"
+        self._vector: VectorEngine = None
+        self.set_engine(engine)
+
+    def reseed(self, seed: int = None):
+        """Restart every random stream from seed (fresh entropy for None)."""
+        self.seed = seed
+        sequences = np.random.SeedSequence(seed).spawn(len(RNG_STREAMS))
+        self.rngs = {name: np.random.default_rng(s) for name, s in zip(RNG_STREAMS, sequences)}
+
+    def set_engine(self, engine: str):
+        """Switch between the object-based ("python") and array-based ("numpy") step."""
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+        self.sync()
+        self._vector = VectorEngine(self) if engine == "numpy" else None
+        self.engine = engine
+
+    def sync(self):
+        """Make Car objects and Edge.cells reflect the current engine state."""
+        if self._vector is not None:
+            self._vector.flush()
+
+    def _invalidate(self):
+        self._router = None
+        self._lane_map = None
+        self._edge_index = None
+        self._signals = None
+        self._merge_wait = None
+        if self._vector is not None:
+            self._vector.invalidate()
+
+    @property
+    def router(self) -> Router:
+        """Shortest-path tables for the current graph, built on first use."""
+        if self._router is None:
+            self._router = Router(self)
+        return self._router
+
+    @property
+    def lane_map(self) -> LaneMap:
+        if self._lane_map is None:
+            self._lane_map = LaneMap(self)
+        return self._lane_map
+
+    @property
+    def edge_index(self) -> EdgeIndex:
+        """Spatial index of the edges, for viewport queries."""
+        if self._edge_index is None:
+            self._edge_index = EdgeIndex(self)
+        return self._edge_index
+
+    @property
+    def signals(self) -> SignalController:
+        if self._signals is None:
+            self._signals = SignalController(self, self.tick_count)
+        return self._signals
+
+    def set_signal_plan(self, node_id: str, plan: SignalPlan):
+        """Run node_id's signal on plan from now on, or its default plan for None. Returns the plan."""
+        node = self.nodes.get(node_id)
+        if node is None or node.type != "intersection":
+            raise ValueError(f"No signal at node: {node_id}")
+        if plan is None:
+            self.signal_plans.pop(node_id, None)
+            plan = SignalPlan.two_phase(node.green_duration, node.green_duration, node.yellow_duration)
+        else:
+            self.signal_plans[node_id] = plan
+        if self._signals is not None:
+            self._signals.set_plan(self._signals.nodes.index(node), plan)
+        return plan
+
+    def merge_wait(self) -> np.ndarray:
+        """Per lane slot, the merges its stop line has lost in a row (see resolve_merges)."""
+        if self._merge_wait is None:
+            self._merge_wait = np.zeros(self.lane_map.lane_count, dtype=np.int64)
+        return self._merge_wait
+
+    def set_signal_control(self, mode: str, **settings):
+        """Run every signal in mode ("fixed", "actuated" or "max_pressure"); see SignalController.configure()."""
+        unknown = set(settings) - set(DEFAULT_CONTROL)
+        if unknown:
+            raise ValueError(f"Unknown signal control settings: {sorted(unknown)}")
+        control = {**self.signal_control, **settings, "mode": mode}
+        self.signals.configure(control)
+        self.signal_control = control
+
+    def set_light_timing(self, green: int, yellow: int = None):
+        """Change the default plan's green (and yellow) time at every signal."""
+        self.light_green_duration = int(green)
+        if yellow is not None:
+            self.light_yellow_duration = int(yellow)
+        for node in self.nodes.values():
+            node.green_duration = self.light_green_duration
+            node.yellow_duration = self.light_yellow_duration
+        self._signals = None
+
+    def apply_green_wave(self, direction: str = "ew") -> int:
+        """Offset the signal plans into a green wave along the grid; returns the signals re-timed."""
+        plans = green_wave(self, direction)
+        self.signal_plans.update(plans)
+        self._signals = None
+        return len(plans)
+
+    def default_zones(self) -> list:
+        """Trip ends when none are given: the sinks, else the intersections, else every node."""
+        for zones in (
+            [n.id for n in self.nodes.values() if n.sink],
+            [n.id for n in self.nodes.values() if n.type == "intersection"]
+        ):
+            if len(zones) >= 2:
+                return zones
+        return list(self.nodes)
+
+    def set_demand(self, zones: list = None, matrix=None, rate: float = 0.5):
+        """
+        Replace random spawning and turning with routed trips between zone
+        nodes, drawn from an OD matrix (uniform if None). zones=None uses
+        default_zones(). Tables for every zone are built up front.
+        """
+        zones = self.default_zones() if zones is None else list(zones)
+        unknown = [z for z in zones if z not in self.nodes]
+        if unknown:
+            raise ValueError(f"Unknown zone nodes: {unknown[:5]}")
+        demand = Demand([self.nodes[z].index for z in zones], matrix, rate)
+        self.router.prepare(demand.zones)
+        self.demand = demand
+
+    def clear_demand(self):
+        self.demand = None
+
+    def set_rerouting(self, enabled: bool, interval: int = 50):
+        """Re-route trips around congestion every interval ticks, or stop doing so."""
+        if self.rerouter is not None and not enabled:
+            # Back to free-flow costs
+            self._router = None
+            if self.demand is not None:
+                self.router.prepare(self.demand.zones)
+        self.rerouter = Rerouter(interval) if enabled else None
 
     def add_node(self, id: str, x: float, y: float, type: str = "intersection"):
+        self._invalidate()
         node = Node(id, x, y, type)
+        node.index = len(self.nodes)
         node.green_duration = self.light_green_duration
         node.yellow_duration = self.light_yellow_duration
         self.nodes[id] = node
 
-    def add_edge(self, from_id: str, to_id: str, length: int = None, direction: str = None):
+    def add_edge(self, from_id: str, to_id: str, length: int = None, direction: str = None, points: list = None,
+                 lanes: int = 1):
+        self._invalidate()
         id = f"{from_id}-{to_id}"
         from_node = self.nodes[from_id]
         to_node = self.nodes[to_id]
@@ -38,17 +216,17 @@ class SimulationModel:
             dist = ((to_node.x - from_node.x)**2 + (to_node.y - from_node.y)**2)**0.5
             length = max(5, int(dist / 9))
             
-        edge = Edge(id, from_node, to_node, length, self.max_v_global, direction)
+        edge = Edge(id, from_node, to_node, length, self.max_v_global, direction, points, lanes)
+        edge.index = len(self.edges)
         self.edges[id] = edge
+        self.stats.add_edge(length, edge.lanes)
         self.nodes[from_id].out_edges.append(edge)
         self.nodes[to_id].in_edges.append(edge)
         return edge
     
     def create_city_grid(self, rows: int = 4, cols: int = 4, spacing: int = 180):
         """Generate a city grid with intersections and bidirectional roads"""
-        self.nodes.clear()
-        self.edges.clear()
-        self.cars.clear()
+        self.reset()
         
         offset_x = 80
         offset_y = 80
@@ -82,193 +260,347 @@ class SimulationModel:
                     self.add_edge(current, down, road_length, "vertical")
                     self.add_edge(down, current, road_length, "vertical")
         
-        edge_list = list(self.edges.keys())
-        for _ in range(min(8, len(edge_list))):
-            if edge_list:
-                edge_id = random.choice(edge_list)
-                self.spawn_car(edge_id)
+        # Cars leave the grid at its edge; there are no dead ends to do it
+        self.mark_sinks(f"n{r}_{c}" for r in range(rows) for c in range(cols)
+                        if r in (0, rows - 1) or c in (0, cols - 1))
+        self.spawn_initial_cars(min(8, len(self.edges)))
     
     def update_traffic_lights(self):
-        """Update traffic light states for all intersections"""
-        for node in self.nodes.values():
-            if node.type != "intersection":
-                continue
-            
-            node.signal_timer += 1
-            
-            if node.signal_state_ns == "green":
-                if node.signal_timer >= node.green_duration:
-                    node.signal_state_ns = "yellow"
-                    node.signal_timer = 0
-            elif node.signal_state_ns == "yellow":
-                if node.signal_timer >= node.yellow_duration:
-                    node.signal_state_ns = "red"
-                    node.signal_state_ew = "green"
-                    node.signal_timer = 0
-            elif node.signal_state_ns == "red":
-                if node.signal_state_ew == "red":
-                    node.signal_state_ns = "green"
-                    node.signal_timer = 0
-            
-            if node.signal_state_ew == "green":
-                if node.signal_timer >= node.green_duration:
-                    node.signal_state_ew = "yellow"
-                    node.signal_timer = 0
-            elif node.signal_state_ew == "yellow":
-                if node.signal_timer >= node.yellow_duration:
-                    node.signal_state_ew = "red"
-                    node.signal_state_ns = "green"
-                    node.signal_timer = 0
+        """Move on the signals whose phase ends this tick."""
+        self.signals.advance(self.tick_count)
     
     def spawn_random_cars(self):
         """Randomly spawn cars based on spawn rate"""
-        if random.random() < self.car_spawn_rate:
-            edge_list = list(self.edges.keys())
-            if edge_list:
-                edge_id = random.choice(edge_list)
-                self.spawn_car(edge_id)
+        if self.demand is not None:
+            self.spawn_trips()
+            return
+        rng = self.rngs["spawn"]
+        if rng.random() < self.car_spawn_rate and self.edges:
+            edges = self.lane_map.edges
+            self.spawn_car(edges[rng.integers(len(edges))].id)
 
-    def spawn_car(self, edge_id: str):
+    def spawn_initial_cars(self, count: int):
+        """Try to start count cars on edges drawn from the spawn stream."""
+        edges = self.lane_map.edges
+        if not edges:
+            return
+        for i in self.rngs["spawn"].integers(len(edges), size=count).tolist():
+            self.spawn_car(edges[i].id)
+
+    def spawn_trips(self):
+        """Start this tick's trips from the demand, each on the first edge of its route."""
+        origins, dests = self.demand.sample(self.rngs["spawn"])
+        if not len(origins):
+            return
+        first, _ = self.router.assign(origins, dests)
+        edges = self.router.edges
+        for e, dest in zip(first.tolist(), dests.tolist()):
+            car = self.spawn_car(edges[e].id, dest) if e >= 0 else None
+            if car is None:
+                self.trips["dropped"] += 1
+            else:
+                self.trips["spawned"] += 1
+
+    def spawn_car(self, edge_id: str, dest: int = -1) -> Car | None:
         edge = self.edges.get(edge_id)
         if not edge:
-            return
+            return None
         
-        if edge.cells[0] is None:
-            car = Car(f"car_{len(self.cars)}_{self.tick_count}", velocity=0, max_v=self.max_v_global)
-            car.current_edge = edge
-            car.position = 0
-            edge.cells[0] = car
-            self.cars.append(car)
+        if self._vector is not None and self._vector.active:
+            return self._vector.spawn_car(edge, dest)
+        
+        for lane, cells in enumerate(edge.cells):
+            if cells[0] is None:
+                car = self._make_car(edge, dest, lane)
+                if car:
+                    cells[0] = car
+                return car
+        return None
+
+    def _make_car(self, edge: Edge, dest: int = -1, lane: int = 0) -> Car | None:
+        """Take a car from the pool and place it at the start of a lane of edge (None if the pool is full)."""
+        car = self.pool.acquire()
+        if car is None:
+            return None
+        car.id = self.next_car_id
+        self.next_car_id += 1
+        car.velocity = 0
+        car.max_v = self.max_v_global
+        car.current_edge = edge
+        car.position = 0
+        car.lane = lane
+        car.dest = dest
+        car.entered = self.tick_count
+        return car
+
+    def mark_sinks(self, node_ids=()):
+        """Mark dead-end nodes, plus any given ids, as sinks where cars leave the map."""
+        for node in self.nodes.values():
+            neighbors = {e.to_node.id for e in node.out_edges}
+            neighbors.update(e.from_node.id for e in node.in_edges)
+            node.sink = len(neighbors) <= 1
+        for node_id in node_ids:
+            if node_id in self.nodes:
+                self.nodes[node_id].sink = True
+        self._invalidate()
 
     def step(self):
         self.tick_count += 1
+        timings = self.timings
+        started = perf_counter()
         
         self.update_traffic_lights()
+        t = perf_counter()
+        timings.observe("signals", t - started)
         self.spawn_random_cars()
+        self.stats.fit(len(self.edges))
+        if self.rerouter is not None:
+            self.rerouter.fit(len(self.edges))
+        
+        # One slowdown and one turn draw per car, indexed by car rather than
+        # by visiting order, so every engine consumes the stream identically.
+        u_slow = self.rngs["slowdown"].random(len(self.cars))
+        u_turn = self.rngs["routing"].random(len(self.cars))
+        moved = perf_counter()
+        timings.observe("spawn", moved - t)
+        
+        if self._vector is not None:
+            self._vector.step(u_slow, u_turn)
+        else:
+            self._step_python(u_slow.tolist(), u_turn.tolist())
+        self.stats.end_tick(self.tick_count, len(self.cars))
+        t = perf_counter()
+        timings.observe("move", t - moved)
         
-        moved_cars = set()
+        if self.rerouter is not None and self.demand is not None:
+            self.trips["rerouted"] += self.rerouter.step(self)
+            timings.observe("reroute", perf_counter() - t)
+        timings.observe("step", perf_counter() - started)
+
+    def _step_python(self, u_slow: List[float], u_turn: List[float]):
+        retired = []
+        waiting = []
+        speed = 0
+        self._change_lanes()
         
+        # Phase 1: cars move along their own lane only. A leader at a green
+        # stop line leaves the map, or picks its next edge and waits there;
+        # followers see it stopped at the end either way.
         for edge in self.edges.values():
-            edge_cars = [c for c in edge.cells if c is not None]
-            edge_cars.sort(key=lambda c: c.position, reverse=True)
-            
-            for i, car in enumerate(edge_cars):
-                if car.id in moved_cars:
-                    continue
+            for cells in edge.cells:
+                lane_cars = [c for c in cells if c is not None]
+                lane_cars.reverse()
+                ahead = None
                 
-                try:
-                    gap = 1000
-                    
-                    if i > 0:
-                        car_ahead = edge_cars[i-1]
-                        gap = car_ahead.position - car.position - 1
-                    else:
-                        dist_to_end = edge.length - 1 - car.position
-                        
-                        if dist_to_end <= 3:
+                for car in lane_cars:
+                    try:
+                        if ahead is None:
+                            gap = edge.length - 1 - car.position
                             to_node = edge.to_node
-                            can_proceed = self._can_proceed_through_intersection(edge, to_node)
-                            
-                            if not can_proceed:
-                                gap = min(gap, dist_to_end)
-                            elif dist_to_end == 0:
-                                next_edge = self._pick_next_edge(edge)
-                                if next_edge and next_edge.cells[0] is None:
-                                    edge.cells[car.position] = None
-                                    next_edge.cells[0] = car
-                                    car.current_edge = next_edge
-                                    car.position = 0
-                                    car.velocity = min(1, car.velocity)
-                                    moved_cars.add(car.id)
-                                    continue
+                            if gap == 0 and self._can_proceed_through_intersection(edge, to_node):
+                                if to_node.sink or car.dest == to_node.index:
+                                    if car.dest == to_node.index:
+                                        self.trips["completed"] += 1
+                                    if self.rerouter is not None:
+                                        self.rerouter.record(edge.index, self.tick_count - car.entered)
+                                    self.stats.cross(edge.index)
+                                    cells[car.position] = None
+                                    retired.append(car)
                                 else:
-                                    gap = 0
-                            else:
-                                gap = dist_to_end
+                                    waiting.append((car, edge, self._pick_next_edge(edge, u_turn[car.index], car.dest, car.lane)))
+                                ahead = car.position
+                                continue
                         else:
-                            gap = dist_to_end
-                    
-                    if car.velocity < car.max_v:
-                        car.velocity += 1
-                    
-                    if car.velocity > gap:
-                        car.velocity = gap
+                            gap = ahead - car.position - 1
                         
-                    if car.velocity > 0 and random.random() < self.p_slowdown:
-                        car.velocity -= 1
-                    
-                    car.velocity = max(0, car.velocity)
-                    
-                    if car.velocity > 0:
-                        edge.cells[car.position] = None
-                        new_pos = car.position + car.velocity
-                        new_pos = min(new_pos, len(edge.cells) - 1)
-                        car.position = new_pos
-                        edge.cells[car.position] = car
+                        if car.velocity < car.max_v:
+                            car.velocity += 1
+                        
+                        if car.velocity > gap:
+                            car.velocity = gap
+                            
+                        if car.velocity > 0 and u_slow[car.index] < self.p_slowdown:
+                            car.velocity -= 1
+                        
+                        car.velocity = max(0, car.velocity)
+                        
+                        if car.velocity > 0:
+                            cells[car.position] = None
+                            car.position = min(car.position + car.velocity, len(cells) - 1)
+                            cells[car.position] = car
+                        speed += car.velocity
+                        ahead = car.position
                     
-                    moved_cars.add(car.id)
-                
-                except Exception as e:
-                    print(f"Error moving car {car.id}: {e}")
-                    edge.cells[car.position] = None
-                    if car in self.cars:
-                        self.cars.remove(car)
-
-    def _pick_next_edge(self, current_edge: Edge) -> Edge | None:
-        out_edges = current_edge.to_node.out_edges
-        if not out_edges:
+                    except Exception as e:
+                        print(f"Error moving car {car.id}: {e}")
+                        cells[car.position] = None
+                        retired.append(car)
+        
+        # Phase 2: waiting leaders cross into lanes whose first cell is free.
+        if waiting:
+            lanes = self.lane_map
+            edges = np.array([edge.index for _, edge, _ in waiting])
+            source = lanes.lane_base[edges] + np.array([car.lane for car, _, _ in waiting])
+            target = np.array([-1 if nxt is None else nxt.index for _, _, nxt in waiting])
+            entry = lanes.entry_lanes(edges, source - lanes.lane_base[edges], target).tolist()
+            crossed = resolve_merges(
+                source,
+                np.where(target >= 0, lanes.lane_base[target] + entry, -1),
+                np.array([nxt is not None and nxt.cells[lane][0] is None for (_, _, nxt), lane in zip(waiting, entry)]),
+                self.merge_wait(), self.tick_count
+            )
+            for (car, edge, next_edge), lane, won in zip(waiting, entry, crossed.tolist()):
+                if not won:
+                    car.velocity = 0
+                    continue
+                if self.rerouter is not None:
+                    self.rerouter.record(edge.index, self.tick_count - car.entered)
+                self.stats.cross(edge.index)
+                car.entered = self.tick_count
+                edge.cells[car.lane][car.position] = None
+                next_edge.cells[lane][0] = car
+                car.current_edge = next_edge
+                car.position = 0
+                car.lane = lane
+                car.velocity = min(1, car.velocity)
+                speed += car.velocity
+        self.stats.velocity_sum = speed
+        
+        # Highest slot first, so the pool's swap-removes don't depend on edge order.
+        for car in sorted(retired, key=lambda c: c.index, reverse=True):
+            self.pool.release(car)
+
+    def _change_lanes(self):
+        """
+        Symmetric lane changing, decided for every car before any moves.
+        A car changes lane when the car ahead would slow it down, the
+        other lane has more room ahead, its cell there is empty and the
+        nearest car behind in it is at least max_v_global cells back.
+        Changes go left on even ticks and right on odd ones, so no two
+        cars ever aim for the same cell.
+        """
+        step = 1 if self.tick_count % 2 == 0 else -1
+        lookback = self.max_v_global
+        moves = []
+        for edge in self.edges.values():
+            if edge.lanes == 1:
+                continue
+            occupied = [[p for p, c in enumerate(cells) if c is not None] for cells in edge.cells]
+            for lane, cells in enumerate(edge.cells):
+                to = lane + step
+                if not 0 <= to < edge.lanes:
+                    continue
+                own, theirs = occupied[lane], occupied[to]
+                for i, pos in enumerate(own):
+                    car = cells[pos]
+                    gap = (own[i + 1] if i + 1 < len(own) else edge.length) - pos - 1
+                    if gap >= min(car.velocity + 1, car.max_v) or edge.cells[to][pos] is not None:
+                        continue
+                    k = bisect_left(theirs, pos)
+                    other_gap = (theirs[k] if k < len(theirs) else edge.length) - pos - 1
+                    back = pos - theirs[k - 1] - 1 if k else lookback
+                    if other_gap > gap and back >= lookback:
+                        moves.append((edge, car, to))
+        for edge, car, to in moves:
+            edge.cells[car.lane][car.position] = None
+            edge.cells[to][car.position] = car
+            car.lane = to
+
+    def _pick_next_edge(self, current_edge: Edge, u: float, dest: int = -1, lane: int = 0) -> Edge | None:
+        if dest >= 0:
+            e = self.router.next_edge_from(dest, current_edge.to_node.index)
+            if e >= 0:
+                return self.router.edges[e]
+        lanes = self.lane_map
+        exits = lanes.lane_exits[lanes.lane_base[current_edge.index] + lane]
+        if not exits:
             return None
-        return random.choice(out_edges)
+        return lanes.edges[exits[int(u * len(exits))]]
     
     def _can_proceed_through_intersection(self, edge: Edge, node: Node) -> bool:
         """Check if a car can proceed through an intersection based on traffic light"""
-        if node.type != "intersection":
-            return True
-        
-        from_node = edge.from_node
-        to_node = edge.to_node
-        
-        dx = to_node.x - from_node.x
-        dy = to_node.y - from_node.y
-        
-        if abs(dx) > abs(dy):
-            signal_state = node.signal_state_ew
-        else:
-            signal_state = node.signal_state_ns
-        
-        return signal_state == "green"
+        return self.signals.edge_green[edge.index]
     
+    def clear_vehicles(self):
+        """Remove all cars and restore signals, keeping the road network."""
+        if self._vector is not None:
+            self._vector.discard()
+        self.pool.clear()
+        self._signals = None
+        self._merge_wait = None
+        for edge in self.edges.values():
+            edge.cells = [[None] * edge.length for _ in range(edge.lanes)]
+        self.tick_count = 0
+        self.next_car_id = 0
+        self.stats.reset()
+        self.trips = dict.fromkeys(self.trips, 0)
+
     def reset(self):
+        if self._vector is not None:
+            self._vector.discard()
+        self._router = None
+        self._lane_map = None
+        self._edge_index = None
+        self.demand = None
+        self.rerouter = None
+        self.map_key = None
+        self._signals = None
+        self._merge_wait = None
+        self.signal_plans.clear()
         self.nodes.clear()
         self.edges.clear()
-        self.cars.clear()
+        self.pool.clear()
         self.tick_count = 0
+        self.next_car_id = 0
+        self.stats.clear()
+        self.trips = dict.fromkeys(self.trips, 0)
+
+    def snapshot(self) -> bytes:
+        """The full simulation state as a compact binary blob (see backend/snapshot.py)."""
+        return take_snapshot(self)
+
+    def restore(self, blob: bytes):
+        """Continue from a snapshot() blob; the run proceeds exactly as the original would."""
+        restore_snapshot(self, blob)
 
     def get_state(self):
+        self.sync()
         return {
             "tick": self.tick_count,
             "cars": [c.to_dict() for c in self.cars],
             "edges": [e.to_dict() for e in self.edges.values()],
             "nodes": [n.to_dict() for n in self.nodes.values()],
-            "lights": [
-                {"id": n.id, "ns": n.signal_state_ns, "ew": n.signal_state_ew}
-                for n in self.nodes.values()
-                if n.type == "intersection"
-            ]
+            "lights": self.get_lights()
         }
 
-    def get_statistics(self):
+    def get_lights(self):
+        return self.signals.lights()
+
+    def car_columns(self) -> np.ndarray:
+        """Car state as an (n, 5) int array of id, edge index, position, velocity, lane."""
+        if self._vector is not None and self._vector.active:
+            return self._vector.columns()
         if not self.cars:
-            return {"speed": 0, "density": 0, "flow": 0, "vehicleCount": 0}
-        
-        avg_speed = sum(c.velocity for c in self.cars) / len(self.cars)
-        total_length = sum(e.length for e in self.edges.values())
-        density = len(self.cars) / total_length if total_length > 0 else 0
-        flow = density * avg_speed * 10
-        
-        return {
-            "speed": abs(round(avg_speed, 2)),
-            "density": abs(round(density, 3)),
-            "flow": abs(round(flow, 3)),
-            "vehicleCount": len(self.cars)
-        }
\ No newline at end of file
+            return np.zeros((0, 5), dtype=np.int64)
+        return np.array(
+            [(c.id, c.current_edge.index, c.position, c.velocity, c.lane) for c in self.cars],
+            dtype=np.int64
+        )
+
+    def car_dests(self) -> np.ndarray:
+        """Destination node index of each car, in car_columns() order (-1 for random turns)."""
+        if self._vector is not None and self._vector.active:
+            return self._vector.car_dest[:self._vector.n].astype(np.int64)
+        return np.array([c.dest for c in self.cars], dtype=np.int64)
+
+    def get_statistics(self):
+        stats = self.stats.summary(self.tick_count, len(self.cars))
+        stats["queued"] = self.signals.queued()
+        if self.demand is not None:
+            stats.update({
+                "tripsSpawned": self.trips["spawned"],
+                "tripsCompleted": self.trips["completed"],
+                "tripsDropped": self.trips["dropped"],
+                "tripsRerouted": self.trips["rerouted"]
+            })
+        return stats
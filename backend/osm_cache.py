@@ -0,0 +1,201 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from .model import SimulationModel
+
+logger = logging.getLogger("UrbanFlow")
+
+# Bump whenever OSMGenerator builds a different graph from the same data,
+# so cached graphs from older parsers are rebuilt from the raw response.
+GRAPH_VERSION = 2
+
+NODE_TYPES = ("intersection", "geometry")
+DIRECTIONS = ("horizontal", "vertical")
+
+
+class OSMCache:
+    """
+    Content-addressed on-disk cache of Overpass responses and built graphs.
+
+    Entries are keyed on the bounds (rounded to ~1 m) and the query text.
+    Each key can have three files:
+    - the gzipped raw response, <key>.json.gz;
+    - the road network built from it, <key>.v<GRAPH_VERSION>.npz;
+    - the routing tables built for that network, <key>.v<GRAPH_VERSION>.routes.npz.
+
+    Entries older than ttl seconds are refetched, unless the cache is
+    offline. Offline, stale entries are still served and a miss is an
+    error. Whenever the directory grows past max_bytes, the least
+    recently used files are deleted. A file's mtime is its fetch time
+    and drives the TTL. Every hit sets its atime, which drives the LRU
+    eviction.
+    """
+
+    def __init__(self, directory: str = "osm_cache", ttl: float = 7 * 24 * 3600,
+                 max_bytes: int = 512 * 1024 * 1024, offline: bool = False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+
+    @staticmethod
+    def from_env():
+        return OSMCache(
+            directory=os.environ.get("URBANFLOW_OSM_CACHE", "osm_cache"),
+            ttl=float(os.environ.get("URBANFLOW_OSM_CACHE_TTL", 7 * 24 * 3600)),
+            max_bytes=int(os.environ.get("URBANFLOW_OSM_CACHE_BYTES", 512 * 1024 * 1024)),
+            offline=os.environ.get("URBANFLOW_OFFLINE", "") not in ("", "0")
+        )
+
+    @staticmethod
+    def key(bounds: dict, query: str) -> str:
+        box = [round(float(bounds[k]), 5) for k in ("south", "west", "north", "east")]
+        normalized = json.dumps([box, " ".join(query.split())])
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:32]
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def _graph_suffix(self) -> str:
+        return f".v{GRAPH_VERSION}.npz"
+
+    def _fresh(self, path: str) -> bool:
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return False
+        if time.time() - mtime > self.ttl and not self.offline:
+            return False
+        os.utime(path, (time.time(), mtime))
+        return True
+
+    def _write(self, path: str, write):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def open_raw(self, key: str):
+        """The cached response as a binary stream, or None on a miss."""
+        path = self._path(key, ".json.gz")
+        if not self._fresh(path):
+            return None
+        try:
+            return gzip.open(path, "rb")
+        except OSError:
+            return None
+
+    def discard_raw(self, key: str, reason):
+        path = self._path(key, ".json.gz")
+        logger.warning(f"Discarding unreadable cache entry {path}: {reason}")
+        self._remove(path)
+
+    def put_raw(self, key: str, source: str):
+        """Store the response at path source, compressing it as it is copied."""
+        def write(f):
+            with open(source, "rb") as src, gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6) as gz:
+                shutil.copyfileobj(src, gz, 1024 * 1024)
+        self._write(self._path(key, ".json.gz"), write)
+
+    def load_graph(self, key: str, model: SimulationModel) -> bool:
+        """Rebuild the model's map from a cached graph; False on a miss."""
+        path = self._path(key, self._graph_suffix())
+        if not self._fresh(path):
+            return False
+        try:
+            with np.load(path, allow_pickle=False) as g:
+                node_ids = g["node_ids"].tolist()
+                node_x = g["node_x"].tolist()
+                node_y = g["node_y"].tolist()
+                node_type = g["node_type"].tolist()
+                sinks = [node_ids[i] for i in np.flatnonzero(g["node_sink"]).tolist()]
+                point_ptr = g["edge_point_ptr"].tolist()
+                points = [tuple(p) for p in g["edge_points"].tolist()]
+                edges = zip(g["edge_from"].tolist(), g["edge_to"].tolist(),
+                            g["edge_length"].tolist(), g["edge_direction"].tolist(),
+                            zip(point_ptr, point_ptr[1:]))
+                model.reset()
+                for node_id, x, y, t in zip(node_ids, node_x, node_y, node_type):
+                    model.add_node(node_id, x, y, type=NODE_TYPES[t])
+                for a, b, length, d, (p0, p1) in edges:
+                    model.add_edge(node_ids[a], node_ids[b], length=length, direction=DIRECTIONS[d],
+                                   points=points[p0:p1])
+                model.mark_sinks(sinks)
+        except (OSError, KeyError, ValueError, IndexError) as e:
+            logger.warning(f"Discarding unreadable cache entry {path}: {e}")
+            self._remove(path)
+            model.reset()
+            return False
+        return True
+
+    def put_graph(self, key: str, model: SimulationModel):
+        nodes = list(model.nodes.values())
+        edges = list(model.edges.values())
+        point_ptr = np.zeros(len(edges) + 1, dtype=np.int64)
+        np.cumsum([len(e.points) for e in edges], out=point_ptr[1:])
+        arrays = {
+            "node_ids": np.array([n.id for n in nodes], dtype=str),
+            "node_x": np.array([n.x for n in nodes], dtype=np.float64),
+            "node_y": np.array([n.y for n in nodes], dtype=np.float64),
+            "node_type": np.array([NODE_TYPES.index(n.type) for n in nodes], dtype=np.uint8),
+            "node_sink": np.array([n.sink for n in nodes], dtype=bool),
+            "edge_from": np.array([e.from_node.index for e in edges], dtype=np.int32),
+            "edge_to": np.array([e.to_node.index for e in edges], dtype=np.int32),
+            "edge_length": np.array([e.length for e in edges], dtype=np.int32),
+            "edge_direction": np.array([DIRECTIONS.index(e.direction) for e in edges], dtype=np.uint8),
+            "edge_point_ptr": point_ptr,
+            "edge_points": np.array([p for e in edges for p in e.points], dtype=np.float64).reshape(-1, 2)
+        }
+        self._write(self._path(key, self._graph_suffix()), lambda f: np.savez_compressed(f, **arrays))
+
+    def load_routes(self, key: str, model: SimulationModel) -> bool:
+        """Give the model's router the cached tables for its graph; False on a miss."""
+        path = self._path(key, f".v{GRAPH_VERSION}.routes.npz")
+        if not self._fresh(path):
+            return False
+        try:
+            with np.load(path, allow_pickle=False) as arrays:
+                if model.router.load_arrays(arrays):
+                    return True
+        except (OSError, KeyError, ValueError, IndexError) as e:
+            logger.warning(f"Discarding unreadable cache entry {path}: {e}")
+        self._remove(path)
+        return False
+
+    def put_routes(self, key: str, model: SimulationModel):
+        arrays = model.router.arrays()
+        self._write(self._path(key, f".v{GRAPH_VERSION}.routes.npz"), lambda f: np.savez_compressed(f, **arrays))
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Delete least recently used files until the cache fits in max_bytes."""
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.is_file() and not e.name.endswith(".tmp")]
+        except FileNotFoundError:
+            return
+        stats = [(e.stat().st_atime, e.stat().st_size, e.path) for e in entries]
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import tempfile
+import threading
+import urllib.parse
+import urllib.request
+from typing import Callable
+
+logger = logging.getLogger("UrbanFlow")
+
+CHUNK_SIZE = 64 * 1024
+PROGRESS_EVERY = 512 * 1024
+HEAD_SIZE = 4096
+
+
+class FetchCancelled(Exception):
+    pass
+
+
+def _download(url: str, body: bytes, timeout: float, stop: threading.Event,
+              claim: threading.Lock, report: Callable[[dict], None]) -> str:
+    """
+    Blocking POST to one mirror, spooled to a temporary file whose path is
+    returned. Abandoned between chunks once stop is set; the first mirror
+    to finish sets stop itself, so only one file outlives the race.
+    """
+    req = urllib.request.Request(url, data=body)
+    req.add_header('User-Agent', 'UrbanFlow/1.0')
+    fd, path = tempfile.mkstemp(prefix="urbanflow-osm-", suffix=".json")
+    try:
+        with os.fdopen(fd, "wb") as out, urllib.request.urlopen(req, timeout=timeout) as response:
+            if response.status != 200:
+                raise Exception(f"HTTP {response.status} from {url}")
+            head = b""
+            received = 0
+            reported = 0
+            while True:
+                if stop.is_set():
+                    raise FetchCancelled(url)
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(head) < HEAD_SIZE:
+                    head += chunk[:HEAD_SIZE - len(head)]
+                out.write(chunk)
+                received += len(chunk)
+                if received - reported >= PROGRESS_EVERY:
+                    reported = received
+                    report({"stage": "downloading", "url": url, "bytes": received})
+        # Overpass reports errors as HTML or as JSON without elements; the
+        # full document is only checked when it is parsed.
+        if b'"elements"' not in head:
+            raise Exception(f"Invalid response from {url}")
+        with claim:
+            if stop.is_set():
+                raise FetchCancelled(url)
+            stop.set()
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def _discard(task: asyncio.Future):
+    if not task.cancelled() and task.exception() is None:
+        os.remove(task.result())
+
+
+def _in_thread(loop: asyncio.AbstractEventLoop, fn: Callable, *args) -> asyncio.Future:
+    """
+    Run fn on a daemon thread of its own and resolve the returned future on
+    loop. Unlike asyncio.to_thread, nothing joins the thread: a download
+    stuck in urlopen on a slow mirror must not hold up asyncio.run() or
+    interpreter exit once another mirror has won.
+    """
+    future = loop.create_future()
+
+    def resolve(ok: bool, value):
+        if future.done():
+            # The caller gave up; a file won after that is nobody's.
+            if ok:
+                os.remove(value)
+        elif ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def run():
+        try:
+            ok, value = True, fn(*args)
+        except BaseException as e:
+            ok, value = False, e
+        try:
+            loop.call_soon_threadsafe(resolve, ok, value)
+        except RuntimeError:
+            # The loop is closed, so no callback will remove the file.
+            if ok:
+                os.remove(value)
+
+    threading.Thread(target=run, name="overpass-fetch", daemon=True).start()
+    return future
+
+
+async def fetch_overpass(query: str, urls: list[str], timeout: float = 45,
+                         progress: Callable[[dict], None] | None = None) -> str:
+    """
+    POST the query to every mirror at once and return the path of a
+    temporary file holding the first valid response; the caller removes
+    it. The other downloads are told to stop, and so are all of them if
+    the caller is cancelled. progress, when given, is called on the event
+    loop with small status dicts.
+    """
+    loop = asyncio.get_running_loop()
+    body = urllib.parse.urlencode({'data': query}).encode('utf-8')
+    stop = threading.Event()
+    claim = threading.Lock()
+
+    def report(info):
+        if progress is not None:
+            loop.call_soon_threadsafe(progress, info)
+
+    pending = {
+        _in_thread(loop, _download, url, body, timeout, stop, claim, report): url
+        for url in urls
+    }
+    report({"stage": "fetching", "mirrors": len(urls)})
+    last_error = None
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                url = pending.pop(task)
+                try:
+                    path = task.result()
+                except Exception as e:
+                    logger.warning(f"Failed to fetch from {url}: {e}")
+                    report({"stage": "mirror_failed", "url": url, "error": str(e)})
+                    last_error = e
+                    continue
+                logger.info(f"Successfully fetched data from {url}")
+                report({"stage": "downloaded", "url": url, "bytes": os.path.getsize(path)})
+                return path
+    finally:
+        stop.set()
+        # A download that claimed the race after the caller gave up would
+        # otherwise leave its file behind.
+        for task in pending:
+            task.add_done_callback(_discard)
+    raise Exception(f"All map servers failed. Please try a smaller area or try again later. ({last_error})")
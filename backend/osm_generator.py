@@ -1,9 +1,13 @@
-import json
-import urllib.request
-import urllib.parse
+import asyncio
 import logging
 import math
+import os
 from .model import SimulationModel
+from .osm_cache import OSMCache
+from .osm_fetch import fetch_overpass
+from .osm_graph import RoadGraph
+from .osm_stream import iter_osm_elements
+from typing import Iterable
 
 logger = logging.getLogger("UrbanFlow")
 
@@ -19,18 +23,19 @@ class OSMGenerator:
         "https://z.overpass-api.de/api/interpreter",
         "https://maps.mail.ru/osm/tools/overpass/api/interpreter"
     ]
+    if os.environ.get("URBANFLOW_OVERPASS_URLS"):
+        OVERPASS_URLS = os.environ["URBANFLOW_OVERPASS_URLS"].split(",")
+    
+    cache = OSMCache.from_env()
     
     @staticmethod
-    def generate_from_bounds(model: SimulationModel, bounds: dict):
-        """
-        Fetch OSM data for the given bounding box and populate the model.
-        """
+    def build_query(bounds: dict) -> str:
         north = bounds['north']
         south = bounds['south']
         east = bounds['east']
         west = bounds['west']
         
-        query = f"""
+        return f"""
         [out:json][timeout:60];
         (
           way["highway"~"^(primary|secondary|tertiary|residential|unclassified)$"]
@@ -39,59 +44,115 @@ class OSMGenerator:
         (._;>;);
         out body;
         """
+    
+    @staticmethod
+    def generate_from_bounds(model: SimulationModel, bounds: dict):
+        """
+        Fetch OSM data for the given bounding box and populate the model.
+        A cached graph or response for the same box is used when present.
+        """
+        if OSMGenerator.load_cached(model, bounds):
+            return
+        if OSMGenerator.cache.offline:
+            raise Exception("No cached map data for this area and offline mode is on.")
+        path = asyncio.run(OSMGenerator.fetch(bounds))
+        try:
+            OSMGenerator.load_response(model, bounds, path)
+        finally:
+            os.remove(path)
+
+    @staticmethod
+    async def fetch(bounds: dict, progress=None) -> str:
+        """
+        Race the Overpass mirrors for this box without blocking the event
+        loop. Returns the path of a temporary file the caller must remove.
+        """
+        return await fetch_overpass(OSMGenerator.build_query(bounds), OSMGenerator.OVERPASS_URLS,
+                                    progress=progress)
+
+    @staticmethod
+    def load_cached(model: SimulationModel, bounds: dict) -> bool:
+        """Build the model from a cached graph or response; False on a miss."""
+        cache = OSMGenerator.cache
+        key = cache.key(bounds, OSMGenerator.build_query(bounds))
+        if cache.load_graph(key, model):
+            logger.info(f"Loaded road network from cache ({len(model.nodes)} nodes, {len(model.edges)} edges)")
+            model.map_key = key
+            if cache.load_routes(key, model):
+                logger.info(f"Loaded routing tables for {len(model.router.dests)} destinations from cache")
+            return True
         
-        data = urllib.parse.urlencode({'data': query}).encode('utf-8')
-        osm_data = None
-        last_error = None
-        
-        for url in OSMGenerator.OVERPASS_URLS:
-            try:
-                logger.info(f"Fetching map data from: {url}")
-                req = urllib.request.Request(url, data=data)
-                req.add_header('User-Agent', 'UrbanFlow/1.0')
-                
-                with urllib.request.urlopen(req, timeout=45) as response:
-                    if response.status == 200:
-                        content = response.read().decode('utf-8')
-                        try:
-                            osm_data = json.loads(content)
-                            if 'elements' in osm_data:
-                                logger.info(f"Successfully fetched data from {url}")
-                                break
-                            else:
-                                last_error = Exception(f"Invalid response from {url}")
-                        except json.JSONDecodeError:
-                            last_error = Exception(f"JSON Decode Error from {url}")
-                    else:
-                        last_error = Exception(f"HTTP {response.status} from {url}")
-                        
-            except Exception as e:
-                logger.warning(f"Failed to fetch from {url}: {e}")
-                last_error = e
-                continue
-        
-        if not osm_data:
-            raise Exception(f"All map servers failed. Please try a smaller area or try again later. ({last_error})")
-            
+        raw = cache.open_raw(key)
+        if raw is None:
+            return False
+        logger.info("Using cached map data")
+        try:
+            with raw:
+                OSMGenerator._build(model, bounds, iter_osm_elements(raw), key)
+        except (OSError, EOFError, ValueError) as e:
+            cache.discard_raw(key, e)
+            model.reset()
+            return False
+        return True
+
+    @staticmethod
+    def load_response(model: SimulationModel, bounds: dict, path: str):
+        """Build the model from an Overpass response saved at path, and cache both."""
+        cache = OSMGenerator.cache
+        key = cache.key(bounds, OSMGenerator.build_query(bounds))
+        with open(path, "rb") as f:
+            OSMGenerator._build(model, bounds, iter_osm_elements(f), key)
+        try:
+            cache.put_raw(key, path)
+        except OSError as e:
+            logger.warning(f"Could not cache map data: {e}")
+
+    @staticmethod
+    def load_file(model: SimulationModel, path: str, bounds: dict):
+        """
+        Import a local Overpass JSON or OSM XML file in one streaming pass.
+        bounds sets the projection and view, as for generate_from_bounds.
+        """
+        with open(path, "rb") as f:
+            OSMGenerator._build_from_elements(model, iter_osm_elements(f), bounds)
+
+    @staticmethod
+    def _build(model: SimulationModel, bounds: dict, elements: Iterable[dict], key: str):
         try:
-            OSMGenerator._parse_osm_data(model, osm_data, bounds)
+            OSMGenerator._build_from_elements(model, elements, bounds)
             logger.info("OSM data successfully loaded into simulation")
             
         except Exception as e:
             logger.error(f"Failed to parse OSM data: {e}")
             raise e
+        
+        model.map_key = key
+        try:
+            OSMGenerator.cache.put_graph(key, model)
+        except OSError as e:
+            logger.warning(f"Could not cache road network: {e}")
 
     @staticmethod
-    def _parse_osm_data(model: SimulationModel, data: dict, bounds: dict):
-        nodes_map = {}
-        
-        for element in data['elements']:
-            if element['type'] == 'node':
-                nodes_map[element['id']] = {
-                    'lat': element['lat'],
-                    'lon': element['lon']
-                }
-        
+    def save_routes(model: SimulationModel):
+        """Cache the routing tables built so far alongside the model's map."""
+        if model.map_key is None:
+            return
+        try:
+            OSMGenerator.cache.put_routes(model.map_key, model)
+        except OSError as e:
+            logger.warning(f"Could not cache routing tables: {e}")
+
+    @staticmethod
+    def _build_from_elements(model: SimulationModel, elements: Iterable[dict], bounds: dict):
+        """
+        Build the road network in one pass over a stream of OSM elements.
+
+        Nodes are projected as they arrive and merged with any node already
+        within snap_radius pixels, keeping only the merged node's index.
+        Ways are added to a RoadGraph, which then folds pass-through
+        nodes into polyline edges. Overpass emits nodes before ways; a way
+        naming a node not seen yet is held back until the stream ends.
+        """
         center_lat = (bounds['north'] + bounds['south']) / 2
         center_lon = (bounds['east'] + bounds['west']) / 2
         
@@ -108,81 +169,37 @@ class OSMGenerator:
             dy = (center_lat - lat) * lat_scale
             return 400 + dx * scale_pixels, 300 + dy * scale_pixels
 
-        model.nodes.clear()
-        model.edges.clear()
-        model.cars.clear()
-        
-        node_usage = {}
-        ways = [el for el in data['elements'] if el['type'] == 'way']
+        model.reset()
         
-        for way in ways:
-            for node_id in way['nodes']:
-                node_usage[node_id] = node_usage.get(node_id, 0) + 1
+        graph = RoadGraph(snap_radius=6)
+        # osm id -> snapped node index, or None when it falls outside the view
+        positions = {}
+        deferred = []
         
-        sim_nodes = {}
-        
-        for osm_id, usage_count in node_usage.items():
-            coords = nodes_map.get(osm_id)
-            if coords:
-                x, y = project(coords['lat'], coords['lon'])
-                
+        for element in elements:
+            if element['type'] == 'node':
+                x, y = project(element['lat'], element['lon'])
                 if -500 < x < 1300 and -400 < y < 1000:
-                    snap_resolution = 6
-                    snapped_x = round(x / snap_resolution) * snap_resolution
-                    snapped_y = round(y / snap_resolution) * snap_resolution
-                    
-                    sim_id = f"node_{int(snapped_x)}_{int(snapped_y)}"
-                    
-                    if sim_id not in model.nodes:
-                        node_type = "intersection" if usage_count >= 3 else "geometry"
-                        model.add_node(sim_id, snapped_x, snapped_y, type=node_type)
-                    
-                    sim_nodes[osm_id] = sim_id
-
-        for way in ways:
-            way_nodes = way['nodes']
-            if not way_nodes:
-                continue
-            
-            last_sim_node = None
-            
-            for osm_id in way_nodes:
-                if osm_id in sim_nodes:
-                    current_sim_node = sim_nodes[osm_id]
-                    
-                    if last_sim_node and last_sim_node != current_sim_node:
-                        n1 = model.nodes[last_sim_node]
-                        n2 = model.nodes[current_sim_node]
-                        
-                        dist = ((n1.x - n2.x)**2 + (n1.y - n2.y)**2)**0.5
-                        if dist >= 3:
-                            edge_id_forward = f"{last_sim_node}-{current_sim_node}"
-                            edge_id_backward = f"{current_sim_node}-{last_sim_node}"
-                            
-                            if edge_id_forward not in model.edges:
-                                model.add_edge(last_sim_node, current_sim_node)
-                            if edge_id_backward not in model.edges:
-                                model.add_edge(current_sim_node, last_sim_node)
-                    
-                    last_sim_node = current_sim_node
+                    positions[element['id']] = graph.points.snap(x, y)
                 else:
-                    last_sim_node = None
-
-        for node_id, node in model.nodes.items():
-            neighbors = set()
-            for edge in node.out_edges:
-                neighbors.add(edge.to_node.id)
-            for edge in node.in_edges:
-                neighbors.add(edge.from_node.id)
-            
-            degree = len(neighbors)
-            
-            if degree >= 3:
-                node.type = "intersection"
-                logger.info(f"Node {node_id} marked as intersection (degree={degree})")
-            else:
-                node.type = "geometry"
+                    positions[element['id']] = None
+            elif element['type'] == 'way':
+                way_nodes = element['nodes']
+                if not way_nodes:
+                    continue
+                if all(osm_id in positions for osm_id in way_nodes):
+                    graph.add_way([positions[osm_id] for osm_id in way_nodes])
+                else:
+                    deferred.append(way_nodes)
+        
+        for way_nodes in deferred:
+            graph.add_way([positions.get(osm_id) for osm_id in way_nodes])
+        
+        merged = len(graph.adjacent)
+        graph.simplify()
+        graph.build(model)
         
-        logger.info(f"Created {len(model.nodes)} nodes, {len(model.edges)} edges")
+        logger.info(f"Created {len(model.nodes)} nodes, {len(model.edges)} edges "
+                    f"(from {merged} road points)")
         intersections = sum(1 for n in model.nodes.values() if n.type == "intersection")
-        logger.info(f"Identified {intersections} intersections with traffic lights")
\ No newline at end of file
+        logger.info(f"Identified {intersections} intersections with traffic lights")
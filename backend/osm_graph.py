@@ -0,0 +1,154 @@
+import math
+
+from .model import SimulationModel
+
+
+class SpatialHash:
+    """
+    Merges points closer than radius into one representative.
+
+    Points are bucketed in square cells of side radius, so a lookup only
+    checks the 3x3 block around the point's cell. The first point to land
+    somewhere becomes the representative later nearby points snap to.
+    """
+
+    def __init__(self, radius: float):
+        self.radius = radius
+        self.cells: dict[tuple, list] = {}
+        self.x: list[float] = []
+        self.y: list[float] = []
+
+    def snap(self, x: float, y: float) -> int:
+        """Index of the representative within radius of (x, y), added if there is none."""
+        cx = math.floor(x / self.radius)
+        cy = math.floor(y / self.radius)
+        best = None
+        best_d2 = self.radius * self.radius
+        for i in range(cx - 1, cx + 2):
+            for j in range(cy - 1, cy + 2):
+                for rep in self.cells.get((i, j), ()):
+                    d2 = (self.x[rep] - x) ** 2 + (self.y[rep] - y) ** 2
+                    if d2 < best_d2:
+                        best, best_d2 = rep, d2
+        if best is not None:
+            return best
+        rep = len(self.x)
+        self.x.append(x)
+        self.y.append(y)
+        self.cells.setdefault((cx, cy), []).append(rep)
+        return rep
+
+
+class RoadGraph:
+    """
+    Undirected road network built from OSM ways before it becomes a model.
+
+    Nodes are SpatialHash representatives and every segment is a two-way
+    road. simplify() folds chains of degree-2 nodes into the polylines
+    of single edges, and build() writes the result into a model.
+    """
+
+    def __init__(self, snap_radius: float = 6):
+        self.points = SpatialHash(snap_radius)
+        self.adjacent: dict[int, set] = {}
+        self.boundary: set[int] = set()
+        self.chains: list[list[int]] = []
+
+    def add_way(self, nodes: list):
+        """Add one way given as snapped node indices, with None where it leaves the view."""
+        last = None
+        clipped = False
+        for node in nodes:
+            if node is None:
+                if last is not None:
+                    self.boundary.add(last)
+                last = None
+                clipped = True
+                continue
+            if clipped:
+                self.boundary.add(node)
+                clipped = False
+            self.adjacent.setdefault(node, set())
+            if last is not None and last != node:
+                self.adjacent[last].add(node)
+                self.adjacent[node].add(last)
+            last = node
+
+    def _is_anchor(self, node: int) -> bool:
+        return len(self.adjacent[node]) != 2 or node in self.boundary
+
+    def simplify(self):
+        """
+        Find the chains between anchors: intersections, dead ends, boundary
+        nodes and anything else that is not a plain pass-through point.
+        A chain whose ends are already joined, or that loops back to its
+        start, is cut at interior nodes so every edge id stays unique.
+        """
+        anchors = {n for n in self.adjacent if self._is_anchor(n)}
+        visited = set()
+        found = []
+
+        def collapse_from(start):
+            for first in sorted(self.adjacent[start]):
+                if (start, first) in visited:
+                    continue
+                chain = [start, first]
+                prev, node = start, first
+                while node not in anchors:
+                    prev, node = node, next(n for n in self.adjacent[node] if n != prev)
+                    chain.append(node)
+                for a, b in zip(chain, chain[1:]):
+                    visited.add((a, b))
+                    visited.add((b, a))
+                found.append(chain)
+
+        for start in sorted(anchors):
+            collapse_from(start)
+        # Rings with no anchor at all: pin one node and walk round.
+        for start in sorted(self.adjacent):
+            if any((start, n) not in visited for n in self.adjacent[start]):
+                anchors.add(start)
+                collapse_from(start)
+
+        # Shortest first, so plain segments (which are unique) never need cutting.
+        pairs = set()
+        self.chains = []
+
+        def emit(chain):
+            a, b = chain[0], chain[-1]
+            pair = (min(a, b), max(a, b))
+            if a != b and pair not in pairs:
+                pairs.add(pair)
+                self.chains.append(chain)
+                return
+            n = len(chain) - 1
+            cuts = [0, n // 3, 2 * n // 3, n] if a == b else [0, n // 2, n]
+            for i, j in zip(cuts, cuts[1:]):
+                emit(chain[i:j + 1])
+
+        for chain in sorted(found, key=len):
+            emit(chain)
+
+    def build(self, model: SimulationModel):
+        """Write the simplified network into model, which should be empty."""
+        xs, ys = self.points.x, self.points.y
+        ids = {}
+
+        def sim_node(node):
+            if node not in ids:
+                x, y = xs[node], ys[node]
+                ids[node] = f"node_{round(x)}_{round(y)}"
+                degree = len(self.adjacent[node])
+                model.add_node(ids[node], x, y, type="intersection" if degree >= 3 else "geometry")
+            return ids[node]
+
+        for chain in self.chains:
+            a, b = sim_node(chain[0]), sim_node(chain[-1])
+            # Cells over the whole polyline, counted as add_edge counts a straight road
+            dist = sum(math.hypot(xs[q] - xs[p], ys[q] - ys[p]) for p, q in zip(chain, chain[1:]))
+            length = max(5, int(dist / 9))
+            points = [(xs[n], ys[n]) for n in chain[1:-1]]
+            model.add_edge(a, b, length=length, points=points)
+            model.add_edge(b, a, length=length, points=points[::-1])
+
+        model.mark_sinks(ids[n] for n in self.boundary if n in ids)
@@ -0,0 +1,89 @@
+import io
+import json
+import xml.etree.ElementTree as ET
+from typing import BinaryIO, Iterator
+
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_osm_elements(f: BinaryIO) -> Iterator[dict]:
+    """
+    Yield OSM elements one at a time from an Overpass JSON response or an
+    OSM XML file, in file order, without loading the whole file.
+
+    Elements come out in Overpass JSON shape: nodes as
+    {"type": "node", "id", "lat", "lon"} and ways as
+    {"type": "way", "id", "nodes": [...]}. Other element types are skipped.
+    """
+    if not hasattr(f, "peek"):
+        f = io.BufferedReader(f)
+    if f.peek(64).lstrip()[:1] == b"<":
+        return _iter_xml(f)
+    return _iter_json(f)
+
+
+def _iter_json(f: BinaryIO) -> Iterator[dict]:
+    text = io.TextIOWrapper(f, encoding="utf-8")
+    decoder = json.JSONDecoder()
+    buf = ""
+    while True:
+        start = buf.find('"elements"')
+        if start >= 0:
+            break
+        chunk = text.read(CHUNK_SIZE)
+        if not chunk:
+            raise ValueError("No 'elements' array in OSM data")
+        buf = buf[-16:] + chunk
+
+    idx = start + len('"elements"')
+    opened = False
+    while True:
+        while idx < len(buf) and buf[idx] in " \t\r\n,:":
+            idx += 1
+        if idx >= len(buf):
+            buf = text.read(CHUNK_SIZE)
+            idx = 0
+            if not buf:
+                raise ValueError("OSM data ended inside the 'elements' array")
+            continue
+        if not opened:
+            if buf[idx] != "[":
+                raise ValueError("'elements' is not an array")
+            opened = True
+            idx += 1
+            continue
+        if buf[idx] == "]":
+            return
+        try:
+            element, end = decoder.raw_decode(buf, idx)
+        except json.JSONDecodeError:
+            chunk = text.read(CHUNK_SIZE)
+            if not chunk:
+                raise
+            buf = buf[idx:] + chunk
+            idx = 0
+            continue
+        idx = end
+        if element.get("type") in ("node", "way"):
+            yield element
+        if idx > CHUNK_SIZE:
+            buf = buf[idx:]
+            idx = 0
+
+
+def _iter_xml(f: BinaryIO) -> Iterator[dict]:
+    root = None
+    for event, el in ET.iterparse(f, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = el
+            continue
+        if el.tag == "node":
+            yield {"type": "node", "id": int(el.get("id")),
+                   "lat": float(el.get("lat")), "lon": float(el.get("lon"))}
+        elif el.tag == "way":
+            yield {"type": "way", "id": int(el.get("id")),
+                   "nodes": [int(nd.get("ref")) for nd in el.iter("nd")]}
+        else:
+            continue
+        root.clear()
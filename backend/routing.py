@@ -0,0 +1,328 @@
+import heapq
+import math
+
+import numpy as np
+
+EPSILON = 1e-9
+
+
+class Router:
+    """
+    Shortest-path next-hop tables over a model's road graph.
+
+    Each destination node gets one row: for every node, the out-edge that
+    starts the cheapest path to the destination (-1 where there is none)
+    and that path's cost. A row is built by one Dijkstra search backwards
+    from its destination, the first time a trip needs it, and is then
+    shared by every trip to that node. Lookups, single or batched, are
+    plain array indexing.
+
+    Edge costs start at the edge length in cells. update_costs() changes
+    some of them, which leaves every row out of date until repair()
+    patches it in place, a few rows at a time. Out-of-date rows keep
+    answering lookups with their previous routes.
+    """
+
+    def __init__(self, model):
+        self.nodes = list(model.nodes.values())
+        self.edges = list(model.edges.values())
+        self.edge_from = np.array([e.from_node.index for e in self.edges], dtype=np.int32)
+        self.edge_to = np.array([e.to_node.index for e in self.edges], dtype=np.int32)
+        self.edge_cost = np.array([e.length for e in self.edges], dtype=np.float64)
+        self._cost = self.edge_cost.tolist()
+        # Per node, (neighbour node, edge index) of each in-edge and out-edge
+        self.incoming = [[(e.from_node.index, e.index) for e in node.in_edges] for node in self.nodes]
+        self.outgoing = [[(e.to_node.index, e.index) for e in node.out_edges] for node in self.nodes]
+        # Node index -> row of next_edge/cost, or -1 while it has no table
+        self.row = np.full(len(self.nodes), -1, dtype=np.int32)
+        self.dests = np.zeros(0, dtype=np.int32)
+        # Cost updates so far, and the one each row was last brought up to
+        self.version = 0
+        self.row_version = np.zeros(0, dtype=np.int64)
+        self.next_edge = np.zeros((0, len(self.nodes)), dtype=np.int32)
+        self.cost = np.zeros((0, len(self.nodes)), dtype=np.float64)
+
+    def _search(self, dest: int):
+        next_edge = [-1] * len(self.nodes)
+        cost = [math.inf] * len(self.nodes)
+        cost[dest] = 0.0
+        self._relax(next_edge, cost, [(0.0, dest)])
+        return np.array(next_edge, dtype=np.int32), np.array(cost, dtype=np.float64)
+
+    def _relax(self, next_edge, cost, heap):
+        """
+        Backward Dijkstra from the nodes on heap, improving next_edge and
+        cost in place. Gains below EPSILON are rounding, not better paths.
+        """
+        incoming, edge_cost = self.incoming, self._cost
+        pop, push = heapq.heappop, heapq.heappush
+        heapq.heapify(heap)
+        while heap:
+            d, v = pop(heap)
+            if d > cost[v]:
+                continue
+            for u, e in incoming[v]:
+                nd = d + edge_cost[e]
+                if nd < cost[u] - EPSILON:
+                    cost[u] = nd
+                    next_edge[u] = e
+                    push(heap, (nd, u))
+
+    def prepare(self, dests):
+        """Build the tables for every destination node index that lacks one."""
+        wanted = dict.fromkeys(np.asarray(dests, dtype=np.int64).tolist())
+        missing = [d for d in wanted if self.row[d] < 0]
+        if not missing:
+            return
+        rows = [self._search(d) for d in missing]
+        start = len(self.dests)
+        self.row[missing] = np.arange(start, start + len(missing), dtype=np.int32)
+        self.dests = np.concatenate([self.dests, np.array(missing, dtype=np.int32)])
+        self.row_version = np.concatenate([self.row_version, np.full(len(missing), self.version, dtype=np.int64)])
+        self.next_edge = np.vstack([self.next_edge] + [r[0] for r in rows])
+        self.cost = np.vstack([self.cost] + [r[1] for r in rows])
+
+    def update_costs(self, edges: np.ndarray, costs: np.ndarray) -> int:
+        """Set new costs on some edges. Returns the number of rows now out of date."""
+        edges = np.asarray(edges, dtype=np.int64)
+        if not len(edges):
+            return 0
+        self.edge_cost[edges] = costs
+        for e, c in zip(edges.tolist(), self.edge_cost[edges].tolist()):
+            self._cost[e] = c
+        self.version += 1
+        return self.pending()
+
+    def pending(self) -> int:
+        return int((self.row_version < self.version).sum())
+
+    def repair(self, limit: int, demand: np.ndarray = None) -> np.ndarray:
+        """
+        Bring up to limit out-of-date rows up to date and return their
+        destinations. demand, per node, ranks rows by how many cars head
+        there; ties go to the row waiting longest.
+        """
+        queued = np.flatnonzero(self.row_version < self.version)
+        if not len(queued):
+            return np.zeros(0, dtype=np.int32)
+        weight = demand[self.dests[queued]] if demand is not None else np.zeros(len(queued))
+        rows = queued[np.lexsort((self.row_version[queued], -weight))[:limit]]
+        for r in rows.tolist():
+            self._repair(r)
+            self.row_version[r] = self.version
+        return self.dests[rows]
+
+    def _repair(self, r: int):
+        """
+        Make one row exact again under the current edge costs. The old
+        next-hop tree is still a set of valid paths, so it is re-priced
+        first: each node's cost is summed up its tree path by pointer
+        jumping. Those costs can only be too high, and only where some
+        edge now beats a node's tree edge; those nodes seed a Dijkstra
+        that spreads the improvements. The work follows the part of the
+        tree that actually moves.
+        """
+        next_row, cost_row = self.next_edge[r], self.cost[r]
+        on_tree = next_row >= 0
+        hop = np.maximum(next_row, 0)
+        parent = np.where(on_tree, self.edge_to[hop], np.arange(len(self.nodes)))
+        total = np.where(on_tree, self.edge_cost[hop], 0.0)
+        while True:
+            up = parent[parent]
+            total = total + total[parent]
+            if (up == parent).all():
+                break
+            parent = up
+        reached = np.isfinite(cost_row)
+        cost_row[reached] = total[reached]
+
+        via = cost_row[self.edge_to] + self.edge_cost
+        tail = self.edge_from
+        better = np.flatnonzero(via < cost_row[tail] - EPSILON)
+        if not len(better):
+            return
+        # Best improving edge per node: sort by cost, keep each node's first.
+        better = better[np.lexsort((via[better], tail[better]))]
+        first = np.flatnonzero(np.diff(tail[better], prepend=-1) != 0)
+        better = better[first]
+        next_row[tail[better]] = better
+        cost_row[tail[better]] = via[better]
+        heap = list(zip(via[better].tolist(), tail[better].tolist()))
+        # Plain lists make the scalar-heavy search several times faster.
+        next_list, cost_list = next_row.tolist(), cost_row.tolist()
+        self._relax(next_list, cost_list, heap)
+        next_row[:] = next_list
+        cost_row[:] = cost_list
+
+    def lookup(self, dests: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+        """Next edge index from each node toward each dest, -1 if unreachable or unprepared."""
+        rows = self.row[dests]
+        out = np.full(len(rows), -1, dtype=np.int32)
+        ok = rows >= 0
+        out[ok] = self.next_edge[rows[ok], nodes[ok]]
+        return out
+
+    def next_edge_from(self, dest: int, node: int) -> int:
+        row = self.row[dest]
+        return int(self.next_edge[row, node]) if row >= 0 else -1
+
+    def assign(self, origins, dests):
+        """
+        Route a batch of trips given as node index arrays. Returns the
+        first edge of each trip (-1 when the destination is unreachable
+        or is the origin) and its free-flow cost in cells.
+        """
+        origins = np.asarray(origins, dtype=np.int64)
+        dests = np.asarray(dests, dtype=np.int64)
+        self.prepare(dests)
+        rows = self.row[dests]
+        return self.next_edge[rows, origins], self.cost[rows, origins]
+
+    def path(self, origin: int, dest: int) -> list:
+        """Edge indices of the shortest path, empty when there is none."""
+        self.prepare([dest])
+        route = []
+        node = origin
+        while node != dest:
+            e = self.next_edge_from(dest, node)
+            if e < 0:
+                return []
+            route.append(e)
+            node = int(self.edge_to[e])
+        return route
+
+    def arrays(self) -> dict:
+        return {"route_dests": self.dests, "route_next": self.next_edge, "route_cost": self.cost}
+
+    def load_arrays(self, arrays) -> bool:
+        """Adopt tables saved by arrays() if they fit this graph."""
+        dests = arrays["route_dests"]
+        next_edge = arrays["route_next"]
+        if next_edge.shape[1:] != (len(self.nodes),) or (next_edge >= len(self.edges)).any():
+            return False
+        self.row[:] = -1
+        self.row[dests] = np.arange(len(dests), dtype=np.int32)
+        self.dests = dests.astype(np.int32)
+        self.row_version = np.full(len(dests), self.version, dtype=np.int64)
+        self.next_edge = next_edge.astype(np.int32)
+        self.cost = arrays["route_cost"].astype(np.float64)
+        return True
+
+
+class Demand:
+    """
+    Origin-destination trip demand between zone nodes.
+
+    zones are node indices. matrix[i][j] weights trips from zones[i] to
+    zones[j] (the diagonal is ignored) and rate is the expected number of
+    new trips per tick. Uniform when matrix is None.
+    """
+
+    def __init__(self, zones, matrix=None, rate: float = 0.5):
+        n = len(zones)
+        if n < 2:
+            raise ValueError("Trip demand needs at least two zones")
+        matrix = np.ones((n, n)) if matrix is None else np.array(matrix, dtype=np.float64)
+        if matrix.shape != (n, n) or (matrix < 0).any():
+            raise ValueError(f"OD matrix must be a non-negative {n}x{n} array")
+        np.fill_diagonal(matrix, 0.0)
+        total = matrix.sum()
+        if total <= 0:
+            raise ValueError("OD matrix has no trips")
+        self.zones = np.asarray(zones, dtype=np.int64)
+        self.matrix = matrix
+        self.rate = float(rate)
+        self.cdf = np.cumsum(matrix.ravel()) / total
+
+    def sample(self, rng: np.random.Generator):
+        """Origin and destination node indices of this tick's new trips."""
+        k = rng.poisson(self.rate)
+        pairs = np.searchsorted(self.cdf, rng.random(k), side="right")
+        o, d = np.divmod(np.minimum(pairs, len(self.cdf) - 1), len(self.zones))
+        return self.zones[o], self.zones[d]
+
+
+class Rerouter:
+    """
+    Dynamic traffic assignment from live edge travel times.
+
+    The engines report how many ticks each car took to cross each edge
+    as it leaves. Every interval ticks the mean crossing time of each
+    edge is turned into a cost in cells, the edge length scaled by how
+    much slower than free flow the crossing was, and folded into an
+    exponentially smoothed estimate. Edges nobody left keep their
+    estimate while occupied and drift back to their length once empty.
+    Edges whose estimate has moved more than threshold from the cost the
+    router uses are updated there, which puts every table out of date.
+    Tables are repaired incrementally, spread over the ticks until the
+    next update, busiest destinations first. A repair costs about one
+    search over the graph, so each tick repairs at most budget // nodes
+    tables and no single step() stalls however large the map. Cars take their next turn from the tables, so only
+    cars whose remaining route changed re-route.
+    """
+
+    def __init__(self, interval: int = 50, alpha: float = 0.3, threshold: float = 0.25,
+                 budget: int = 4000):
+        self.interval = max(1, int(interval))
+        self.budget = budget
+        self.alpha = alpha
+        self.threshold = threshold
+        self.travel = None
+        self.exits = None
+        self.ticks = None
+        self.per_tick = 1
+
+    def fit(self, n: int):
+        """Size the per-edge counters for a graph of n edges, clearing them if it changed."""
+        if self.exits is None or len(self.exits) != n:
+            self.exits = np.zeros(n, dtype=np.int64)
+            self.ticks = np.zeros(n, dtype=np.int64)
+            self.travel = None
+
+    def record(self, edge: int, ticks: int):
+        self.exits[edge] += 1
+        self.ticks[edge] += ticks
+
+    def record_many(self, edges: np.ndarray, ticks: np.ndarray):
+        np.add.at(self.exits, edges, 1)
+        np.add.at(self.ticks, edges, ticks)
+
+    def observe(self, model) -> np.ndarray:
+        router = model.router
+        length = np.array([e.length for e in router.edges], dtype=np.float64)
+        self.fit(len(length))
+        if self.travel is None:
+            self.travel = length.copy()
+        # Free flow: accelerating from 1 up to the speed limit, then cruising.
+        free = np.ceil(length / model.max_v_global) + 2
+        sampled = self.exits > 0
+        mean = np.divide(self.ticks, self.exits, out=np.zeros(len(length)), where=sampled)
+        measured = np.where(sampled, length * np.maximum(1.0, mean / free), length)
+        empty = np.bincount(model.car_columns()[:, 1], minlength=len(length)) == 0
+        blend = sampled | empty
+        self.travel[blend] = self.alpha * measured[blend] + (1 - self.alpha) * self.travel[blend]
+        self.exits[:] = 0
+        self.ticks[:] = 0
+        return self.travel
+
+    def step(self, model) -> int:
+        """
+        Run once per tick: measure and queue on update ticks, then repair
+        this tick's share of tables. Returns how many cars changed course.
+        """
+        router = model.router
+        if model.tick_count % self.interval == 0:
+            travel = self.observe(model)
+            edges = np.flatnonzero(np.abs(travel - router.edge_cost) > self.threshold * router.edge_cost)
+            queued = router.update_costs(edges, travel[edges])
+            cap = max(1, self.budget // len(router.nodes))
+            self.per_tick = min(cap, max(1, -(-queued // self.interval)))
+        if not router.pending():
+            return 0
+        dests = model.car_dests()
+        at = router.edge_to[model.car_columns()[:, 1]]
+        before = router.lookup(np.maximum(dests, 0), at)
+        heading = np.bincount(dests[dests >= 0], minlength=len(router.nodes))
+        repaired = router.repair(self.per_tick, heading)
+        moved = np.isin(dests, repaired)
+        return int((router.lookup(np.maximum(dests[moved], 0), at[moved]) != before[moved]).sum())
@@ -0,0 +1,154 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+
+def run_ticks(step: Callable[[], None], count: int, budget: float | None = None) -> int:
+    """Run count ticks, or with a budget in seconds as many as fit (at least one)."""
+    if budget is None:
+        for _ in range(count):
+            step()
+        return count
+    deadline = time.monotonic() + budget
+    n = 0
+    while True:
+        step()
+        n += 1
+        if time.monotonic() >= deadline:
+            return n
+
+
+class RateMeter:
+    """Events per second, measured over a sliding window of wall-clock time."""
+
+    def __init__(self, window: float = 1.0):
+        self.window = window
+        self.rate = 0.0
+        self._count = 0
+        self._since = time.monotonic()
+
+    def mark(self, n: int = 1):
+        self._count += n
+        now = time.monotonic()
+        elapsed = now - self._since
+        if elapsed >= self.window:
+            self.rate = self._count / elapsed
+            self._count = 0
+            self._since = now
+
+    def reset(self):
+        self.rate = 0.0
+        self._count = 0
+        self._since = time.monotonic()
+
+
+class TickScheduler:
+    """
+    Fixed-timestep driver for the simulation loop.
+
+    Ticks run at tick_hz of simulated time per wall-clock second and
+    frames are published at frame_hz, independently of each other and of
+    how long a step takes. A late loop runs the missed ticks back to back,
+    up to max_catch_up per wake-up; debt beyond that is dropped so a
+    persistently slow step degrades the tick rate instead of spiralling.
+    With max_speed set, ticks run as fast as the engine allows and only
+    frames stay on the wall clock.
+    """
+
+    def __init__(self, tick_hz: float = 10.0, frame_hz: float = 10.0,
+                 max_speed: bool = False, max_catch_up: int = 5):
+        self.tick_hz = tick_hz
+        self.frame_hz = frame_hz
+        self.max_speed = max_speed
+        self.max_catch_up = max_catch_up
+        self.ticks = RateMeter()
+        self.frames = RateMeter()
+        # Wake-ups that found the loop more than a tick behind, and ticks given up
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self._next_tick = None
+        self._next_frame = None
+
+    def configure(self, tick_hz: float | None = None, frame_hz: float | None = None,
+                  max_speed: bool | None = None):
+        if tick_hz is not None:
+            tick_hz = float(tick_hz)
+            if tick_hz <= 0:
+                raise ValueError("tick_hz must be positive")
+            self.tick_hz = tick_hz
+        if frame_hz is not None:
+            frame_hz = float(frame_hz)
+            if frame_hz <= 0:
+                raise ValueError("frame_hz must be positive")
+            self.frame_hz = frame_hz
+        if max_speed is not None:
+            self.max_speed = bool(max_speed)
+        self._next_tick = None
+
+    def status(self) -> dict:
+        return {
+            "tick_hz": self.tick_hz,
+            "frame_hz": self.frame_hz,
+            "max_speed": self.max_speed,
+            "tick_rate": round(self.ticks.rate, 1),
+            "frame_rate": round(self.frames.rate, 1)
+        }
+
+    def _due_ticks(self, now: float) -> int:
+        interval = 1.0 / self.tick_hz
+        if self._next_tick is None:
+            self._next_tick = now
+        if self._next_tick > now:
+            return 0
+        due = int((now - self._next_tick) / interval) + 1
+        if due > 1:
+            self.overruns += 1
+        n = min(due, self.max_catch_up)
+        self.skipped_ticks += due - n
+        self._next_tick += due * interval
+        return n
+
+    async def run(self, advance: Callable[[int, float | None], Awaitable[int]],
+                  snapshot: Callable[[], Awaitable[Any]], publish: Callable[[Any], None],
+                  is_running: Callable[[], bool]):
+        """
+        Drive the simulation forever. advance(count, budget) runs count
+        ticks, or as many as fit in budget seconds, wherever the model
+        lives; publish() receives each snapshot() back on the event loop.
+        """
+        while True:
+            if not is_running():
+                self._next_tick = None
+                self._next_frame = None
+                self.ticks.reset()
+                self.frames.reset()
+                await asyncio.sleep(0.05)
+                continue
+
+            now = time.monotonic()
+            if self._next_frame is None:
+                self._next_frame = now
+            if self.max_speed:
+                # Step in slices so frames and commands still get through.
+                budget = max(0.0, min(self._next_frame, now + 0.05) - now)
+                self.ticks.mark(await advance(0, budget))
+                self._next_tick = None
+            else:
+                count = self._due_ticks(now)
+                if count:
+                    await advance(count, None)
+                self.ticks.mark(count)
+
+            now = time.monotonic()
+            if now >= self._next_frame:
+                publish(await snapshot())
+                self.frames.mark()
+                self._next_frame += 1.0 / self.frame_hz
+                if self._next_frame <= now:
+                    self._next_frame = now + 1.0 / self.frame_hz
+
+            if self.max_speed:
+                await asyncio.sleep(0)
+            else:
+                wake = min(self._next_tick, self._next_frame)
+                await asyncio.sleep(max(0.0, wake - time.monotonic()))
@@ -1,7 +1,7 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 import asyncio
 import json
 import logging
@@ -13,8 +13,9 @@ logger = logging.getLogger("UrbanFlow")
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from backend.model import SimulationModel
-from backend.map_loader import CityMapLoader
+from backend.frames import FORMATS
+from backend.metrics import prometheus_text, summarize
+from backend.sessions import SessionManager, DEFAULT_SESSION
 from backend.osm_generator import OSMGenerator
 
 app = FastAPI(docs_url="/api/docs", redoc_url=None)
@@ -51,101 +52,259 @@ async def read_docs(request: Request):
 async def read_usage(request: Request):
     return templates.TemplateResponse("usage.html", {"request": request})
 
-model = SimulationModel()
-model.create_city_grid() 
+sessions = SessionManager(
+    shards=int(os.environ.get("URBANFLOW_SHARDS", 0)),
+    max_sessions=int(os.environ.get("URBANFLOW_MAX_SESSIONS", 32)),
+    idle_timeout=float(os.environ.get("URBANFLOW_IDLE_TIMEOUT", 600)),
+    max_cars=int(os.environ.get("URBANFLOW_MAX_CARS", 10000)),
+    max_edges=int(os.environ.get("URBANFLOW_MAX_EDGES", 50000))
+)
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+@app.on_event("startup")
+async def startup_event():
+    await sessions.start()
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+@app.on_event("shutdown")
+async def shutdown_event():
+    await sessions.stop()
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                pass
+@app.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    """Phase timings, counters and gauges in the Prometheus text format."""
+    text = prometheus_text(*await sessions.metrics())
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
 
-manager = ConnectionManager()
+@app.get("/debug/profile", response_class=PlainTextResponse)
+async def read_profile(seconds: float = 5.0, interval_ms: float = 5.0):
+    """Sample every thread for seconds (at most 60) and return folded stacks for a flame graph."""
+    if not 0 < seconds <= 60 or not 1 <= interval_ms <= 1000:
+        return PlainTextResponse("seconds must be in (0, 60] and interval_ms in [1, 1000]\n", status_code=400)
+    try:
+        return PlainTextResponse(await sessions.profile(seconds, interval_ms / 1000))
+    except RuntimeError as e:
+        return PlainTextResponse(f"{e}\n", status_code=409)
 
-async def simulation_loop():
-    logger.info("Simulation loop started")
+async def stream_metrics(websocket: WebSocket, get_clients, interval: float):
+    """Send a summary of the metrics to one client every interval seconds until cancelled."""
     while True:
-        try:
-            if model.running:
-                model.step()
-                state = model.get_state()
-                await manager.broadcast({
-                    "type": "update",
-                    "tick": model.tick_count,
-                    "stats": model.get_statistics(),
-                    "cars": state['cars'],
-                    "lights": state['lights'] 
-                })
-        except Exception as e:
-            logger.error(f"Error in simulation loop: {e}")
-            with open("server_error.log", "w") as f:
-                f.write(str(e))
-                import traceback
-                traceback.print_exc(file=f)
-            model.running = False
-            
-        await asyncio.sleep(0.1)  
+        metrics = summarize(*await sessions.metrics())
+        get_clients().send(websocket, {"type": "metrics", "metrics": metrics})
+        await asyncio.sleep(interval)
 
-@app.on_event("startup")
-async def startup_event():
-    asyncio.create_task(simulation_loop())
+async def switch_session(current, target, websocket: WebSocket, fmt: str):
+    if current is not None:
+        sessions.leave(current, websocket)
+    await sessions.join(target, websocket, fmt)
+    return target
+
+async def load_osm_map(session, websocket: WebSocket, bounds: dict):
+    """
+    Load an OSM box into a session. Runs as its own task so the socket
+    keeps receiving while mirrors are raced; only the download can be
+    cancelled, building the graph runs to completion on the shard.
+    """
+    clients = session.clients
+    
+    def progress(info):
+        clients.send(websocket, {"type": "osm_progress", **info})
+    
+    try:
+        state = await session.call("load_cached_osm", bounds)
+        if state is None:
+            if OSMGenerator.cache.offline:
+                raise Exception("No cached map data for this area and offline mode is on.")
+            fetch = session.osm_fetch = asyncio.create_task(OSMGenerator.fetch(bounds, progress=progress))
+            try:
+                path = await fetch
+            except asyncio.CancelledError:
+                if fetch.cancelled():
+                    logger.info("OSM fetch cancelled")
+                    clients.send(websocket, {"type": "osm_cancelled"})
+                    return
+                raise
+            finally:
+                if session.osm_fetch is fetch:
+                    session.osm_fetch = None
+            progress({"stage": "building"})
+            try:
+                state = await session.call("load_osm_response", bounds, path)
+            finally:
+                os.remove(path)
+        clients.broadcast({"type": "init", "session": session.id, "state": state})
+        
+    except Exception as e:
+        logger.error(f"Error generating OSM map: {e}")
+        clients.send(websocket, {
+            "type": "error", 
+            "message": f"Failed to load map data: {str(e)}"
+        })
 
 @app.websocket("/ws/simulation")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    fmt = websocket.query_params.get("format", "json")
+    if fmt not in FORMATS:
+        fmt = "json"
+    requested = websocket.query_params.get("session", DEFAULT_SESSION)
+    await websocket.accept()
+    session = None
+    metrics_feed = None
     try:
-        await websocket.send_json({
-            "type": "init",
-            "state": model.get_state()
-        })
+        session = sessions.get(requested) or await sessions.default()
+        await sessions.join(session, websocket, fmt)
+        if session.id != requested:
+            session.clients.send(websocket, {"type": "error", "message": f"No such session: {requested}"})
 
         while True:
             data = await websocket.receive_text()
             message = json.loads(data)
             action = message.get("action")
 
+            if sessions.get(session.id) is not session:
+                # Destroyed or evicted while we were attached.
+                session = await switch_session(session, await sessions.default(), websocket, fmt)
+            session.touch()
+            clients = session.clients
+
             if action == "start":
-                model.running = True
-                logger.info("Simulation Started")
+                session.running = True
+                logger.info(f"Simulation Started ({session.id})")
             
             elif action == "stop":
-                model.running = False
-                logger.info("Simulation Stopped")
+                session.running = False
+                logger.info(f"Simulation Stopped ({session.id})")
             
             elif action == "reset":
-                model.cars.clear()
-                for node in model.nodes.values():
-                    if node.type == "intersection":
-                        node.signal_state_ns = "green"
-                        node.signal_state_ew = "red"
-                        node.signal_timer = 0
-                for edge in model.edges.values():
-                    edge.cells = [None] * edge.length
-                
-                model.tick_count = 0
-                model.running = False
-                
-                state = model.get_state()
-                await manager.broadcast({"type": "init", "state": state})
+                session.running = False
+                state = await session.call("reset_vehicles")
+                clients.broadcast({"type": "init", "session": session.id, "state": state})
                 logger.info("Simulation Reset (Map preserved)")
 
+            elif action == "keyframe":
+                clients.request_keyframe(websocket)
+
+            elif action == "viewport":
+                # The map rectangle a client draws, and its pixels per map unit;
+                # without one it gets the whole map again.
+                rect = None
+                if message.get("x0") is not None:
+                    rect = tuple(float(message[k]) for k in ("x0", "y0", "x1", "y1"))
+                await session.call("set_view", clients.client_id(websocket), rect, float(message.get("scale", 1.0)))
+                clients.set_view(websocket, rect is not None)
+
+            elif action == "history":
+                since = message.get("since")
+                count = message.get("count")
+                history = await session.call("history", None if since is None else int(since),
+                                             None if count is None else int(count))
+                clients.send(websocket, {"type": "history", "session": session.id, "history": history})
+
+            elif action == "checkpoint":
+                checkpoint = await session.call("checkpoint")
+                clients.send(websocket, {"type": "checkpoint", "session": session.id, "checkpoint": checkpoint})
+
+            elif action == "rewind":
+                try:
+                    state = await session.call("rewind")
+                    clients.broadcast({"type": "init", "session": session.id, "state": state})
+                except ValueError as e:
+                    clients.send(websocket, {"type": "error", "message": str(e)})
+
+            elif action == "subscribe_metrics":
+                if metrics_feed is not None:
+                    metrics_feed.cancel()
+                interval = min(60.0, max(0.5, float(message.get("interval", 1.0))))
+                metrics_feed = asyncio.create_task(stream_metrics(websocket, lambda: session.clients, interval))
+
+            elif action == "unsubscribe_metrics":
+                if metrics_feed is not None:
+                    metrics_feed.cancel()
+                    metrics_feed = None
+
+            elif action == "list_sessions":
+                clients.send(websocket, {"type": "sessions", "sessions": sessions.list()})
+
+            elif action == "create_session":
+                try:
+                    created = await sessions.create(name=str(message.get("name", "")))
+                    session = await switch_session(session, created, websocket, fmt)
+                except ValueError as e:
+                    clients.send(websocket, {"type": "error", "message": str(e)})
+
+            elif action == "join_session":
+                target_id = message.get("session", DEFAULT_SESSION)
+                target = sessions.get(target_id)
+                if target is None and target_id == DEFAULT_SESSION:
+                    target = await sessions.default()
+                if target is None:
+                    clients.send(websocket, {"type": "error", "message": f"No such session: {target_id}"})
+                elif target is not session:
+                    session = await switch_session(session, target, websocket, fmt)
+
+            elif action == "destroy_session":
+                target_id = message.get("session", session.id)
+                await sessions.destroy(target_id)
+                if target_id == session.id:
+                    session = await switch_session(session, await sessions.default(), websocket, fmt)
+
             elif action == "set_spawn_rate":
-                model.spawn_rate = float(message.get("value", 0.5))
+                await session.call("configure", "spawn_rate", float(message.get("value", 0.5)))
             
+            elif action == "set_demand":
+                zones = message.get("zones") if message.get("enabled", True) else False
+                try:
+                    demand = await session.call("set_demand", zones, message.get("matrix"),
+                                                float(message.get("rate", 0.5)))
+                    clients.broadcast({"type": "demand", "session": session.id, "demand": demand})
+                except ValueError as e:
+                    clients.send(websocket, {"type": "error", "message": str(e)})
+
+            elif action == "set_rerouting":
+                rerouting = await session.call("set_rerouting", bool(message.get("enabled", True)),
+                                               max(1, int(message.get("interval", 50))))
+                clients.broadcast({"type": "rerouting", "session": session.id, "rerouting": rerouting})
+
+            elif action == "set_signal_plan":
+                try:
+                    signal = await session.call("set_signal_plan", message.get("node"), message.get("plan"))
+                    clients.broadcast({"type": "signal_plan", "session": session.id, "signal": signal})
+                except (KeyError, TypeError, ValueError) as e:
+                    clients.send(websocket, {"type": "error", "message": str(e)})
+
+            elif action == "set_engine":
+                try:
+                    engine = await session.call("set_engine", message.get("value", "python"))
+                    logger.info(f"Simulation engine set to {engine}")
+                except ValueError as e:
+                    clients.send(websocket, {"type": "error", "message": str(e)})
+
+            elif action == "set_clock":
+                try:
+                    session.clock.configure(
+                        tick_hz=message.get("tick_hz"),
+                        frame_hz=message.get("frame_hz"),
+                        max_speed=message.get("max_speed")
+                    )
+                    logger.info(f"Clock set to {session.clock.status()}")
+                except (TypeError, ValueError) as e:
+                    clients.send(websocket, {"type": "error", "message": str(e)})
+
             elif action == "set_light_timing":
-                model.traffic_light_interval = int(message.get("value", 30))
+                await session.call("set_light_timing", max(1, int(message.get("value", 30))))
+
+            elif action == "set_signal_control":
+                settings = {k: int(message[k]) for k in ("min_green", "max_green", "extension", "detector") if k in message}
+                try:
+                    control = await session.call("set_signal_control", message.get("mode", "fixed"), settings)
+                    clients.broadcast({"type": "signal_control", "session": session.id, "control": control})
+                except ValueError as e:
+                    clients.send(websocket, {"type": "error", "message": str(e)})
+
+            elif action == "green_wave":
+                try:
+                    count = await session.call("green_wave", message.get("direction", "ew"))
+                    logger.info(f"Green wave re-timed {count} signals")
+                except ValueError as e:
+                    clients.send(websocket, {"type": "error", "message": str(e)})
 
             elif action == "regenerate_grid":
                 try:
@@ -153,103 +312,49 @@ async def websocket_endpoint(websocket: WebSocket):
                     cols = max(2, int(message.get("cols", 3)))
                     initial_vehicles = int(message.get("initial_vehicles", 5))
                     
-                    model.running = False
-                    model.reset()
-                    logger.info(f"Regenerating grid: {rows}x{cols}")
-                    model.create_city_grid(rows, cols)
-                    
-                    if len(model.nodes) == 0:
-                        logger.error("CRITICAL: Grid generation produced 0 nodes! Trying fallback...")
-                        model.create_city_grid(4, 4)
-                        if len(model.nodes) == 0:
-                             logger.error("CRITICAL: Fallback failed. Manually adding one node.")
-                             model.add_node("manual_fallback", 400, 300, "intersection")
-
-                    edge_keys = list(model.edges.keys())
-                    if edge_keys:
-                        import random
-                        for _ in range(min(initial_vehicles, len(edge_keys))):
-                            start_edge = random.choice(edge_keys)
-                            model.spawn_car(start_edge)
-                    
-                    logger.info("Simulation initialized (paused)")
-                    
-                    state = model.get_state()
+                    session.running = False
+                    state = await session.call("regenerate_grid", rows, cols, initial_vehicles)
                     logger.info(f"Grid ready to send: {len(state['nodes'])} nodes, {len(state['edges'])} edges")
-                    
-                    msg = {"type": "init", "state": state}
-                    await manager.broadcast(msg)
+                    clients.broadcast({"type": "init", "session": session.id, "state": state})
                     
                 except Exception as e:
                     logger.error(f"Error during grid regeneration: {e}")
-                    await websocket.send_json({"type": "error", "message": str(e)})
+                    clients.send(websocket, {"type": "error", "message": str(e)})
 
             elif action == "load_city_layout":
                 filename = message.get("file")
                 layout_type = message.get("layout_type")
                 
-                model.running = False
-                model.reset()
+                session.running = False
                 
                 try:
-                    if layout_type == "json":
-                        filepath = os.path.join("city_layouts", filename)
-                        CityMapLoader.load_from_json(model, filepath)
-                    elif layout_type == "pattern":
-                        if filename == "manhattan":
-                            CityMapLoader.create_manhattan_grid(model)
-                        elif filename == "roundabout":
-                            CityMapLoader.create_roundabout(model)
-                        elif filename == "t_intersection":
-                            CityMapLoader.create_t_intersection(model)
-                    
-                    logger.info("Simulation initialized (paused)")
-                    
-                    state = model.get_state()
-                    msg = {"type": "init", "state": state}
-                    await websocket.send_json(msg)
-                    await manager.broadcast(msg)
+                    state = await session.call("load_city_layout", filename, layout_type)
+                    clients.broadcast({"type": "init", "session": session.id, "state": state})
                     logger.info(f"City Layout Loaded: {filename}")
                 except Exception as e:
                     logger.error(f"Failed to load city layout: {e}")
-                    await websocket.send_json({"type": "error", "message": str(e)})
+                    clients.send(websocket, {"type": "error", "message": str(e)})
 
             elif action == "generate_from_osm":
                 bounds = message.get("bounds")
-                model.running = False
-                model.reset()
-                
-                try:
-                    OSMGenerator.generate_from_bounds(model, bounds)
-                    
-                    edge_list = list(model.edges.keys())
-                    initial_vehicles = 20
-                    import random
-                    for _ in range(min(initial_vehicles, len(edge_list))):
-                        if edge_list:
-                            edge_id = random.choice(edge_list)
-                            model.spawn_car(edge_id)
-                    
-                    logger.info("Simulation initialized (paused)")
-                    
-                    logger.info("OSM Map generated successfully")
-                    state = model.get_state()
-                    msg = {"type": "init", "state": state}
-                    await websocket.send_json(msg)
-                    await manager.broadcast(msg)
-                    
-                except Exception as e:
-                    logger.error(f"Error generating OSM map: {e}")
-                    await websocket.send_json({
-                        "type": "error", 
-                        "message": f"Failed to load map data: {str(e)}"
-                    })
+                session.running = False
+                if session.osm_fetch is not None:
+                    session.osm_fetch.cancel()
+                session.osm_load = asyncio.create_task(load_osm_map(session, websocket, bounds))
+
+            elif action == "cancel_osm":
+                if session.osm_fetch is not None:
+                    session.osm_fetch.cancel()
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
     except Exception as e:
         logger.error(f"WebSocket Error: {e}")
-        manager.disconnect(websocket)
+    finally:
+        if metrics_feed is not None:
+            metrics_feed.cancel()
+        if session is not None:
+            sessions.leave(session, websocket)
 
 if __name__ == "__main__":
     import uvicorn
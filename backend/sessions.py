@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import secrets
+import time
+import traceback
+from collections import Counter
+
+from fastapi import WebSocket
+
+from .connections import ConnectionManager
+from .metrics import PhaseTimer, Sampler
+from .scheduler import TickScheduler
+from .shards import ProcessShard, ThreadShard
+
+logger = logging.getLogger("UrbanFlow")
+
+DEFAULT_SESSION = "default"
+
+
+class Session:
+    """
+    One independent simulation: its model lives on a shard, while its
+    viewers, clock and run flag live here on the event loop.
+    """
+
+    def __init__(self, session_id: str, shard, name: str = "", timings: PhaseTimer = None):
+        self.id = session_id
+        self.name = name or session_id
+        self.shard = shard
+        self.clients = ConnectionManager()
+        self.clock = TickScheduler(tick_hz=10.0, frame_hz=10.0)
+        self.running = False
+        self.last_seen = time.monotonic()
+        self.task = None
+        self.osm_load = None
+        self.osm_fetch = None
+        # Loop-side phase timings, shared by the manager's sessions
+        self.timings = timings or PhaseTimer()
+        self.errors = 0
+
+    async def call(self, command: str, *args):
+        return await self.shard.call(command, self.id, *args)
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def idle_for(self) -> float:
+        if self.clients.clients:
+            return 0.0
+        return time.monotonic() - self.last_seen
+
+    def info(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "clients": len(self.clients.clients),
+            "running": self.running,
+            "shard": self.shard.index
+        }
+
+    def counters(self) -> dict:
+        """Totals behind the manager's counter metrics."""
+        return {
+            "overruns": self.clock.overruns,
+            "skipped_ticks": self.clock.skipped_ticks,
+            "dropped_frames": self.clients.dropped_frames,
+            "errors": self.errors
+        }
+
+    async def _advance(self, count: int, budget: float | None) -> int:
+        started = time.perf_counter()
+        n = await self.call("advance", count, budget)
+        self.timings.observe("advance", time.perf_counter() - started)
+        return n
+
+    async def _snapshot(self):
+        rates = self.clock.status()
+        return await self.call(
+            "snapshot",
+            {"tick_rate": rates["tick_rate"], "frame_rate": rates["frame_rate"]},
+            self.clients.wants_keyframe(),
+            *self.clients.wants()
+        )
+
+    def _publish(self, snapshot):
+        frame, keyframe = snapshot
+        started = time.perf_counter()
+        self.clients.broadcast(frame, resync=lambda: keyframe)
+        self.timings.observe("broadcast", time.perf_counter() - started)
+
+    async def run(self):
+        logger.info(f"Simulation loop started for session {self.id}")
+        while True:
+            try:
+                await self.clock.run(self._advance, self._snapshot, self._publish, lambda: self.running)
+            except Exception as e:
+                logger.exception(f"Error in simulation loop of session {self.id}: {e}")
+                self.errors += 1
+                with open("server_error.log", "a") as f:
+                    f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} session {self.id}: {e}\n")
+                    traceback.print_exc(file=f)
+                self.running = False
+
+
+class SessionManager:
+    """
+    Creates, finds and evicts Sessions, spread over a fixed set of shards.
+
+    With shards=0 every session steps on one worker thread of the server
+    process. With shards > 0 each shard is a subprocess, and new sessions
+    go to the shard that hosts the fewest. Sessions with no viewers for
+    idle_timeout seconds are destroyed. max_cars and max_edges cap each
+    session's vehicle pool and map size.
+    """
+
+    def __init__(self, shards: int = 0, max_sessions: int = 32, idle_timeout: float = 600.0,
+                 max_cars: int = 10000, max_edges: int = 50000):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_cars = max_cars
+        self.max_edges = max_edges
+        if shards > 0:
+            self.shards = [ProcessShard(i) for i in range(shards)]
+        else:
+            self.shards = [ThreadShard(0)]
+        self.sessions: dict[str, Session] = {}
+        self._lock = asyncio.Lock()
+        self._evictor = None
+        self.timings = PhaseTimer()
+        # Session counters carried over from destroyed sessions
+        self.retired = Counter()
+        self.sampler = Sampler()
+
+    async def start(self):
+        for shard in self.shards:
+            await shard.start()
+        self._evictor = asyncio.create_task(self._evict_idle())
+
+    async def stop(self):
+        if self._evictor is not None:
+            self._evictor.cancel()
+        for session_id in list(self.sessions):
+            await self.destroy(session_id)
+        for shard in self.shards:
+            await shard.stop()
+
+    def get(self, session_id: str) -> Session | None:
+        return self.sessions.get(session_id)
+
+    def list(self) -> list[dict]:
+        return [s.info() for s in self.sessions.values()]
+
+    async def create(self, name: str = "", session_id: str | None = None) -> Session:
+        async with self._lock:
+            if session_id is not None and session_id in self.sessions:
+                return self.sessions[session_id]
+            if len(self.sessions) >= self.max_sessions:
+                raise ValueError(f"Session limit reached ({self.max_sessions})")
+            session_id = session_id or secrets.token_hex(4)
+            load = {shard.index: 0 for shard in self.shards}
+            for s in self.sessions.values():
+                load[s.shard.index] += 1
+            shard = min(self.shards, key=lambda sh: load[sh.index])
+            await shard.call("create", session_id, self.max_cars, self.max_edges)
+            session = Session(session_id, shard, name, self.timings)
+            session.task = asyncio.create_task(session.run())
+            self.sessions[session_id] = session
+            logger.info(f"Created session {session_id} on shard {shard.index}")
+            return session
+
+    async def default(self) -> Session:
+        """The shared session plain clients land in, recreated if it was evicted."""
+        return await self.create(session_id=DEFAULT_SESSION)
+
+    async def destroy(self, session_id: str):
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+        session.running = False
+        if session.task is not None:
+            session.task.cancel()
+        self.retired.update(session.counters())
+        for websocket in session.clients.active_connections:
+            session.clients.send(websocket, {"type": "session_closed", "session": session_id})
+        try:
+            await session.shard.call("destroy", session_id)
+        except RuntimeError as e:
+            logger.warning(f"Could not release session {session_id}: {e}")
+        logger.info(f"Destroyed session {session_id}")
+
+    async def metrics(self):
+        """
+        Phase timings of the server loop and of each shard, counters and
+        per-session gauges, in the form prometheus_text() takes.
+        """
+        timings = [({"process": "server"}, self.timings)]
+        shard_sessions = {}
+        for shard in self.shards:
+            try:
+                shard_timings, models = await shard.call("metrics")
+            except RuntimeError as e:
+                logger.warning(f"No metrics from shard {shard.index}: {e}")
+                continue
+            timings.append(({"process": f"shard-{shard.index}"}, shard_timings))
+            shard_sessions.update(models)
+
+        totals = Counter(self.retired)
+        for session in self.sessions.values():
+            totals.update(session.counters())
+        counters = {
+            "urbanflow_tick_overruns_total": ("Loop wake-ups that found a session more than a tick behind.",
+                                              [({}, totals["overruns"])]),
+            "urbanflow_ticks_skipped_total": ("Ticks given up to catch up with the wall clock.",
+                                              [({}, totals["skipped_ticks"])]),
+            "urbanflow_frames_dropped_total": ("Frames dropped for clients that fell behind.",
+                                               [({}, totals["dropped_frames"])]),
+            "urbanflow_loop_errors_total": ("Errors that stopped a session's loop.", [({}, totals["errors"])])
+        }
+        live = [(session, shard_sessions.get(session.id, {})) for session in self.sessions.values()]
+        gauges = {
+            "urbanflow_sessions": ("Live sessions.", [({}, len(self.sessions))]),
+            "urbanflow_clients": ("Connected clients.",
+                                  [({"session": s.id}, len(s.clients.clients)) for s, _ in live]),
+            "urbanflow_tick": ("Current tick.", [({"session": s.id}, m.get("tick", 0)) for s, m in live]),
+            "urbanflow_vehicles": ("Vehicles on the map.",
+                                   [({"session": s.id}, m.get("vehicles", 0)) for s, m in live]),
+            "urbanflow_edges": ("Edges of the map.", [({"session": s.id}, m.get("edges", 0)) for s, m in live]),
+            "urbanflow_tick_rate": ("Ticks per second.",
+                                    [({"session": s.id}, round(s.clock.ticks.rate, 2)) for s, _ in live]),
+            "urbanflow_frame_rate": ("Frames per second.",
+                                     [({"session": s.id}, round(s.clock.frames.rate, 2)) for s, _ in live])
+        }
+        return timings, counters, gauges
+
+    async def profile(self, seconds: float, interval: float = 0.005) -> str:
+        """
+        Sample the stacks of the server and of every shard process for
+        seconds, as folded stacks. Raises RuntimeError if a profile is
+        already being taken.
+        """
+        self.sampler.start(seconds, interval)
+        remote = [shard for shard in self.shards if not shard.local]
+        for shard in remote:
+            await shard.call("start_profile", seconds, interval)
+        while self.sampler.running:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(interval)
+        folded = [self.sampler.folded()]
+        for shard in remote:
+            stacks = await shard.call("profile")
+            folded.append("".join(f"shard-{shard.index};{line}\n" for line in stacks.splitlines()))
+        return "".join(folded)
+
+    async def _evict_idle(self):
+        while True:
+            await asyncio.sleep(min(30.0, self.idle_timeout))
+            for session in list(self.sessions.values()):
+                if session.idle_for() >= self.idle_timeout:
+                    logger.info(f"Evicting idle session {session.id}")
+                    await self.destroy(session.id)
+
+    async def join(self, session: Session, websocket: WebSocket, fmt: str):
+        """Attach an accepted socket to a session and send it the init state."""
+        state = await session.call("state")
+        session.clients.attach(websocket, fmt)
+        session.touch()
+        session.clients.send(websocket, {
+            "type": "init",
+            "format": fmt,
+            "session": session.id,
+            "state": state
+        })
+        # Frames encoded while the state was fetched may predate it.
+        session.clients.request_keyframe(websocket)
+
+    def leave(self, session: Session, websocket: WebSocket):
+        session.clients.disconnect(websocket)
+        session.touch()
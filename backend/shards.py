@@ -0,0 +1,386 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+
+from .model import SimulationModel
+from .map_loader import CityMapLoader
+from .osm_generator import OSMGenerator
+from .frames import DeltaEncoder, View, serialize
+from .metrics import PhaseTimer, Sampler
+from .scheduler import run_ticks
+from .signals import SignalPlan
+from .worker import SimulationWorker
+
+logger = logging.getLogger("UrbanFlow")
+
+# Model settings a client may change directly with a set_* action.
+TUNABLES = ("spawn_rate",)
+
+
+class SessionHost:
+    """
+    The SimulationModels of every session on one shard.
+
+    Each command takes the session id first and runs wherever the shard
+    runs it: on its worker thread, or inside its subprocess. Commands
+    that replace the map return the new init state.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        # Per session, the snapshot() blob of its last checkpoint
+        self.checkpoints = {}
+        # Per session, the View of each client that set one, by client id
+        self.views = {}
+        # Phase timings of every session on this shard, steps included
+        self.timings = PhaseTimer()
+        self.sampler = Sampler()
+
+    def create(self, session_id: str, max_cars: int, max_edges: int):
+        model = SimulationModel(max_cars=max_cars)
+        model.timings = self.timings
+        model.create_city_grid()
+        self.sessions[session_id] = (model, DeltaEncoder(keyframe_interval=50), max_edges)
+
+    def destroy(self, session_id: str):
+        self.sessions.pop(session_id, None)
+        self.checkpoints.pop(session_id, None)
+        self.views.pop(session_id, None)
+
+    def _session(self, session_id: str):
+        try:
+            return self.sessions[session_id]
+        except KeyError:
+            raise KeyError(f"No such session: {session_id}") from None
+
+    def _new_map(self, session_id: str):
+        model, frames, max_edges = self._session(session_id)
+        # Views were taken of the old map; clients send them again.
+        self.views.pop(session_id, None)
+        if len(model.edges) > max_edges:
+            n = len(model.edges)
+            model.reset()
+            model.create_city_grid()
+            frames.reset()
+            raise ValueError(f"Map has {n} edges; sessions are limited to {max_edges}")
+        logger.info("Simulation initialized (paused)")
+        frames.reset()
+        return self._state(model)
+
+    def _state(self, model: SimulationModel):
+        started = time.perf_counter()
+        state = model.get_state()
+        self.timings.observe("get_state", time.perf_counter() - started)
+        return state
+
+    def state(self, session_id: str):
+        return self._state(self._session(session_id)[0])
+
+    def advance(self, session_id: str, count: int, budget: float | None):
+        return run_ticks(self._session(session_id)[0].step, count, budget)
+
+    def snapshot(self, session_id: str, extra_stats: dict, with_keyframe: bool, formats: list, views: dict):
+        """
+        The next frame, and a resync keyframe of the same tick if asked for,
+        serialized here for the wire formats of clients seeing the whole map
+        and for each client with a view (client id to format). Views of
+        clients no longer listed are forgotten.
+        """
+        model, frames, _ = self._session(session_id)
+        started = time.perf_counter()
+        frame = frames.encode(model, extra_stats=extra_stats)
+        keyframe = frames.resync_frame() if with_keyframe else None
+        known = self.views.get(session_id, {})
+        for view_id in [v for v in known if v not in views]:
+            del known[view_id]
+        aggregates = frames.aggregate_frame() if any(v.aggregate for v in known.values()) else None
+        encoded = serialize(frame, formats, views, known, aggregates)
+        if keyframe is frame:
+            encoded_keyframe = encoded
+        else:
+            encoded_keyframe = serialize(keyframe, formats, views, known, aggregates)
+        self.timings.observe("frame", time.perf_counter() - started)
+        return encoded, encoded_keyframe
+
+    def set_view(self, session_id: str, view_id: int, rect: tuple | None, scale: float = 1.0) -> bool:
+        """
+        Cull one client's frames to the rectangle (x0, y0, x1, y1) of the map,
+        or stop culling them for None. Returns whether it is zoomed out far
+        enough for per-edge aggregates.
+        """
+        model = self._session(session_id)[0]
+        views = self.views.setdefault(session_id, {})
+        if rect is None:
+            views.pop(view_id, None)
+            return False
+        index = model.edge_index
+        edges = index.query(*rect)
+        node_ids = list(model.nodes)
+        view = View(len(model.edges), edges, [node_ids[i] for i in index.nodes(edges).tolist()], scale)
+        views[view_id] = view
+        return view.aggregate
+
+    def metrics(self):
+        """This shard's phase timings, and the tick, vehicles and edges of each session."""
+        sessions = {
+            session_id: {"tick": model.tick_count, "vehicles": len(model.cars), "edges": len(model.edges)}
+            for session_id, (model, _, _) in self.sessions.items()
+        }
+        return self.timings, sessions
+
+    def start_profile(self, seconds: float, interval: float):
+        self.sampler.start(seconds, interval)
+
+    def profile(self) -> str:
+        """Folded stacks of the last profile taken by start_profile()."""
+        return self.sampler.folded()
+
+    def history(self, session_id: str, since: int | None, count: int | None):
+        """Recorded statistics after tick since, at most the last count rows."""
+        return self._session(session_id)[0].stats.history.window(since, count)
+
+    def checkpoint(self, session_id: str):
+        """Save the session's full state; rewind() goes back to it. Returns the blob size and tick."""
+        model = self._session(session_id)[0]
+        blob = model.snapshot()
+        self.checkpoints[session_id] = blob
+        return {"tick": model.tick_count, "bytes": len(blob)}
+
+    def rewind(self, session_id: str):
+        """Go back to the last checkpoint, from which the run repeats exactly."""
+        model, frames, _ = self._session(session_id)
+        if session_id not in self.checkpoints:
+            raise ValueError("No checkpoint to rewind to")
+        model.restore(self.checkpoints[session_id])
+        frames.reset()
+        self.views.pop(session_id, None)
+        return self._state(model)
+
+    def set_engine(self, session_id: str, engine: str):
+        model = self._session(session_id)[0]
+        model.set_engine(engine)
+        return model.engine
+
+    def configure(self, session_id: str, name: str, value):
+        if name not in TUNABLES:
+            raise ValueError(f"Unknown setting: {name}")
+        setattr(self._session(session_id)[0], name, value)
+
+    def set_demand(self, session_id: str, zones, matrix, rate: float):
+        """Route trips between zones from an OD matrix; zones=False goes back to random turns."""
+        model = self._session(session_id)[0]
+        if zones is False:
+            model.clear_demand()
+            return None
+        model.set_demand(zones, matrix, rate)
+        OSMGenerator.save_routes(model)
+        return {"zones": len(model.demand.zones), "rate": model.demand.rate}
+
+    def set_rerouting(self, session_id: str, enabled: bool, interval: int):
+        model = self._session(session_id)[0]
+        model.set_rerouting(enabled, interval)
+        return {"enabled": enabled, "interval": interval}
+
+    def set_signal_plan(self, session_id: str, node_id: str, plan: dict | None):
+        """Give one signal a two-phase plan, or its default back when plan is None."""
+        model = self._session(session_id)[0]
+        if plan is not None:
+            plan = SignalPlan.two_phase(int(plan["ns_green"]), int(plan["ew_green"]), int(plan.get("yellow", 5)),
+                                        int(plan.get("all_red", 0)), int(plan.get("offset", 0)))
+        return {"node": node_id, "plan": model.set_signal_plan(node_id, plan).to_dict()}
+
+    def set_signal_control(self, session_id: str, mode: str, settings: dict):
+        model = self._session(session_id)[0]
+        model.set_signal_control(mode, **settings)
+        return model.signal_control
+
+    def set_light_timing(self, session_id: str, green: int):
+        self._session(session_id)[0].set_light_timing(green)
+
+    def green_wave(self, session_id: str, direction: str):
+        return self._session(session_id)[0].apply_green_wave(direction)
+
+    def reset_vehicles(self, session_id: str):
+        model, frames, _ = self._session(session_id)
+        model.clear_vehicles()
+        frames.reset()
+        return self._state(model)
+
+    def regenerate_grid(self, session_id: str, rows: int, cols: int, initial_vehicles: int):
+        model, _, max_edges = self._session(session_id)
+        n = 2 * (rows * (cols - 1) + cols * (rows - 1))
+        if n > max_edges:
+            raise ValueError(f"A {rows}x{cols} grid has {n} edges; sessions are limited to {max_edges}")
+        model.reset()
+        logger.info(f"Regenerating grid: {rows}x{cols}")
+        model.create_city_grid(rows, cols)
+
+        if len(model.nodes) == 0:
+            logger.error("CRITICAL: Grid generation produced 0 nodes! Trying fallback...")
+            model.create_city_grid(4, 4)
+            if len(model.nodes) == 0:
+                logger.error("CRITICAL: Fallback failed. Manually adding one node.")
+                model.add_node("manual_fallback", 400, 300, "intersection")
+
+        model.spawn_initial_cars(min(initial_vehicles, len(model.edges)))
+
+        return self._new_map(session_id)
+
+    def load_city_layout(self, session_id: str, filename: str, layout_type: str):
+        model = self._session(session_id)[0]
+        model.reset()
+        if layout_type == "json":
+            filepath = os.path.join("city_layouts", filename)
+            CityMapLoader.load_from_json(model, filepath)
+        elif layout_type == "pattern":
+            if filename == "manhattan":
+                CityMapLoader.create_manhattan_grid(model)
+            elif filename == "roundabout":
+                CityMapLoader.create_roundabout(model)
+            elif filename == "t_intersection":
+                CityMapLoader.create_t_intersection(model)
+        return self._new_map(session_id)
+
+    def load_cached_osm(self, session_id: str, bounds: dict):
+        """The init state for a cached OSM box, or None when it must be fetched."""
+        model = self._session(session_id)[0]
+        if not OSMGenerator.load_cached(model, bounds):
+            return None
+        return self._osm_ready(session_id)
+
+    def load_osm_response(self, session_id: str, bounds: dict, path: str):
+        """Build from a downloaded response file; only its path crosses the pipe."""
+        model = self._session(session_id)[0]
+        OSMGenerator.load_response(model, bounds, path)
+        return self._osm_ready(session_id)
+
+    def _osm_ready(self, session_id: str):
+        model, _, max_edges = self._session(session_id)
+        if len(model.edges) <= max_edges:
+            model.spawn_initial_cars(min(20, len(model.edges)))
+
+        logger.info("OSM Map generated successfully")
+        return self._new_map(session_id)
+
+
+class ThreadShard:
+    """A SessionHost run on one worker thread of the server process."""
+
+    # Whether the host shares the server's process (and its profiler)
+    local = True
+
+    def __init__(self, index: int):
+        self.index = index
+        self.host = SessionHost()
+        self.worker = SimulationWorker(name=f"shard-{index}")
+
+    async def start(self):
+        pass
+
+    async def call(self, command: str, *args):
+        return await self.worker.call(getattr(self.host, command), *args)
+
+    async def stop(self):
+        self.worker.shutdown()
+
+
+def _serve(conn):
+    """Subprocess entry point: run SessionHost commands received over a pipe."""
+    logging.basicConfig(level=logging.INFO)
+    host = SessionHost()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        call_id, command, args = request
+        try:
+            result = (call_id, True, getattr(host, command)(*args))
+        except Exception as e:
+            logger.debug(traceback.format_exc())
+            result = (call_id, False, e)
+        try:
+            conn.send(result)
+        except Exception as e:
+            # The result itself could not be pickled; report that instead.
+            conn.send((call_id, False, RuntimeError(f"{command} returned an unsendable result: {e}")))
+    conn.close()
+
+
+class ProcessShard:
+    """
+    A SessionHost in its own subprocess, so sessions on different shards
+    step on different cores. Calls are pickled over a pipe and answered
+    in order; a reader thread resolves the matching futures on the loop.
+    """
+
+    local = False
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.pending = {}
+        self.next_call = 0
+
+    async def start(self):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_serve, args=(child,), name=f"shard-{self.index}", daemon=True)
+        self.process.start()
+        child.close()
+        self.loop = asyncio.get_running_loop()
+        threading.Thread(target=self._read, name=f"shard-{self.index}-reader", daemon=True).start()
+
+    def _read(self):
+        while True:
+            try:
+                call_id, ok, value = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            self.loop.call_soon_threadsafe(self._resolve, call_id, ok, value)
+        self.loop.call_soon_threadsafe(self._fail_pending)
+
+    def _resolve(self, call_id, ok, value):
+        future = self.pending.pop(call_id, None)
+        if future is None or future.done():
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def _fail_pending(self):
+        if self.pending:
+            logger.error(f"Shard {self.index} exited with {len(self.pending)} calls pending")
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(f"Shard {self.index} is not running"))
+        self.pending.clear()
+
+    async def call(self, command: str, *args):
+        if self.process is None or not self.process.is_alive():
+            raise RuntimeError(f"Shard {self.index} is not running")
+        call_id = self.next_call
+        self.next_call += 1
+        future = self.loop.create_future()
+        self.pending[call_id] = future
+        self.conn.send((call_id, command, args))
+        return await future
+
+    async def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        await asyncio.get_running_loop().run_in_executor(None, self.process.join, 5)
+        if self.process.is_alive():
+            self.process.terminate()
@@ -0,0 +1,369 @@
+import numpy as np
+
+GREEN, YELLOW, RED = 0, 1, 2
+STATE_NAMES = ("green", "yellow", "red")
+# Columns of SignalController.state
+NS, EW = 0, 1
+
+CONTROL_MODES = ("fixed", "actuated", "max_pressure")
+# How SignalController runs green phases; see SignalController.configure()
+DEFAULT_CONTROL = {"mode": "fixed", "min_green": 10, "max_green": 60, "extension": 3, "detector": 6}
+
+
+class SignalPlan:
+    """
+    A fixed-time signal program.
+
+    phases is a list of (ns, ew, duration) with ns and ew each GREEN,
+    YELLOW or RED, run in order and repeated every cycle. offset shifts
+    the cycle so phase 0 starts on ticks offset, offset + cycle, ...,
+    which is how neighbouring signals are coordinated.
+    """
+
+    def __init__(self, phases: list, offset: int = 0):
+        phases = [(int(ns), int(ew), int(d)) for ns, ew, d in phases]
+        if not phases or any(d < 1 for _, _, d in phases):
+            raise ValueError("A signal plan needs at least one phase, each at least one tick long")
+        if any(s not in (GREEN, YELLOW, RED) for ns, ew, _ in phases for s in (ns, ew)):
+            raise ValueError("Signal states must be GREEN, YELLOW or RED")
+        self.phases = phases
+        self.cycle = sum(d for _, _, d in phases)
+        self.offset = int(offset) % self.cycle
+
+    @staticmethod
+    def two_phase(ns_green: int, ew_green: int, yellow: int = 5, all_red: int = 0, offset: int = 0):
+        """North-south then east-west, each green, yellow, then an optional all-red clearance."""
+        phases = [(GREEN, RED, ns_green), (YELLOW, RED, yellow), (RED, RED, all_red),
+                  (RED, GREEN, ew_green), (RED, YELLOW, yellow), (RED, RED, all_red)]
+        return SignalPlan([p for p in phases if p[2] > 0], offset)
+
+    def locate(self, tick: int):
+        """The phase running on tick and the tick it ends on."""
+        t = (tick - self.offset) % self.cycle
+        for i, (_, _, duration) in enumerate(self.phases):
+            if t < duration:
+                return i, tick + duration - t
+            t -= duration
+
+    def to_dict(self):
+        return {
+            "phases": [{"ns": STATE_NAMES[ns], "ew": STATE_NAMES[ew], "duration": d} for ns, ew, d in self.phases],
+            "cycle": self.cycle,
+            "offset": self.offset
+        }
+
+
+class TimingWheel:
+    """
+    Items bucketed by the tick they are due on, in size slots reused
+    round-robin. Items due more than size ticks ahead share a slot with
+    nearer ones and are simply kept until their own tick comes round.
+    """
+
+    def __init__(self, size: int = 256):
+        self.slots = [[] for _ in range(size)]
+
+    def schedule(self, tick: int, item):
+        self.slots[tick % len(self.slots)].append((tick, item))
+
+    def pop(self, tick: int) -> list:
+        """Remove and return the items due on tick."""
+        i = tick % len(self.slots)
+        slot = self.slots[i]
+        if not slot:
+            return []
+        self.slots[i] = [(t, item) for t, item in slot if t > tick]
+        return [item for t, item in slot if t == tick]
+
+
+class SignalController:
+    """
+    The traffic signals at a model's intersections, advanced by events.
+
+    Each signal runs a SignalPlan, held as rows of padded phase tables.
+    Its current phase and the tick of its next event are kept in arrays,
+    and the event ticks sit in a TimingWheel, so advance() only touches
+    signals with an event on that tick, all of them in one batch.
+    state holds the NS and EW state of every node as small integers
+    (nodes without a signal stay GREEN), and edge_green says for every
+    edge whether a car at its end may enter the next node. Both change
+    only when a phase does, so the engines read them as they are.
+
+    In "fixed" mode every phase runs for its planned duration. In
+    "actuated" and "max_pressure" mode, phases that give anyone a green
+    instead get a decision event after min_green ticks and every
+    extension ticks after that, which keeps the green or moves on. The
+    decision reads queue detectors: the cars in the last detector cells
+    of each approach.
+    """
+
+    def __init__(self, model, tick: int):
+        self.model = model
+        nodes = list(model.nodes.values())
+        edges = list(model.edges.values())
+        self.nodes = [n for n in nodes if n.type == "intersection"]
+        self.node_at = np.array([n.index for n in self.nodes], dtype=np.int64)
+        self.plans = [
+            model.signal_plans.get(n.id) or SignalPlan.two_phase(n.green_duration, n.green_duration, n.yellow_duration)
+            for n in self.nodes
+        ]
+        self._tables()
+        self.phase = np.zeros(len(self.nodes), dtype=np.int64)
+        self.phase_start = np.zeros(len(self.nodes), dtype=np.int64)
+        self.ends = np.zeros(len(self.nodes), dtype=np.int64)
+        self.state = np.full((len(nodes), 2), GREEN, dtype=np.uint8)
+        self.edge_from = np.array([e.from_node.index for e in edges], dtype=np.int64)
+        self.edge_to = np.array([e.to_node.index for e in edges], dtype=np.int64)
+        self.edge_len = np.array([e.length for e in edges], dtype=np.int64)
+        self.edge_ew = np.array([e.approaches_east_west() for e in edges], dtype=np.int64)
+        self.edge_green = np.ones(len(edges), dtype=bool)
+        self.out_degree = np.array([len(n.out_edges) for n in nodes], dtype=np.int64)
+        # The edges ending at each signal's node, as ranges of approach_idx
+        self.approach_ptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        np.cumsum([len(n.in_edges) for n in self.nodes], out=self.approach_ptr[1:])
+        self.approach_idx = np.array([e.index for n in self.nodes for e in n.in_edges], dtype=np.int64)
+        self.tick = tick
+        self.configure(model.signal_control)
+
+    def configure(self, control: dict):
+        """
+        Take the control settings (see DEFAULT_CONTROL) and restart every
+        signal from its plan. mode is one of CONTROL_MODES; min_green and
+        max_green bound an adaptive green, extension is the ticks between
+        its decisions and detector the cells each queue detector covers.
+        """
+        control = {**DEFAULT_CONTROL, **control}
+        if control["mode"] not in CONTROL_MODES:
+            raise ValueError(f"Unknown signal control '{control['mode']}', expected one of {CONTROL_MODES}")
+        for key in ("min_green", "max_green", "extension", "detector"):
+            if int(control[key]) < 1:
+                raise ValueError(f"{key} must be at least 1 tick")
+        self.mode = control["mode"]
+        self.min_green = int(control["min_green"])
+        self.max_green = int(control["max_green"])
+        self.extension = int(control["extension"])
+        self.detector = int(control["detector"])
+        self._restart(self.tick)
+
+    def _tables(self):
+        width = max((len(p.phases) for p in self.plans), default=1)
+        shape = (len(self.plans), width)
+        self.phase_ns = np.full(shape, RED, dtype=np.uint8)
+        self.phase_ew = np.full(shape, RED, dtype=np.uint8)
+        self.phase_len = np.ones(shape, dtype=np.int64)
+        # The next phase, cyclically, that gives someone a green
+        self.next_service = np.zeros(shape, dtype=np.int64)
+        self.phase_count = np.array([len(p.phases) for p in self.plans], dtype=np.int64)
+        for s, plan in enumerate(self.plans):
+            self._table_row(s, plan)
+        self.phase_service = (self.phase_ns == GREEN) | (self.phase_ew == GREEN)
+
+    def _table_row(self, s: int, plan: SignalPlan):
+        ns, ew, length = zip(*plan.phases)
+        k = len(plan.phases)
+        self.phase_ns[s, :k] = ns
+        self.phase_ew[s, :k] = ew
+        self.phase_len[s, :k] = length
+        self.phase_count[s] = k
+        service = [GREEN in (a, b) for a, b, _ in plan.phases]
+        for i in range(k):
+            j = next((j % k for j in range(i + 1, i + k + 1) if service[j % k]), i)
+            self.next_service[s, i] = j
+
+    def _restart(self, tick: int):
+        """Place every signal where its plan has it on tick."""
+        self.wheel = TimingWheel()
+        located = [plan.locate(tick) for plan in self.plans]
+        signals = np.arange(len(self.nodes), dtype=np.int64)
+        phase = np.array([p for p, _ in located], dtype=np.int64)
+        ends = np.array([e for _, e in located], dtype=np.int64)
+        self._enter(signals, phase, ends, ends - self.phase_len[signals, phase])
+
+    def restore(self, tick: int, phase: np.ndarray, start: np.ndarray, ends: np.ndarray):
+        """Put every signal back in a saved phase, begun and ending on the saved ticks."""
+        self.tick = tick
+        self.wheel = TimingWheel()
+        signals = np.arange(len(self.nodes), dtype=np.int64)
+        self._enter(signals, np.asarray(phase, dtype=np.int64), np.asarray(ends, dtype=np.int64),
+                    np.asarray(start, dtype=np.int64))
+
+    def _enter(self, signals: np.ndarray, phase: np.ndarray, ends: np.ndarray, start):
+        if not len(signals):
+            return
+        self.phase[signals] = phase
+        self.phase_start[signals] = start
+        at = self.node_at[signals]
+        self.state[at, NS] = self.phase_ns[signals, phase]
+        self.state[at, EW] = self.phase_ew[signals, phase]
+        edges = self.approach_idx[self._approaches(signals)[1]]
+        self.edge_green[edges] = self.state[self.edge_to[edges], self.edge_ew[edges]] == GREEN
+        self._schedule(signals, ends)
+
+    def _schedule(self, signals: np.ndarray, ends: np.ndarray):
+        self.ends[signals] = ends
+        for t in np.unique(ends).tolist():
+            self.wheel.schedule(t, signals[ends == t])
+
+    def _approaches(self, signals: np.ndarray):
+        """For each approach of signals: its position in signals, and its position in approach_idx."""
+        start, stop = self.approach_ptr[signals], self.approach_ptr[signals + 1]
+        counts = stop - start
+        owner = np.repeat(np.arange(len(signals)), counts)
+        return owner, np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    def advance(self, tick: int):
+        """Bring every signal to tick, which should be the one after the last."""
+        if tick == self.tick:
+            return
+        if tick != self.tick + 1:
+            # Jumped (a reset or restore): place every signal from its plan.
+            self.tick = tick
+            self._restart(tick)
+            return
+        self.tick = tick
+        due = self.wheel.pop(tick)
+        if not due:
+            return
+        signals = np.unique(np.concatenate(due))
+        # Entries left behind by set_plan() or a decision no longer match ends.
+        signals = signals[self.ends[signals] == tick]
+        adaptive = self.mode != "fixed"
+        if adaptive:
+            deciding = self.phase_service[signals, self.phase[signals]]
+            hold = np.zeros(len(signals), dtype=bool)
+            hold[deciding] = self._keep_green(signals[deciding], tick)
+            self._schedule(signals[hold], np.full(hold.sum(), tick + self.extension, dtype=np.int64))
+            signals = signals[~hold]
+        phase = (self.phase[signals] + 1) % self.phase_count[signals]
+        ends = tick + self.phase_len[signals, phase]
+        if adaptive:
+            ends = np.where(self.phase_service[signals, phase], tick + self.min_green, ends)
+        self._enter(signals, phase, ends, tick)
+
+    def detect(self):
+        """
+        Queue detector counts per edge: cars in its last detector cells.
+        Also, per node, the load on its exits as cars per detector length of lane.
+        """
+        cars = self.model.car_columns()
+        edge, pos = cars[:, 1], cars[:, 2]
+        n = len(self.edge_len)
+        near = pos >= self.edge_len[edge] - self.detector
+        queue = np.bincount(edge[near], minlength=n)
+        cells = self.edge_len * self.model.lane_map.lanes
+        load = np.bincount(edge, minlength=n) * self.detector / np.maximum(cells, 1)
+        exits = np.bincount(self.edge_from, weights=load, minlength=len(self.out_degree))
+        return queue, exits / np.maximum(self.out_degree, 1)
+
+    def _keep_green(self, signals: np.ndarray, tick: int) -> np.ndarray:
+        """
+        Decide, for signals in a green phase, which keep it. Actuated: keep
+        it while nobody waits for the next green, or while cars still
+        arrive on this one and it is under max_green. Max pressure: keep
+        it while its approaches' queues, less the load on the exits they
+        feed, outweigh those of the next green, again up to max_green.
+        """
+        if not len(signals):
+            return np.zeros(0, dtype=bool)
+        queue, exit_load = self.detect()
+        owner, k = self._approaches(signals)
+        edges = self.approach_idx[k]
+        ew = self.edge_ew[edges].astype(bool)
+        sig = signals[owner]
+        now = self.phase[sig]
+        then = self.next_service[sig, now]
+        green_now = np.where(ew, self.phase_ew[sig, now], self.phase_ns[sig, now]) == GREEN
+        green_then = np.where(ew, self.phase_ew[sig, then], self.phase_ns[sig, then]) == GREEN
+        under_max = tick - self.phase_start[signals] < self.max_green
+        if self.mode == "actuated":
+            weight = queue[edges].astype(np.float64)
+        else:
+            weight = queue[edges] - exit_load[self.edge_to[edges]]
+        served = np.bincount(owner, weights=weight * green_now, minlength=len(signals))
+        waiting = np.bincount(owner, weights=weight * green_then, minlength=len(signals))
+        if self.mode == "actuated":
+            return (waiting == 0) | ((served > 0) & under_max)
+        return under_max & (served >= waiting)
+
+    def queued(self) -> int:
+        """Cars stopped within detector range of a signal."""
+        cars = self.model.car_columns()
+        edge, pos, vel = cars[:, 1], cars[:, 2], cars[:, 3]
+        at_signal = np.zeros(len(self.edge_len), dtype=bool)
+        at_signal[self.approach_idx] = True
+        return int((at_signal[edge] & (vel == 0) & (pos >= self.edge_len[edge] - self.detector)).sum())
+
+    def set_plan(self, s: int, plan: SignalPlan):
+        """Switch signal s to plan, at the point its cycle has reached on the current tick."""
+        self.plans[s] = plan
+        if len(plan.phases) > self.phase_ns.shape[1]:
+            self._tables()
+        else:
+            self._table_row(s, plan)
+            self.phase_service[s] = (self.phase_ns[s] == GREEN) | (self.phase_ew[s] == GREEN)
+        phase, ends = plan.locate(self.tick)
+        self._enter(np.array([s], dtype=np.int64), np.array([phase]), np.array([ends]), ends - plan.phases[phase][2])
+
+    def lights(self) -> list:
+        ns = self.state[self.node_at, NS].tolist()
+        ew = self.state[self.node_at, EW].tolist()
+        return [
+            {"id": node.id, "ns": STATE_NAMES[a], "ew": STATE_NAMES[b]}
+            for node, a, b in zip(self.nodes, ns, ew)
+        ]
+
+
+def green_wave(model, direction: str = "ew", speed: float = None) -> dict:
+    """
+    Offsets that give a platoon green after green along the rows ("ew",
+    travelling east) or columns ("ns", travelling south) of a grid, such
+    as create_city_grid() and create_manhattan_grid() build. speed is in
+    cells per tick and defaults to the mean free-flow speed. Returns the
+    re-timed plan for every signal on a row or column, keyed by node id.
+    """
+    if direction not in ("ew", "ns"):
+        raise ValueError("Green wave direction must be 'ew' or 'ns'")
+    if speed is None:
+        speed = max(1.0, model.max_v_global - model.p_slowdown)
+    signals = [n for n in model.nodes.values() if n.type == "intersection"]
+
+    # Each signal's next signal downstream: the nearest one straight ahead.
+    following = {}
+    for node in signals:
+        best = None
+        for edge in node.out_edges:
+            other = edge.to_node
+            if other.type != "intersection":
+                continue
+            ahead, across = (other.x - node.x, other.y - node.y)[::1 if direction == "ew" else -1]
+            if ahead > 0 and abs(across) * 4 < ahead and (best is None or ahead < best[0]):
+                best = (ahead, edge)
+        if best is not None:
+            following[node.id] = best[1]
+
+    arrival = {}
+    heads = {n.id for n in signals} - {e.to_node.id for e in following.values()}
+    for head in sorted(heads):
+        t, node_id = 0.0, head
+        while node_id not in arrival:
+            arrival[node_id] = t
+            edge = following.get(node_id)
+            if edge is None:
+                break
+            t += edge.length / speed
+            node_id = edge.to_node.id
+
+    column = 1 if direction == "ew" else 0
+    plans = {}
+    for node_id, t in arrival.items():
+        node = model.nodes[node_id]
+        base = model.signal_plans.get(node_id) or SignalPlan.two_phase(
+            node.green_duration, node.green_duration, node.yellow_duration)
+        # Ticks from the start of the cycle to this direction's green
+        lead = 0
+        for phase in base.phases:
+            if phase[column] == GREEN:
+                break
+            lead += phase[2]
+        plans[node_id] = SignalPlan(base.phases, round(t) - lead)
+    return plans
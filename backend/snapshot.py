@@ -0,0 +1,185 @@
+import io
+import json
+
+import numpy as np
+
+from .routing import Demand, Rerouter
+from .signals import SignalPlan
+
+# Bump whenever the layout of a snapshot changes
+SNAPSHOT_VERSION = 1
+
+SETTINGS = ("p_slowdown", "max_v_global", "car_spawn_rate", "light_green_duration", "light_yellow_duration")
+
+
+def snapshot(model) -> bytes:
+    """
+    The whole state of model as a compressed .npz blob: the road network,
+    every car, signal phases and plans, demand and re-routing state,
+    statistics, the tick and the random streams. restore() continues
+    the run exactly where it stopped.
+    """
+    model.sync()
+    nodes = list(model.nodes.values())
+    edges = list(model.edges.values())
+    cars = model.cars
+    point_ptr = np.zeros(len(edges) + 1, dtype=np.int64)
+    np.cumsum([len(e.points) for e in edges], out=point_ptr[1:])
+    stats = model.stats
+    history = stats.history.window()
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "tick": model.tick_count,
+        "next_car_id": model.next_car_id,
+        "engine": model.engine,
+        "seed": model.seed,
+        "settings": {name: getattr(model, name) for name in SETTINGS},
+        "trips": model.trips,
+        "map_key": model.map_key,
+        "signal_control": model.signal_control,
+        "signal_plans": {node_id: [plan.phases, plan.offset] for node_id, plan in model.signal_plans.items()},
+        "rngs": {name: rng.bit_generator.state for name, rng in model.rngs.items()},
+        "stats": {"velocity_sum": stats.velocity_sum, "crossings": stats.crossings,
+                  "recent_sum": stats.recent_sum, "counted": stats.counted},
+        "demand": None if model.demand is None else model.demand.rate,
+        "rerouter": None,
+    }
+    arrays = {
+        "node_ids": np.array([n.id for n in nodes], dtype=str),
+        "node_x": np.array([n.x for n in nodes], dtype=np.float64),
+        "node_y": np.array([n.y for n in nodes], dtype=np.float64),
+        "node_type": np.array([n.type for n in nodes], dtype=str),
+        "node_sink": np.array([n.sink for n in nodes], dtype=bool),
+        "node_green": np.array([n.green_duration for n in nodes], dtype=np.int64),
+        "node_yellow": np.array([n.yellow_duration for n in nodes], dtype=np.int64),
+        "edge_from": np.array([e.from_node.index for e in edges], dtype=np.int32),
+        "edge_to": np.array([e.to_node.index for e in edges], dtype=np.int32),
+        "edge_length": np.array([e.length for e in edges], dtype=np.int32),
+        "edge_lanes": np.array([e.lanes for e in edges], dtype=np.int32),
+        "edge_direction": np.array([e.direction for e in edges], dtype=str),
+        "edge_point_ptr": point_ptr,
+        "edge_points": np.array([p for e in edges for p in e.points], dtype=np.float64).reshape(-1, 2),
+        # Cars in pool order, which the per-car random draws are indexed by
+        "cars": np.array([(c.id, c.current_edge.index, c.position, c.lane, c.velocity, c.max_v, c.dest, c.entered)
+                          for c in cars], dtype=np.int64).reshape(-1, 8),
+        "merge_wait": model.merge_wait(),
+        "stats_loops": stats.loops,
+        "stats_recent": stats.recent,
+        "history": np.array([history[k] for k in history], dtype=np.float64).T,
+    }
+    if model._signals is not None:
+        signals = model._signals
+        arrays["signal_state"] = np.stack([signals.phase, signals.phase_start, signals.ends])
+        meta["signal_tick"] = signals.tick
+    if model.demand is not None:
+        arrays["demand_zones"] = model.demand.zones
+        arrays["demand_matrix"] = model.demand.matrix
+    rerouter = model.rerouter
+    if rerouter is not None:
+        # Live travel times have moved the router's costs away from the
+        # free-flow ones, so its tables are saved as they are.
+        router = model.router
+        meta["rerouter"] = {"interval": rerouter.interval, "alpha": rerouter.alpha, "threshold": rerouter.threshold,
+                            "budget": rerouter.budget, "per_tick": rerouter.per_tick, "version": router.version}
+        for name in ("travel", "exits", "ticks"):
+            if getattr(rerouter, name) is not None:
+                arrays[f"rerouter_{name}"] = getattr(rerouter, name)
+        arrays.update(route_dests=router.dests, route_next=router.next_edge, route_cost=router.cost,
+                      route_edge_cost=router.edge_cost, route_row_version=router.row_version)
+    arrays["meta"] = np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)
+    out = io.BytesIO()
+    np.savez_compressed(out, **arrays)
+    return out.getvalue()
+
+
+def restore(model, blob: bytes):
+    """Replace model's state with a snapshot() blob. Raises ValueError if the blob cannot be read."""
+    try:
+        with np.load(io.BytesIO(blob), allow_pickle=False) as g:
+            arrays = {name: g[name] for name in g.files}
+        meta = json.loads(arrays["meta"].tobytes().decode("utf-8"))
+    except (OSError, KeyError, ValueError, EOFError) as e:
+        raise ValueError(f"Unreadable snapshot: {e}") from None
+    if meta.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Snapshot version {meta.get('version')} is not {SNAPSHOT_VERSION}")
+    cars = arrays["cars"]
+    if model.pool.capacity is not None and len(cars) > model.pool.capacity:
+        raise ValueError(f"Snapshot has {len(cars)} cars; the model is limited to {model.pool.capacity}")
+
+    model.set_engine("python")
+    model.reset()
+    for name, value in meta["settings"].items():
+        setattr(model, name, value)
+    node_ids = arrays["node_ids"].tolist()
+    for node_id, x, y, t in zip(node_ids, arrays["node_x"].tolist(), arrays["node_y"].tolist(),
+                                arrays["node_type"].tolist()):
+        model.add_node(node_id, x, y, type=t)
+    for node, sink, green, yellow in zip(model.nodes.values(), arrays["node_sink"].tolist(),
+                                         arrays["node_green"].tolist(), arrays["node_yellow"].tolist()):
+        node.sink = sink
+        node.green_duration = green
+        node.yellow_duration = yellow
+    point_ptr = arrays["edge_point_ptr"].tolist()
+    points = [tuple(p) for p in arrays["edge_points"].tolist()]
+    for a, b, length, lanes, d, p0, p1 in zip(arrays["edge_from"].tolist(), arrays["edge_to"].tolist(),
+                                             arrays["edge_length"].tolist(), arrays["edge_lanes"].tolist(),
+                                             arrays["edge_direction"].tolist(), point_ptr, point_ptr[1:]):
+        model.add_edge(node_ids[a], node_ids[b], length=length, direction=d, points=points[p0:p1], lanes=lanes)
+
+    edges = list(model.edges.values())
+    for car_id, e, pos, lane, vel, max_v, dest, entered in cars.tolist():
+        car = model.pool.acquire()
+        car.id, car.position, car.lane, car.velocity, car.max_v = car_id, pos, lane, vel, max_v
+        car.dest, car.entered = dest, entered
+        car.current_edge = edges[e]
+        edges[e].cells[lane][pos] = car
+    model.tick_count = meta["tick"]
+    model.next_car_id = meta["next_car_id"]
+    model.trips = dict(meta["trips"])
+    model.map_key = meta["map_key"]
+    model.seed = meta["seed"]
+    for name, state in meta["rngs"].items():
+        model.rngs[name].bit_generator.state = state
+
+    model.signal_plans.update({node_id: SignalPlan(phases, offset)
+                               for node_id, (phases, offset) in meta["signal_plans"].items()})
+    model.signal_control = dict(meta["signal_control"])
+    if "signal_state" in arrays:
+        model._signals = None
+        signals = model.signals
+        signals.restore(meta["signal_tick"], *arrays["signal_state"])
+    model.merge_wait()[:] = arrays["merge_wait"]
+
+    stats = model.stats
+    stats.fit(len(edges))
+    stats.loops[:] = arrays["stats_loops"]
+    stats.recent[:] = arrays["stats_recent"]
+    for name, value in meta["stats"].items():
+        setattr(stats, name, value)
+    for row in arrays["history"].tolist():
+        stats.history.append(row)
+
+    if meta["demand"] is not None:
+        model.demand = Demand(arrays["demand_zones"], arrays["demand_matrix"], meta["demand"])
+    saved = meta["rerouter"]
+    if saved is not None:
+        rerouter = Rerouter(saved["interval"], saved["alpha"], saved["threshold"], saved["budget"])
+        rerouter.per_tick = saved["per_tick"]
+        rerouter.fit(len(edges))
+        for name in ("travel", "exits", "ticks"):
+            if f"rerouter_{name}" in arrays:
+                setattr(rerouter, name, arrays[f"rerouter_{name}"].copy())
+        model.rerouter = rerouter
+        router = model.router
+        router.edge_cost = arrays["route_edge_cost"].copy()
+        router._cost = router.edge_cost.tolist()
+        router.dests = arrays["route_dests"].copy()
+        router.row[:] = -1
+        router.row[router.dests] = np.arange(len(router.dests), dtype=np.int32)
+        router.next_edge = arrays["route_next"].copy()
+        router.cost = arrays["route_cost"].copy()
+        router.row_version = arrays["route_row_version"].copy()
+        router.version = saved["version"]
+    elif model.demand is not None:
+        model.router.prepare(model.demand.zones)
+    model.set_engine(meta["engine"])
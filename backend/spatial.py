@@ -0,0 +1,76 @@
+import numpy as np
+
+# Half the drawn width of a lane, in map units (see static/js/visualizer.js)
+LANE_MARGIN = 14
+
+
+class EdgeIndex:
+    """
+    A uniform grid over the bounding boxes of a model's edges, polyline
+    points and drawn road width included, for finding the edges inside
+    a viewport. Cells are sized so that there are about as many cells
+    as edges. Each cell lists the edges whose box overlaps it, stored
+    CSR-style in cell_ptr/cell_idx.
+    """
+
+    def __init__(self, model):
+        edges = list(model.edges.values())
+        self.edge_from = np.array([e.from_node.index for e in edges], dtype=np.int64)
+        self.edge_to = np.array([e.to_node.index for e in edges], dtype=np.int64)
+        boxes = np.zeros((len(edges), 4), dtype=np.float64)
+        for i, e in enumerate(edges):
+            xs = [e.from_node.x, e.to_node.x] + [x for x, _ in e.points]
+            ys = [e.from_node.y, e.to_node.y] + [y for _, y in e.points]
+            pad = LANE_MARGIN * e.lanes
+            boxes[i] = min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad
+        self.boxes = boxes
+        if not len(edges):
+            self.origin = np.zeros(2)
+            self.cell = 1.0
+            self.shape = (0, 0)
+            self.cell_ptr = np.zeros(1, dtype=np.int64)
+            self.cell_idx = np.zeros(0, dtype=np.int64)
+            return
+
+        self.origin = boxes[:, :2].min(axis=0)
+        extent = boxes[:, 2:].max(axis=0) - self.origin
+        self.cell = max(float(np.sqrt(extent[0] * extent[1] / len(edges))), 1.0)
+        self.shape = tuple(int(n) + 1 for n in extent // self.cell)
+        lo, hi = self._cells(boxes[:, :2]), self._cells(boxes[:, 2:])
+        cells, owners = [], []
+        for i, ((x0, y0), (x1, y1)) in enumerate(zip(lo.tolist(), hi.tolist())):
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    cells.append(cx * self.shape[1] + cy)
+                    owners.append(i)
+        cells = np.array(cells, dtype=np.int64)
+        order = np.argsort(cells, kind="stable")
+        self.cell_idx = np.array(owners, dtype=np.int64)[order]
+        self.cell_ptr = np.zeros(self.shape[0] * self.shape[1] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=self.shape[0] * self.shape[1]), out=self.cell_ptr[1:])
+
+    def _cells(self, points: np.ndarray) -> np.ndarray:
+        cells = ((points - self.origin) // self.cell).astype(np.int64)
+        return np.clip(cells, 0, np.array(self.shape) - 1)
+
+    def query(self, x0: float, y0: float, x1: float, y1: float) -> np.ndarray:
+        """Sorted indices of the edges whose box overlaps the rectangle."""
+        boxes = self.boxes
+        if not len(boxes) or x1 < x0 or y1 < y0:
+            return np.zeros(0, dtype=np.int64)
+        (cx0, cy0), (cx1, cy1) = self._cells(np.array([[x0, y0], [x1, y1]], dtype=np.float64)).tolist()
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) * 4 > len(self.cell_ptr):
+            # Most of the map is in view; testing every box is cheaper
+            candidates = np.arange(len(boxes))
+        else:
+            rows = [self.cell_idx[self.cell_ptr[c]:self.cell_ptr[c + 1]]
+                    for cx in range(cx0, cx1 + 1)
+                    for c in range(cx * self.shape[1] + cy0, cx * self.shape[1] + cy1 + 1)]
+            candidates = np.unique(np.concatenate(rows)) if rows else np.zeros(0, dtype=np.int64)
+        b = boxes[candidates]
+        inside = (b[:, 0] <= x1) & (b[:, 2] >= x0) & (b[:, 1] <= y1) & (b[:, 3] >= y0)
+        return candidates[inside]
+
+    def nodes(self, edges: np.ndarray) -> np.ndarray:
+        """Sorted indices of the nodes at either end of edges."""
+        return np.union1d(self.edge_from[edges], self.edge_to[edges])
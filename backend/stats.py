@@ -0,0 +1,125 @@
+import numpy as np
+
+# Columns of History, as named in get_statistics()
+HISTORY_FIELDS = ("tick", "speed", "density", "flow", "vehicleCount", "throughput")
+
+
+class History:
+    """
+    The last capacity rows of statistics in a fixed ring buffer, one
+    column per HISTORY_FIELDS entry. Appending is O(1); reading a window
+    copies only the rows asked for.
+    """
+
+    def __init__(self, capacity: int = 3600):
+        self.capacity = capacity
+        self.rows = np.zeros((capacity, len(HISTORY_FIELDS)), dtype=np.float64)
+        self.count = 0
+
+    def clear(self):
+        self.count = 0
+
+    def append(self, row: tuple):
+        self.rows[self.count % self.capacity] = row
+        self.count += 1
+
+    def window(self, since: int = None, count: int = None) -> dict:
+        """Rows after tick since (all kept rows for None), at most the last count, as lists per field."""
+        n = min(self.count, self.capacity)
+        if count is not None:
+            n = min(n, max(0, int(count)))
+        idx = np.arange(self.count - n, self.count) % self.capacity
+        rows = self.rows[idx]
+        if since is not None:
+            rows = rows[rows[:, 0] > since]
+        columns = {name: rows[:, i].tolist() for i, name in enumerate(HISTORY_FIELDS)}
+        columns["tick"] = [int(t) for t in columns["tick"]]
+        columns["vehicleCount"] = [int(v) for v in columns["vehicleCount"]]
+        return columns
+
+
+class TrafficStats:
+    """
+    Running aggregates behind SimulationModel.get_statistics(), updated by
+    the engines as cars move, spawn and leave, so reading them never scans
+    the cars or the edges.
+
+    Each edge has a loop detector at its stop line that counts the cars
+    leaving it (into the next edge or off the map). flow is the measured
+    flux over the last window ticks, in cars per tick per lane, which
+    is comparable to density times speed. throughput is the cars per
+    tick crossing any detector over the same window, so it follows
+    changes such as a new signal control within window ticks; crossings
+    is the total since the start.
+    """
+
+    def __init__(self, window: int = 60, history: int = 3600):
+        self.window = window
+        self.history = History(history)
+        self.cells = 0
+        self.lanes = 0
+        self.loops = np.zeros(0, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        """Forget the cars and counts, keeping the road network."""
+        self.velocity_sum = 0
+        self.crossings = 0
+        self.loops[:] = 0
+        self.recent = np.zeros(self.window, dtype=np.int64)
+        self.recent_sum = 0
+        self.counted = 0
+        self.history.clear()
+
+    def clear(self):
+        """Forget the road network too."""
+        self.cells = 0
+        self.lanes = 0
+        self.loops = np.zeros(0, dtype=np.int64)
+        self.reset()
+
+    def add_edge(self, length: int, lanes: int):
+        self.cells += length * lanes
+        self.lanes += lanes
+
+    def fit(self, edges: int):
+        """Grow the detector counts to cover edges new since the last tick."""
+        if len(self.loops) < edges:
+            self.loops = np.concatenate([self.loops, np.zeros(edges - len(self.loops), dtype=np.int64)])
+
+    def cross(self, edge: int):
+        """One car passed edge's detector."""
+        self.loops[edge] += 1
+        self.crossings += 1
+
+    def cross_many(self, edges: np.ndarray):
+        np.add.at(self.loops, edges, 1)
+        self.crossings += len(edges)
+
+    def end_tick(self, tick: int, vehicles: int):
+        """Close tick's flow count and record its row of history."""
+        slot = tick % self.window
+        passed = self.crossings - self.counted
+        self.counted = self.crossings
+        self.recent_sum += passed - int(self.recent[slot])
+        self.recent[slot] = passed
+        self.history.append(self._row(tick, vehicles))
+
+    def _row(self, tick: int, vehicles: int) -> tuple:
+        speed = self.velocity_sum / vehicles if vehicles else 0.0
+        density = vehicles / self.cells if self.cells else 0.0
+        ticks = min(tick, self.window)
+        flow = self.recent_sum / (ticks * self.lanes) if ticks and self.lanes else 0.0
+        throughput = self.recent_sum / ticks if ticks else 0.0
+        return tick, speed, density, flow, vehicles, throughput
+
+    def summary(self, tick: int, vehicles: int) -> dict:
+        _, speed, density, flow, _, throughput = self._row(tick, vehicles)
+        return {
+            "speed": round(speed, 2),
+            "density": round(density, 3),
+            "flow": round(flow, 3),
+            "vehicleCount": vehicles,
+            "throughput": round(throughput, 3),
+            "crossings": self.crossings
+        }
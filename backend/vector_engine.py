@@ -0,0 +1,316 @@
+import numpy as np
+
+from .junctions import resolve_merges
+
+
+class VectorEngine:
+    """
+    Struct-of-arrays Nagel-Schreckenberg backend for SimulationModel.step.
+
+    While active, car state lives in flat NumPy buffers and the Car/Edge
+    objects are only refreshed on flush(). Each tick lets cars change
+    lanes, moves every car along its own lane, then lets waiting leaders
+    cross nodes through
+    resolve_merges(), like the Python path, so both engines agree for
+    the same seed.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.active = False
+        self.dirty = False
+
+    def load(self):
+        """Build the static graph buffers and pull car state from the objects."""
+        model = self.model
+        self.edges = list(model.edges.values())
+        self.nodes = list(model.nodes.values())
+        self.cars = model.cars
+
+        self.edge_len = np.array([e.length for e in self.edges], dtype=np.int32)
+        self.edge_lanes = np.array([e.lanes for e in self.edges], dtype=np.int32)
+        # Each edge's lanes lie one after another in the cell buffer
+        self.edge_off = np.zeros(len(self.edges), dtype=np.int64)
+        if len(self.edges) > 1:
+            np.cumsum(self.edge_len[:-1].astype(np.int64) * self.edge_lanes[:-1], out=self.edge_off[1:])
+        self.lane_base = model.lane_map.lane_base
+        self.multilane = bool(len(self.edges)) and int(self.edge_lanes.max()) > 1
+        self.edge_to = np.array([e.to_node.index for e in self.edges], dtype=np.int32)
+
+        self.node_sink = np.array([n.sink for n in self.nodes], dtype=bool)
+
+        self.cells = np.full(int((self.edge_len.astype(np.int64) * self.edge_lanes).sum()), -1, dtype=np.int32)
+
+        n = len(self.cars)
+        capacity = model.pool.capacity or max(64, n * 2)
+        self.car_id = np.zeros(capacity, dtype=np.int64)
+        self.car_edge = np.zeros(capacity, dtype=np.int32)
+        self.car_pos = np.zeros(capacity, dtype=np.int32)
+        self.car_lane = np.zeros(capacity, dtype=np.int32)
+        self.car_vel = np.zeros(capacity, dtype=np.int32)
+        self.car_maxv = np.zeros(capacity, dtype=np.int32)
+        self.car_dest = np.zeros(capacity, dtype=np.int32)
+        self.car_entered = np.zeros(capacity, dtype=np.int64)
+        self.n = 0
+        for car in self.cars:
+            self._append(car)
+
+        self.active = True
+        self.dirty = False
+
+    def invalidate(self):
+        """Hand state back to the objects; buffers are rebuilt on the next step."""
+        self.flush()
+        self.active = False
+
+    def discard(self):
+        """Drop the buffers without writing them back (objects were reset)."""
+        self.active = False
+        self.dirty = False
+
+    def _append(self, car):
+        i = self.n
+        if i == len(self.car_edge):
+            for name in ("car_id", "car_edge", "car_pos", "car_lane", "car_vel", "car_maxv", "car_dest", "car_entered"):
+                arr = getattr(self, name)
+                grown = np.zeros(len(arr) * 2, dtype=arr.dtype)
+                grown[:i] = arr[:i]
+                setattr(self, name, grown)
+        e = car.current_edge.index
+        self.car_id[i] = car.id
+        self.car_edge[i] = e
+        self.car_pos[i] = car.position
+        self.car_lane[i] = car.lane
+        self.car_vel[i] = car.velocity
+        self.car_maxv[i] = car.max_v
+        self.car_dest[i] = car.dest
+        self.car_entered[i] = car.entered
+        self.cells[self._cell(e, car.lane, car.position)] = i
+        self.n = i + 1
+
+    def _cell(self, edge, lane, pos):
+        return self.edge_off[edge] + lane * self.edge_len[edge] + pos
+
+    def spawn_car(self, edge, dest: int = -1):
+        e = edge.index
+        starts = self._cell(e, np.arange(edge.lanes), 0)
+        free = np.flatnonzero(self.cells[starts] < 0)
+        if not len(free):
+            return None
+        car = self.model._make_car(edge, dest, int(free[0]))
+        if car is None:
+            return None
+        self._append(car)
+        self.dirty = True
+        return car
+
+    def flush(self):
+        """Write buffer state back into the Car objects and Edge.cells."""
+        if not self.active or not self.dirty:
+            return
+        for edge in self.edges:
+            for cells in edge.cells:
+                cells[:] = [None] * edge.length
+        n = self.n
+        for car, e, p, l, v, t in zip(self.cars, self.car_edge[:n].tolist(), self.car_pos[:n].tolist(),
+                                      self.car_lane[:n].tolist(), self.car_vel[:n].tolist(),
+                                      self.car_entered[:n].tolist()):
+            edge = self.edges[e]
+            car.current_edge = edge
+            car.position = p
+            car.lane = l
+            car.velocity = v
+            car.entered = t
+            edge.cells[l][p] = car
+        self.dirty = False
+
+    def columns(self):
+        n = self.n
+        return np.stack([self.car_id[:n], self.car_edge[:n], self.car_pos[:n], self.car_vel[:n],
+                         self.car_lane[:n]], axis=1)
+
+    def _advance(self, v, maxv, gap, u):
+        v = np.where(v < maxv, v + 1, v)
+        v = np.minimum(v, gap)
+        v = v - ((v > 0) & (u < self.model.p_slowdown))
+        return np.maximum(v, 0)
+
+    def step(self, u_slow, u_turn):
+        if not self.active:
+            self.load()
+        n = self.n
+        if n == 0:
+            return
+        self.dirty = True
+        if self.multilane:
+            self._change_lanes()
+
+        edge = self.car_edge[:n]
+        pos = self.car_pos[:n]
+        lane = self.car_lane[:n]
+        vel = self.car_vel[:n]
+        maxv = self.car_maxv[:n]
+        slot = self.lane_base[edge] + lane
+
+        # Walking the cell buffer yields cars grouped by lane in position
+        # order, so each lane's leader is the last car of its run.
+        order = self.cells[np.flatnonzero(self.cells >= 0)]
+        e_s = edge[order]
+        p_s = pos[order]
+        s_s = slot[order]
+        boundary = np.flatnonzero(s_s[1:] != s_s[:-1])
+        lead_k = np.append(boundary, n - 1)
+        tail_k = np.insert(boundary + 1, 0, 0)
+
+        lead = order[lead_k]
+        lead_edge = e_s[lead_k]
+        lead_gap = self.edge_len[lead_edge] - 1 - p_s[lead_k]
+        cand = (lead_gap == 0) & self.model.signals.edge_green[lead_edge]
+        # Leaders at a green stop line leave the map or wait to cross into
+        # their next edge. Either way they do not move along their edge, and
+        # followers see them stopped at its end.
+        arrived = cand & (self.car_dest[lead] == self.edge_to[lead_edge])
+        sink = arrived | (cand & self.node_sink[self.edge_to[lead_edge]])
+        cand &= ~sink
+
+        new_pos_s = p_s.astype(np.int64)
+        new_vel_s = np.zeros(n, dtype=np.int64)
+        ahead_pos = np.zeros(n, dtype=np.int64)
+
+        k = lead_k
+        c = order[k]
+        v = self._advance(vel[c], maxv[c], lead_gap, u_slow[c])
+        new_vel_s[k] = v
+        new_pos_s[k] = p_s[k] + v
+        ahead_pos[k] = new_pos_s[k]
+
+        active = lead_k
+        count = lead_k - tail_k + 1
+        r = 1
+        while True:
+            keep = count > r
+            active = active[keep]
+            count = count[keep]
+            if not len(active):
+                break
+            k = active - r
+            c = order[k]
+            gap = ahead_pos[k + 1] - p_s[k] - 1
+            v = self._advance(vel[c], maxv[c], gap, u_slow[c])
+            new_vel_s[k] = v
+            new_pos_s[k] = p_s[k] + v
+            ahead_pos[k] = new_pos_s[k]
+            r += 1
+
+        self.cells[self._cell(edge, lane, pos)] = -1
+
+        new_edge = edge.copy()
+        new_lane = lane.copy()
+        new_pos = np.empty(n, dtype=np.int32)
+        new_vel = np.empty(n, dtype=np.int32)
+        new_pos[order] = new_pos_s
+        new_vel[order] = new_vel_s
+
+        # Then the waiting leaders cross into lanes whose first cell is free.
+        moved = np.zeros(0, dtype=np.int64)
+        if cand.any():
+            cars = lead[cand]
+            edges = lead_edge[cand].astype(np.int64)
+            target = self._next_edges(cars, edges, u_turn)
+            entry = self.model.lane_map.entry_lanes(edges, lane[cars], target)
+            target_slot = np.where(target >= 0, self.lane_base[np.maximum(target, 0)] + entry, -1)
+            taken = np.zeros(int(self.lane_base[-1]), dtype=bool)
+            taken[slot[new_pos == 0]] = True
+            free = ~taken[np.maximum(target_slot, 0)]
+            won = resolve_merges(slot[cars], target_slot, free, self.model.merge_wait(), self.model.tick_count)
+            moved = cars[won]
+            new_edge[moved] = target[won]
+            new_lane[moved] = entry[won]
+            new_pos[moved] = 0
+            new_vel[moved] = np.minimum(1, vel[moved])
+
+        tick = self.model.tick_count
+        rerouter = self.model.rerouter
+        left = np.concatenate([moved, lead[sink]])
+        self.model.stats.cross_many(edge[left])
+        if rerouter is not None:
+            rerouter.record_many(edge[left], tick - self.car_entered[left])
+        self.car_entered[moved] = tick
+
+        self.car_edge[:n] = new_edge
+        self.car_pos[:n] = new_pos
+        self.car_lane[:n] = new_lane
+        self.car_vel[:n] = new_vel
+        self.cells[self._cell(new_edge, new_lane, new_pos)] = np.arange(n, dtype=np.int32)
+
+        self.model.trips["completed"] += int(arrived.sum())
+        for car in [self.cars[i] for i in np.sort(lead[sink])[::-1].tolist()]:
+            self._release(car)
+        self.model.stats.velocity_sum = int(self.car_vel[:self.n].sum())
+
+    def _release(self, car):
+        """Swap-remove a car from the buffers, mirroring CarPool.release."""
+        i = car.index
+        last = self.n - 1
+        self.cells[self._cell(self.car_edge[i], self.car_lane[i], self.car_pos[i])] = -1
+        if i != last:
+            for arr in (self.car_id, self.car_edge, self.car_pos, self.car_lane, self.car_vel, self.car_maxv,
+                        self.car_dest, self.car_entered):
+                arr[i] = arr[last]
+            self.cells[self._cell(self.car_edge[i], self.car_lane[i], self.car_pos[i])] = i
+        self.n = last
+        self.model.pool.release(car)
+
+    def _change_lanes(self):
+        """Symmetric lane changing, as SimulationModel._change_lanes, for all cars at once."""
+        n = self.n
+        step = 1 if self.model.tick_count % 2 == 0 else -1
+        lookback = self.model.max_v_global
+        edge = self.car_edge[:n]
+        to = self.car_lane[:n] + step
+        c = np.flatnonzero((to >= 0) & (to < self.edge_lanes[edge]))
+        if not len(c):
+            return
+        occupied = np.flatnonzero(self.cells >= 0)
+        e = edge[c]
+        length = self.edge_len[e].astype(np.int64)
+        here = self._cell(e, self.car_lane[c], self.car_pos[c])
+        end = here - self.car_pos[c] + length
+
+        # Room ahead in the car's own lane
+        k = np.searchsorted(occupied, here, side="right")
+        ahead = occupied[np.minimum(k, len(occupied) - 1)]
+        gap = np.where((k < len(occupied)) & (ahead < end), ahead, end) - here - 1
+        hindered = (gap < np.minimum(self.car_vel[c] + 1, self.car_maxv[c])) & (self.cells[here + step * length] < 0)
+        c, here, end, gap, length = c[hindered], here[hindered], end[hindered], gap[hindered], length[hindered]
+        there = here + step * length
+        start = end + step * length - length
+
+        # Room ahead and behind in the other lane
+        k = np.searchsorted(occupied, there)
+        ahead = occupied[np.minimum(k, len(occupied) - 1)]
+        other_gap = np.where((k < len(occupied)) & (ahead < start + length), ahead, start + length) - there - 1
+        behind = occupied[np.maximum(k - 1, 0)]
+        back = np.where((k > 0) & (behind >= start), there - behind - 1, lookback)
+
+        change = (other_gap > gap) & (back >= lookback)
+        c = c[change]
+        self.cells[here[change]] = -1
+        self.cells[there[change]] = c
+        self.car_lane[c] += step
+
+    def _next_edges(self, cars, edges, u_turn):
+        """Where each car waiting at the end of edges turns next: its route, else an exit its lane serves (-1 if none)."""
+        node = self.edge_to[edges]
+        lanes = self.model.lane_map
+        s = self.lane_base[edges] + self.car_lane[cars]
+        lo = lanes.exit_ptr[s]
+        deg = lanes.exit_ptr[s + 1] - lo
+        pick = lo + (u_turn[cars] * deg).astype(np.int32)
+        nxt = np.where(deg > 0, lanes.exit_idx[np.minimum(pick, len(lanes.exit_idx) - 1)], -1).astype(np.int64)
+        dest = self.car_dest[cars]
+        routed = dest >= 0
+        if routed.any():
+            hop = self.model.router.lookup(dest[routed], node[routed])
+            nxt[routed] = np.where(hop >= 0, hop, nxt[routed])
+        return nxt
@@ -0,0 +1,24 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SimulationWorker:
+    """
+    The one thread that every SimulationModel call goes through.
+
+    The model is not thread-safe, so ticks, frame snapshots and the
+    commands that rebuild or query it all run here in submission order.
+    The event loop only awaits the results and stays free for sockets
+    and HTTP requests however long a tick takes.
+    """
+
+    def __init__(self, name: str = "simulation"):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    async def call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
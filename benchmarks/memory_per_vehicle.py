@@ -0,0 +1,61 @@
+"""
+Memory cost of a vehicle in each simulation engine.
+
+Usage: python benchmarks/memory_per_vehicle.py [--vehicles 50000] [--grid 40]
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.model import SimulationModel
+
+
+def fill(model: SimulationModel, vehicles: int):
+    edge_ids = list(model.edges.keys())
+    while len(model.cars) < vehicles:
+        for edge_id in edge_ids:
+            model.spawn_car(edge_id)
+            if len(model.cars) >= vehicles:
+                break
+        model.step()
+
+
+def measure(engine: str, vehicles: int, grid: int, seed: int = 0):
+    model = SimulationModel(engine=engine, seed=seed, max_cars=None)
+    model.car_spawn_rate = 0
+    model.create_city_grid(grid, grid)
+    # A closed grid, so no car leaves at the edge while it fills
+    model.mark_sinks()
+    model.clear_vehicles()
+    model.step()
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fill(model, vehicles)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    count = len(model.cars)
+    return count, (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vehicles", type=int, default=50000)
+    parser.add_argument("--grid", type=int, default=40)
+    args = parser.parse_args()
+
+    print(f"{'engine':<8} {'vehicles':>9} {'bytes/vehicle':>14}")
+    for engine in ("python", "numpy"):
+        count, per_vehicle = measure(engine, args.vehicles, args.grid)
+        print(f"{engine:<8} {count:>9} {per_vehicle:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+"""
+Benchmarks for the tick loop, state and frame serialization, and map import.
+
+Usage: python benchmarks/suite.py [--quick] [--only tick,state,frames,osm,layouts]
+           [--engines python,numpy] [--save benchmarks/baseline.json]
+           [--compare benchmarks/baseline.json] [--tolerance 0.25]
+       python benchmarks/suite.py --record NAME SOUTH,WEST,NORTH,EAST
+
+Groups:
+    tick      step() on create_city_grid sizes at increasing vehicle counts
+    state     get_state() and get_statistics() on a loaded grid
+    frames    DeltaEncoder frames as sent over the WebSocket, JSON and binary
+    osm       OSM import of the Overpass responses in benchmarks/fixtures/
+              (recorded with --record), or of a generated one if there are none;
+              and generate_from_bounds() racing a fast and a slow local mirror,
+              which fails if it waits for the slow one
+    layouts   the city_layouts/ files and CityMapLoader patterns
+
+Every case runs in a fresh process, so its peak RSS is its own. Results
+are printed as a table and, with --save, written as JSON. --compare
+checks them against a saved baseline and exits with status 1 if any
+metric is worse by more than --tolerance (a fraction of the baseline).
+"""
+import argparse
+import contextlib
+import http.server
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from backend.batch import build_layout
+from backend.frames import DeltaEncoder, FORMATS
+from backend.model import ENGINES, SimulationModel
+from backend.osm_cache import OSMCache
+from backend.osm_generator import OSMGenerator
+from backend.osm_stream import iter_osm_elements
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+GROUPS = ("tick", "state", "frames", "osm", "layouts")
+
+# Whether a larger value of each metric is better (+1) or worse (-1);
+# --compare only checks the metrics named here.
+METRICS = {
+    "ticks_per_sec": +1,
+    "us_per_vehicle": -1,
+    "get_state_ms": -1,
+    "get_state_bytes": -1,
+    "get_statistics_us": -1,
+    "encode_us": -1,
+    "keyframe_bytes": -1,
+    "bytes_per_frame": -1,
+    "load_ms": -1,
+    "elements_per_sec": +1,
+    "peak_rss_mb": -1,
+}
+
+# (rows/cols, vehicle counts) for the tick group; --quick runs the first of each
+GRIDS = ((8, (500, 1000)), (16, (1000, 4000)), (32, (4000, 16000)))
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, or None where it cannot be read."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def quiet():
+    """Hide the DEBUG prints of map building."""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def grid_model(engine: str, size: int, vehicles: int) -> SimulationModel:
+    """A size x size grid holding about vehicles cars, with spawning off so the count stays put."""
+    model = SimulationModel(engine=engine, seed=0, max_cars=None)
+    with quiet():
+        model.create_city_grid(size, size)
+    # A closed grid, so the load stays put with no cars leaving at the edge
+    model.mark_sinks()
+    model.car_spawn_rate = 0
+    model.clear_vehicles()
+    fill(model, vehicles)
+    return model
+
+
+def fill(model: SimulationModel, vehicles: int):
+    # Cars start at the head of an edge, so fill over a few ticks
+    for _ in range(200):
+        if len(model.cars) >= vehicles:
+            break
+        model.spawn_initial_cars(vehicles - len(model.cars))
+        model.step()
+
+
+def bench_tick(engine: str, size: int, vehicles: int, ticks: int) -> dict:
+    model = grid_model(engine, size, vehicles)
+    for _ in range(10):
+        model.step()
+    result = {"edges": len(model.edges)}
+    result.update(run_ticks(model, ticks))
+    return result
+
+
+def bench_state(engine: str, size: int, vehicles: int, repeat: int) -> dict:
+    model = grid_model(engine, size, vehicles)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        state = model.get_state()
+    get_state = (time.perf_counter() - started) / repeat
+    started = time.perf_counter()
+    for _ in range(repeat * 20):
+        model.get_statistics()
+    get_statistics = (time.perf_counter() - started) / (repeat * 20)
+    return {
+        "vehicles": len(model.cars),
+        "get_state_ms": round(get_state * 1e3, 3),
+        "get_state_bytes": len(json.dumps(state, separators=(",", ":"))),
+        "get_statistics_us": round(get_statistics * 1e6, 2),
+    }
+
+
+def bench_frames(engine: str, size: int, vehicles: int, fmt: str, ticks: int) -> dict:
+    """One frame per tick, as a session streams them; keyframes every 50 frames."""
+    model = grid_model(engine, size, vehicles)
+    frames = DeltaEncoder(keyframe_interval=50)
+    keyframe, sizes, elapsed = 0, [], 0.0
+    for _ in range(ticks):
+        model.step()
+        started = time.perf_counter()
+        frame = frames.encode(model)
+        data = frame.encode(fmt)
+        elapsed += time.perf_counter() - started
+        if frame.kind == 0 and not keyframe:
+            keyframe = len(data)
+        else:
+            sizes.append(len(data))
+    return {
+        "vehicles": len(model.cars),
+        "encode_us": round(elapsed * 1e6 / ticks, 1),
+        "keyframe_bytes": keyframe,
+        "bytes_per_frame": round(float(np.mean(sizes)), 1) if sizes else None,
+    }
+
+
+def synthetic_fixture(path: str, size: int = 60, seed: int = 0) -> dict:
+    """
+    Write an Overpass-style JSON response of a jittered size x size street
+    grid, with shape points between junctions and a few dead ends, and
+    return its bounds. Stands in for recorded fixtures when there are none.
+    """
+    rng = np.random.default_rng(seed)
+    south, west = 48.85, 2.33
+    step = 0.0009
+    ids = np.arange(size * size).reshape(size, size) + 1
+    lat = south + step * (np.arange(size)[:, None] + rng.uniform(-0.15, 0.15, (size, size)))
+    lon = west + step * (np.arange(size)[None, :] + rng.uniform(-0.15, 0.15, (size, size)))
+    elements = [{"type": "node", "id": int(i), "lat": float(a), "lon": float(o)}
+                for i, a, o in zip(ids.ravel(), lat.ravel(), lon.ravel())]
+    next_id = size * size + 1
+    ways = []
+    for lines in (ids, ids.T):
+        for line in lines:
+            way = [int(line[0])]
+            for a, b in zip(line[:-1].tolist(), line[1:].tolist()):
+                # Two shape points per block, which the import folds into a polyline
+                for t in (1 / 3, 2 / 3):
+                    pa, pb = elements[a - 1], elements[b - 1]
+                    elements.append({"type": "node", "id": next_id,
+                                     "lat": pa["lat"] + t * (pb["lat"] - pa["lat"]) + rng.normal(0, step / 40),
+                                     "lon": pa["lon"] + t * (pb["lon"] - pa["lon"]) + rng.normal(0, step / 40)})
+                    way.append(next_id)
+                    next_id += 1
+                way.append(b)
+            ways.append(way)
+    highways = ("primary", "secondary", "tertiary", "residential", "unclassified")
+    for way in list(ways):
+        # Break some streets, leaving dead ends
+        if len(way) > 9 and rng.random() < 0.2:
+            cut = int(rng.integers(3, len(way) - 3))
+            ways.append(way[cut + 3:])
+            way[:] = way[:cut]
+    for i, way in enumerate(ways):
+        elements.append({"type": "way", "id": i + 1, "nodes": way,
+                         "tags": {"highway": highways[int(rng.integers(len(highways)))]}})
+    with open(path, "w") as f:
+        json.dump({"version": 0.6, "generator": "benchmarks/suite.py", "elements": elements}, f)
+    return {"south": float(lat.min()), "west": float(lon.min()), "north": float(lat.max()), "east": float(lon.max())}
+
+
+def fixtures() -> list:
+    """(name, path, bounds) of each recorded fixture."""
+    found = []
+    if os.path.isdir(FIXTURES):
+        for name in sorted(os.listdir(FIXTURES)):
+            if name.endswith(".bounds.json"):
+                continue
+            stem, ext = os.path.splitext(name)
+            bounds_path = os.path.join(FIXTURES, f"{stem}.bounds.json")
+            if ext in (".json", ".osm", ".xml") and os.path.exists(bounds_path):
+                with open(bounds_path) as f:
+                    found.append((stem, os.path.join(FIXTURES, name), json.load(f)))
+    return found
+
+
+def bench_osm(path: str, bounds: dict, ticks: int) -> dict:
+    model = SimulationModel(engine="numpy", seed=0)
+    with open(path, "rb") as f:
+        elements = sum(1 for _ in iter_osm_elements(f))
+    started = time.perf_counter()
+    with quiet():
+        OSMGenerator.load_file(model, path, bounds)
+    load = time.perf_counter() - started
+    result = {
+        "bytes": os.path.getsize(path),
+        "nodes": len(model.nodes),
+        "edges": len(model.edges),
+        "load_ms": round(load * 1e3, 1),
+        "elements_per_sec": round(elements / load),
+    }
+    if model.edges and ticks:
+        model.car_spawn_rate = 0
+        fill(model, 2 * len(model.edges))
+        result.update(run_ticks(model, ticks))
+    return result
+
+
+def mirror(path: str, delay: float) -> http.server.ThreadingHTTPServer:
+    """A local stand-in Overpass mirror answering every query with the file at path after delay seconds."""
+    with open(path, "rb") as f:
+        body = f.read()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(delay)
+            try:
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except OSError:
+                # The client stopped listening once another mirror won.
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_mirror_race(path: str, bounds: dict, slow: float, workdir: str) -> dict:
+    """
+    generate_from_bounds() with a cold cache against a fast and a slow
+    mirror. The synchronous entry point must return with the fast one, not
+    once the losing download gives up.
+    """
+    servers = [mirror(path, slow), mirror(path, 0.0)]
+    OSMGenerator.OVERPASS_URLS = [f"http://127.0.0.1:{s.server_port}/" for s in servers]
+    OSMGenerator.cache = OSMCache(directory=os.path.join(workdir, "mirror_race_cache"))
+    model = SimulationModel(engine="numpy", seed=0)
+    started = time.perf_counter()
+    with quiet():
+        OSMGenerator.generate_from_bounds(model, bounds)
+    elapsed = time.perf_counter() - started
+    for server in servers:
+        server.shutdown()
+    if elapsed >= slow:
+        raise RuntimeError(f"generate_from_bounds took {elapsed:.2f}s, waiting for the {slow}s mirror")
+    return {"edges": len(model.edges), "fetch_ms": round(elapsed * 1e3, 1), "slow_mirror_ms": round(slow * 1e3)}
+
+
+def run_ticks(model: SimulationModel, ticks: int, repeat: int = 3) -> dict:
+    """Step model repeat times ticks ticks, reporting the fastest run (the least disturbed by the machine)."""
+    best = None
+    for _ in range(repeat):
+        counted = 0
+        started = time.perf_counter()
+        for _ in range(ticks):
+            model.step()
+            counted += len(model.cars)
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best[0]:
+            best = elapsed, counted
+    elapsed, counted = best
+    return {
+        "vehicles": round(counted / ticks),
+        "ticks_per_sec": round(ticks / elapsed, 2),
+        "us_per_vehicle": round(elapsed * 1e6 / counted, 3) if counted else None,
+    }
+
+
+def bench_layout(layout: str, engine: str, ticks: int) -> dict:
+    model = SimulationModel(engine=engine, seed=0)
+    started = time.perf_counter()
+    with quiet():
+        build_layout(model, layout)
+    load = time.perf_counter() - started
+    result = {"nodes": len(model.nodes), "edges": len(model.edges), "load_ms": round(load * 1e3, 2)}
+    result.update(run_ticks(model, ticks))
+    # A handful of cars; per vehicle is mostly the fixed cost of a tick
+    del result["us_per_vehicle"]
+    return result
+
+
+def run_case(case: tuple) -> dict:
+    name, fn, args = case
+    result = globals()[fn](*args)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def cases(groups: list, engines: list, quick: bool, workdir: str) -> list:
+    """(name, function name, args) of every case in groups."""
+    ticks = 20 if quick else 100
+    out = []
+    if "tick" in groups:
+        for size, counts in GRIDS[:2] if quick else GRIDS:
+            for vehicles in counts[:1] if quick else counts:
+                for engine in engines:
+                    out.append((f"tick/{engine}/grid{size}/v{vehicles}", "bench_tick", (engine, size, vehicles, ticks)))
+    if "state" in groups:
+        for engine in engines:
+            out.append((f"state/{engine}/grid16/v4000", "bench_state", (engine, 16, 4000, 3 if quick else 10)))
+    if "frames" in groups:
+        for fmt in FORMATS:
+            for engine in engines:
+                out.append((f"frames/{fmt}/{engine}/grid16/v4000", "bench_frames",
+                            (engine, 16, 4000, fmt, 60 if quick else 200)))
+    if "osm" in groups:
+        found = fixtures()
+        if not found:
+            path = os.path.join(workdir, "synthetic.json")
+            found = [("synthetic", path, synthetic_fixture(path, 30 if quick else 60))]
+        for name, path, bounds in found:
+            out.append((f"osm/{name}", "bench_osm", (path, bounds, ticks)))
+        name, path, bounds = found[0]
+        out.append(("osm/mirror_race", "bench_mirror_race", (path, bounds, 5.0, workdir)))
+    if "layouts" in groups:
+        layouts = [f"json:{os.path.join(ROOT, 'city_layouts', f)}"
+                   for f in sorted(os.listdir(os.path.join(ROOT, "city_layouts"))) if f.endswith(".json")]
+        layouts += [f"pattern:{p}" for p in ("manhattan", "roundabout", "t_intersection")]
+        for layout in layouts:
+            label = os.path.splitext(os.path.basename(layout.partition(":")[2]))[0]
+            for engine in engines:
+                out.append((f"layouts/{engine}/{label}", "bench_layout", (layout, engine, ticks * 2)))
+    return out
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Lines describing every metric worse than its baseline by more than tolerance."""
+    worse = []
+    for name, metrics in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        for metric, sign in METRICS.items():
+            old, new = base.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if sign * change < -tolerance:
+                worse.append(f"{name} {metric}: {old} -> {new} ({change:+.0%})")
+    return worse
+
+
+def record(name: str, bounds_text: str):
+    """Save the Overpass response for a box as a fixture."""
+    south, west, north, east = (float(x) for x in bounds_text.split(","))
+    bounds = {"south": south, "west": west, "north": north, "east": east}
+    import asyncio
+    path = asyncio.run(OSMGenerator.fetch(bounds))
+    os.makedirs(FIXTURES, exist_ok=True)
+    shutil.move(path, os.path.join(FIXTURES, f"{name}.json"))
+    with open(os.path.join(FIXTURES, f"{name}.bounds.json"), "w") as f:
+        json.dump(bounds, f)
+    print(f"Recorded {os.path.getsize(os.path.join(FIXTURES, f'{name}.json'))} bytes to {FIXTURES}/{name}.json")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument("--quick", action="store_true", help="smaller sizes and fewer ticks")
+    parser.add_argument("--only", default=",".join(GROUPS), help="comma-separated groups to run")
+    parser.add_argument("--engines", default=",".join(ENGINES))
+    parser.add_argument("--save", metavar="PATH", help="write the results as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="baseline JSON to check the results against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--inline", action="store_true", help="run every case in this process (shared peak RSS)")
+    parser.add_argument("--record", nargs=2, metavar=("NAME", "BOUNDS"), help="save an Overpass fixture and exit")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record(*args.record)
+        return 0
+    groups = [g for g in args.only.split(",") if g]
+    engines = [e for e in args.engines.split(",") if e]
+    unknown = set(groups) - set(GROUPS) or set(engines) - set(ENGINES)
+    if unknown:
+        parser.error(f"Unknown groups or engines: {sorted(unknown)}")
+
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="urbanflow-bench-")
+    context = multiprocessing.get_context("spawn")
+    try:
+        for case in cases(groups, engines, args.quick, workdir):
+            if args.inline:
+                result = run_case(case)
+            else:
+                with context.Pool(1) as pool:
+                    result = pool.apply(run_case, (case,))
+            results[case[0]] = result
+            print(f"{case[0]:<44} " + " ".join(f"{k}={v}" for k, v in result.items()), flush=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "machine": {"python": platform.python_version(), "numpy": np.__version__,
+                            "platform": platform.platform(), "processor": platform.machine(),
+                            "cpus": os.cpu_count()},
+                "quick": args.quick,
+                "results": results,
+            }, f, indent=1)
+        print(f"Saved {len(results)} results to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("quick") != args.quick:
+            print("Warning: baseline and this run differ in --quick; sizes will not match")
+        worse = compare(results, baseline, args.tolerance)
+        for line in worse:
+            print(f"REGRESSION {line}")
+        if worse:
+            return 1
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,9 @@ let flowChart = null;
 let vehiclesChart = null;
 let densityChart = null;
 
+// Points kept on each chart
+window.CHART_POINTS = 60;
+
 window.setupCharts = function () {
     setupVelocityChart();
     setupFlowChart();
@@ -160,11 +163,27 @@ function getChartOptions(yAxisLabel) {
     };
 }
 
+window.applyHistory = function (history) {
+    // Replace every chart's points with a window of recorded statistics
+    if (!velocityChart || !history.tick.length) return;
+
+    const series = [
+        [velocityChart, history.speed],
+        [flowChart, history.flow],
+        [vehiclesChart, history.vehicleCount],
+        [densityChart, history.density]
+    ];
+    series.forEach(([chart, values]) => {
+        if (!chart) return;
+        chart.data.labels = history.tick.slice(-window.CHART_POINTS);
+        chart.data.datasets[0].data = values.slice(-window.CHART_POINTS);
+        chart.update('none');
+    });
+}
+
 window.updateCharts = function (tick, stats) {
     if (!velocityChart) return;
 
-    const maxDataPoints = 60;
-
     updateChart(velocityChart, tick, stats.speed);
     updateChart(flowChart, tick, stats.flow);
     updateChart(vehiclesChart, tick, stats.vehicleCount || 0);
@@ -177,10 +196,20 @@ window.updateCharts = function (tick, stats) {
 }
 
 function updateChart(chart, tick, value) {
-    chart.data.labels.push(tick);
+    if (!chart) return;
+    const last = chart.data.labels[chart.data.labels.length - 1];
+    if (last === tick) return;
+    if (last > tick) {
+        // The simulation was reset
+        chart.data.labels = [];
+        chart.data.datasets[0].data = [];
+    }
+    const labels = chart.data.labels;
+
+    labels.push(tick);
     chart.data.datasets[0].data.push(value);
 
-    if (chart.data.labels.length > 60) {
+    if (labels.length > window.CHART_POINTS) {
         chart.data.labels.shift();
         chart.data.datasets[0].data.shift();
     }
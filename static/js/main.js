@@ -1,6 +1,17 @@
 let ws = null;
 let isConnected = false;
 
+// Ask the server for packed binary updates; JSON is used if it declines.
+const USE_BINARY_FRAMES = true;
+const BINARY_MAGIC = 0x32424655; // "UFB2" read as little-endian uint32
+const frameTextDecoder = new TextDecoder();
+
+// The last map rectangle sent to the server, and the timer of a pending one
+let sentViewport = null;
+let pendingViewport = null;
+let viewportTimer = null;
+const VIEWPORT_THROTTLE_MS = 150;
+
 window.onload = function () {
     if (document.getElementById('sim-canvas') || document.getElementById('stat-flow') || document.getElementById('chart-velocity')) {
         setupWebSocket();
@@ -28,10 +39,16 @@ function setupWebSocket() {
         host = 'localhost:8000';
     }
 
-    const wsUrl = `${protocol}//${host}/ws/simulation`;
+    const params = new URLSearchParams();
+    if (USE_BINARY_FRAMES) params.set('format', 'binary');
+    const session = new URLSearchParams(window.location.search).get('session');
+    if (session) params.set('session', session);
+    const query = params.toString() ? `?${params}` : '';
+    const wsUrl = `${protocol}//${host}/ws/simulation${query}`;
     console.log("Connecting to:", wsUrl);
 
     ws = new WebSocket(wsUrl);
+    ws.binaryType = 'arraybuffer';
 
     ws.onopen = () => {
         console.log("Connected to Simulation Engine");
@@ -40,18 +57,30 @@ function setupWebSocket() {
         const canvas = document.getElementById('sim-canvas');
         if (canvas) {
         }
+        // Backfill the charts from the server's recorded history
+        if (window.applyHistory) safeSend({ action: "history", count: window.CHART_POINTS });
     };
 
     ws.onmessage = (event) => {
-        const data = JSON.parse(event.data);
+        const data = event.data instanceof ArrayBuffer ? decodeBinaryFrame(event.data) : JSON.parse(event.data);
+        if (!data) return;
 
         if (data.type === 'init') {
+            fetchingMap = false;
+            const routeToggle = document.getElementById('route-trips-toggle');
+            if (routeToggle) routeToggle.checked = false;
+            const rerouteToggle = document.getElementById('reroute-toggle');
+            if (rerouteToggle) rerouteToggle.checked = false;
             try {
                 console.log("Received INIT state. Keys:", Object.keys(data.state));
                 if (data.state.nodes) console.log("Node count:", data.state.nodes.length);
                 else console.error("CRITICAL: state.nodes is undefined!");
 
                 window.worldMap = data.state;
+                indexWorldMap(window.worldMap);
+                applyLights(data.state.lights);
+                // A new map clears the server's view of this client; send it again.
+                sentViewport = null;
                 resizeCanvas();
                 if (window.renderSimulation) window.renderSimulation(data.state);
 
@@ -68,17 +97,12 @@ function setupWebSocket() {
             try {
                 if (window.worldMap) {
                     window.worldMap.tick = data.tick;
+                    window.worldMap.awaitingKeyframe = false;
+                    window.worldMap.aggregates = null;
+                    window.worldMap.carById = new Map(data.cars.map(car => [car.id, car]));
                     window.worldMap.cars = data.cars;
 
-                    if (data.lights && window.worldMap.nodes) {
-                        data.lights.forEach(light => {
-                            const node = window.worldMap.nodes.find(n => n.id === light.id);
-                            if (node) {
-                                node.signal_ns = light.ns;
-                                node.signal_ew = light.ew;
-                            }
-                        });
-                    }
+                    applyLights(data.lights);
 
                     if (window.renderSimulation) window.renderSimulation(window.worldMap);
                 }
@@ -87,6 +111,55 @@ function setupWebSocket() {
             } catch (e) {
                 console.error("Error processing UPDATE:", e);
             }
+        } else if (data.type === 'delta') {
+
+            try {
+                const map = window.worldMap;
+                if (map && map.carById && map.tick === data.base) {
+                    map.tick = data.tick;
+                    data.removed.forEach(id => map.carById.delete(id));
+                    data.cars.forEach(car => map.carById.set(car.id, car));
+                    map.cars = Array.from(map.carById.values());
+
+                    applyLights(data.lights);
+
+                    if (window.renderSimulation) window.renderSimulation(map);
+                } else if (map && !map.awaitingKeyframe) {
+                    map.awaitingKeyframe = true;
+                    safeSend({ action: "keyframe" });
+                }
+
+                updateStats(data);
+            } catch (e) {
+                console.error("Error processing DELTA:", e);
+            }
+        } else if (data.type === 'aggregate') {
+
+            try {
+                const map = window.worldMap;
+                if (map) {
+                    // Zoomed out: per-edge [edge_id, cars, mean speed] in place of cars.
+                    map.tick = data.tick;
+                    map.aggregates = new Map(data.edges.map(([id, n, v]) => [id, { n: n, v: v }]));
+                    applyLights(data.lights);
+
+                    if (window.renderSimulation) window.renderSimulation(map);
+                }
+
+                updateStats(data);
+            } catch (e) {
+                console.error("Error processing AGGREGATE:", e);
+            }
+        } else if (data.type === 'history') {
+            if (window.applyHistory) window.applyHistory(data.history);
+        } else if (data.type === 'osm_progress') {
+            showMapFetchProgress(data);
+        } else if (data.type === 'osm_cancelled') {
+            fetchingMap = false;
+            showCanvasMessage('Map download cancelled');
+        } else if (data.type === 'session_closed') {
+            console.warn(`Session ${data.session} was closed; joining the default session`);
+            safeSend({ action: "join_session", session: "default" });
         } else if (data.type === 'error') {
             console.error("Server Error:", data.message);
             alert("Error: " + data.message);
@@ -104,6 +177,112 @@ function setupWebSocket() {
     };
 }
 
+function decodeBinaryFrame(buffer) {
+    const view = new DataView(buffer);
+    if (view.getUint32(0, true) !== BINARY_MAGIC) {
+        console.error("Unknown binary frame");
+        return null;
+    }
+
+    const kind = view.getUint8(4);
+    const tick = view.getUint32(8, true);
+    const base = view.getUint32(12, true);
+    const count = view.getUint32(16, true);
+    const removedCount = view.getUint32(20, true);
+    const tailLength = view.getUint32(24, true);
+
+    if (kind === 2) return decodeAggregateFrame(buffer, tick, count, tailLength);
+
+    let offset = 28;
+    const ids = new Uint32Array(buffer, offset, count);
+    offset += 4 * count;
+    const edgeIdx = new Uint32Array(buffer, offset, count);
+    offset += 4 * count;
+    const removed = new Uint32Array(buffer, offset, removedCount);
+    offset += 4 * removedCount;
+    const positions = new Uint16Array(buffer, offset, count);
+    offset += 2 * count;
+    const velocities = new Uint8Array(buffer, offset, count);
+    offset += count;
+    const lanes = new Uint8Array(buffer, offset, count);
+    offset += count;
+    offset = (offset + 3) & ~3;
+    const tail = JSON.parse(frameTextDecoder.decode(new Uint8Array(buffer, offset, tailLength)));
+
+    const edges = (window.worldMap && window.worldMap.edges) || [];
+    const cars = new Array(count);
+    for (let i = 0; i < count; i++) {
+        const edge = edges[edgeIdx[i]];
+        cars[i] = { id: ids[i], v: velocities[i], p: positions[i], l: lanes[i], edge_id: edge ? edge.id : null };
+    }
+
+    return {
+        type: kind === 0 ? 'update' : 'delta',
+        tick: tick,
+        base: base,
+        cars: cars,
+        removed: removed,
+        stats: tail.stats,
+        lights: tail.lights
+    };
+}
+
+function decodeAggregateFrame(buffer, tick, count, tailLength) {
+    // Edge indices (uint32), car counts (uint16), mean speeds in fiftieths (uint8)
+    let offset = 28;
+    const edgeIdx = new Uint32Array(buffer, offset, count);
+    offset += 4 * count;
+    const counts = new Uint16Array(buffer, offset, count);
+    offset += 2 * count;
+    const speeds = new Uint8Array(buffer, offset, count);
+    offset += count;
+    offset = (offset + 3) & ~3;
+    const tail = JSON.parse(frameTextDecoder.decode(new Uint8Array(buffer, offset, tailLength)));
+
+    const edges = (window.worldMap && window.worldMap.edges) || [];
+    const rows = [];
+    for (let i = 0; i < count; i++) {
+        const edge = edges[edgeIdx[i]];
+        if (edge) rows.push([edge.id, counts[i], speeds[i] / 50]);
+    }
+
+    return { type: 'aggregate', tick: tick, edges: rows, stats: tail.stats, lights: tail.lights };
+}
+
+// Called by the renderer with the map rectangle on screen and its pixels per map unit.
+window.onViewportChange = function (viewport) {
+    const key = [viewport.x0, viewport.y0, viewport.x1, viewport.y1, viewport.scale]
+        .map(v => Math.round(v * 100) / 100).join(',');
+    if (key === sentViewport || key === pendingViewport || !isConnected) return;
+    // Wait for panning and zooming to settle before asking the server to re-cull.
+    clearTimeout(viewportTimer);
+    pendingViewport = key;
+    viewportTimer = setTimeout(() => {
+        sentViewport = key;
+        pendingViewport = null;
+        safeSend({ action: "viewport", ...viewport });
+    }, VIEWPORT_THROTTLE_MS);
+};
+
+function indexWorldMap(map) {
+    map.nodeById = new Map((map.nodes || []).map(node => [node.id, node]));
+    map.edgeById = new Map((map.edges || []).map(edge => [edge.id, edge]));
+    map.carById = new Map((map.cars || []).map(car => [car.id, car]));
+}
+
+function applyLights(lights) {
+    const map = window.worldMap;
+    if (!lights || !map || !map.nodeById) return;
+
+    lights.forEach(light => {
+        const node = map.nodeById.get(light.id);
+        if (node) {
+            node.signal_ns = light.ns;
+            node.signal_ew = light.ew;
+        }
+    });
+}
+
 function safeSend(message) {
     if (!ws || ws.readyState === WebSocket.CLOSED || ws.readyState === WebSocket.CLOSING) {
         console.warn("WebSocket closed. Attempting to reconnect...");
@@ -253,6 +432,10 @@ window.addEventListener('load', () => {
     const spawnValue = document.getElementById('spawn-rate-value');
     const lightSlider = document.getElementById('light-timing-slider');
     const lightValue = document.getElementById('light-timing-value');
+    const routeToggle = document.getElementById('route-trips-toggle');
+    const rerouteToggle = document.getElementById('reroute-toggle');
+    const signalSelect = document.getElementById('signal-control-select');
+    const greenWaveBtn = document.getElementById('btn-green-wave');
 
     if (gridRowsSlider) {
         gridRowsSlider.addEventListener('input', (e) => {
@@ -277,6 +460,20 @@ window.addEventListener('load', () => {
             const value = parseInt(e.target.value) / 100;
             spawnValue.textContent = `${e.target.value}%`;
             safeSend({ action: "set_spawn_rate", value: value });
+            if (routeToggle && routeToggle.checked) sendDemand(true);
+        });
+    }
+
+    // With trips on, the spawn rate is the expected number of new trips per tick.
+    const sendDemand = (enabled) => {
+        safeSend({ action: "set_demand", enabled: enabled, rate: parseInt(spawnSlider.value) / 100 });
+    };
+    if (routeToggle) {
+        routeToggle.addEventListener('change', (e) => sendDemand(e.target.checked));
+    }
+    if (rerouteToggle) {
+        rerouteToggle.addEventListener('change', (e) => {
+            safeSend({ action: "set_rerouting", enabled: e.target.checked });
         });
     }
 
@@ -288,6 +485,15 @@ window.addEventListener('load', () => {
             safeSend({ action: "set_light_timing", value: value });
         });
     }
+
+    if (signalSelect) {
+        signalSelect.addEventListener('change', (e) => {
+            safeSend({ action: "set_signal_control", mode: e.target.value });
+        });
+    }
+    if (greenWaveBtn) {
+        greenWaveBtn.addEventListener('click', () => safeSend({ action: "green_wave", direction: "ew" }));
+    }
 });
 
 let mapInstance = null;
@@ -338,8 +544,48 @@ function confirmMapSelection() {
         ctx.fillText('Fetching real-world map data...', canvas.width / 2, canvas.height / 2);
     }
 
+    fetchingMap = true;
     safeSend({
         action: "generate_from_osm",
         bounds: bounds
     });
 }
+
+let fetchingMap = false;
+
+function showCanvasMessage(text, detail) {
+    const canvas = document.getElementById('sim-canvas');
+    if (!canvas) return;
+    const ctx = canvas.getContext('2d');
+    ctx.fillStyle = '#1a1a1a';
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+    ctx.fillStyle = '#ffffff';
+    ctx.font = "20px 'Inter', sans-serif";
+    ctx.textAlign = 'center';
+    ctx.fillText(text, canvas.width / 2, canvas.height / 2);
+    if (detail) {
+        ctx.font = "14px 'Inter', sans-serif";
+        ctx.fillText(detail, canvas.width / 2, canvas.height / 2 + 28);
+    }
+}
+
+function showMapFetchProgress(progress) {
+    const hint = 'Press Esc to cancel';
+    if (progress.stage === 'fetching') {
+        showCanvasMessage(`Fetching real-world map data from ${progress.mirrors} servers...`, hint);
+    } else if (progress.stage === 'downloading' || progress.stage === 'downloaded') {
+        const mb = (progress.bytes / (1024 * 1024)).toFixed(1);
+        showCanvasMessage(`Downloading map data... ${mb} MB`, hint);
+    } else if (progress.stage === 'building') {
+        fetchingMap = false;
+        showCanvasMessage('Building road network...');
+    }
+}
+
+function cancelMapFetch() {
+    if (fetchingMap) safeSend({ action: "cancel_osm" });
+}
+
+document.addEventListener('keydown', (e) => {
+    if (e.key === 'Escape') cancelMapFetch();
+});
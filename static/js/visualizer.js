@@ -1,7 +1,13 @@
+// Zoom factor over the fitted map, and pan in screen pixels, set by the mouse
+const camera = { zoom: 1, panX: 0, panY: 0 };
+let lastState = null;
+
 window.renderSimulation = function (state) {
     const canvas = document.getElementById('sim-canvas');
     if (!canvas) return;
     const ctx = canvas.getContext('2d');
+    lastState = state;
+    attachCameraControls(canvas);
 
     ctx.clearRect(0, 0, canvas.width, canvas.height);
 
@@ -32,12 +38,22 @@ window.renderSimulation = function (state) {
     const padding = 60;
     const scaleX = (canvas.width - 2 * padding) / gridWidth;
     const scaleY = (canvas.height - 2 * padding) / gridHeight;
-    const scale = Math.min(scaleX, scaleY, 2.5);
-
-    const scaledWidth = gridWidth * scale;
-    const scaledHeight = gridHeight * scale;
-    const offsetX = (canvas.width - scaledWidth) / 2 - minX * scale;
-    const offsetY = (canvas.height - scaledHeight) / 2 - minY * scale;
+    const fitScale = Math.min(scaleX, scaleY, 2.5);
+    const scale = fitScale * camera.zoom;
+
+    // Zoom about the canvas centre, then pan
+    const offsetX = canvas.width / 2 - ((minX + maxX) / 2) * scale + camera.panX;
+    const offsetY = canvas.height / 2 - ((minY + maxY) / 2) * scale + camera.panY;
+
+    if (window.onViewportChange) {
+        window.onViewportChange({
+            x0: -offsetX / scale,
+            y0: -offsetY / scale,
+            x1: (canvas.width - offsetX) / scale,
+            y1: (canvas.height - offsetY) / scale,
+            scale: scale
+        });
+    }
 
     const transform = (x, y) => {
         let tx = x * scale + offsetX;
@@ -67,9 +83,18 @@ window.renderSimulation = function (state) {
         }
     });
 
-    if (state.cars && state.cars.length > 0) {
+    let vehicles = state.cars ? state.cars.length : 0;
+    if (state.aggregates) {
+        // Zoomed out: roads coloured by mean speed in place of cars
+        vehicles = 0;
+        state.aggregates.forEach((agg, edgeId) => {
+            const edge = state.edgeById && state.edgeById.get(edgeId);
+            if (edge) drawEdgeAggregate(ctx, edge, agg, transform, scale);
+            vehicles += agg.n;
+        });
+    } else if (state.cars && state.cars.length > 0) {
         state.cars.forEach(car => {
-            drawRealisticVehicle(ctx, car, state.edges, transform, scale);
+            drawRealisticVehicle(ctx, car, state.edges, transform, scale, state.edgeById);
         });
     }
 
@@ -78,9 +103,9 @@ window.renderSimulation = function (state) {
     ctx.fillText(`Time: ${state.tick || 0}`, canvas.width - 180, 35);
 
     ctx.font = "14px 'Inter', sans-serif";
-    ctx.fillText(`Vehicles: ${state.cars ? state.cars.length : 0}`, canvas.width - 180, 60);
+    ctx.fillText(`Vehicles: ${vehicles}`, canvas.width - 180, 60);
 
-    if (!state.cars || state.cars.length === 0) {
+    if (vehicles === 0 && camera.zoom === 1) {
         ctx.fillStyle = 'rgba(255, 193, 7, 0.9)';
         ctx.fillRect(10, canvas.height - 50, 320, 40);
         ctx.fillStyle = '#000';
@@ -89,6 +114,60 @@ window.renderSimulation = function (state) {
     }
 }
 
+function attachCameraControls(canvas) {
+    if (canvas._camera) return;
+    canvas._camera = true;
+    const redraw = () => { if (lastState) window.renderSimulation(lastState); };
+    let drag = null;
+
+    canvas.addEventListener('wheel', (e) => {
+        e.preventDefault();
+        const factor = Math.exp(-e.deltaY * 0.0015);
+        const zoom = Math.min(64, Math.max(0.25, camera.zoom * factor));
+        // Keep the map point under the cursor in place
+        const rect = canvas.getBoundingClientRect();
+        const mx = (e.clientX - rect.left) * canvas.width / rect.width - canvas.width / 2;
+        const my = (e.clientY - rect.top) * canvas.height / rect.height - canvas.height / 2;
+        const k = zoom / camera.zoom;
+        camera.panX = mx - (mx - camera.panX) * k;
+        camera.panY = my - (my - camera.panY) * k;
+        camera.zoom = zoom;
+        redraw();
+    }, { passive: false });
+
+    canvas.addEventListener('mousedown', (e) => {
+        drag = { x: e.clientX, y: e.clientY };
+    });
+    window.addEventListener('mousemove', (e) => {
+        if (!drag) return;
+        const rect = canvas.getBoundingClientRect();
+        camera.panX += (e.clientX - drag.x) * canvas.width / rect.width;
+        camera.panY += (e.clientY - drag.y) * canvas.height / rect.height;
+        drag = { x: e.clientX, y: e.clientY };
+        redraw();
+    });
+    window.addEventListener('mouseup', () => { drag = null; });
+
+    canvas.addEventListener('dblclick', () => {
+        camera.zoom = 1;
+        camera.panX = 0;
+        camera.panY = 0;
+        redraw();
+    });
+}
+
+function drawEdgeAggregate(ctx, edge, agg, transform, scale) {
+    // Red when stopped to green at full speed; wider the fuller the road
+    const pts = edgePath(edge).pts.map(p => transform(p.x, p.y));
+    const speed = Math.min(agg.v / 5, 1);
+    const fill = Math.min(agg.n / Math.max((edge.length || 1) * (edge.lanes || 1), 1), 1);
+    ctx.lineCap = 'round';
+    tracePath(ctx, pts);
+    ctx.lineWidth = Math.max(2, 28 * scale * (edge.lanes || 1) * (0.3 + 0.7 * fill));
+    ctx.strokeStyle = `hsla(${Math.round(120 * speed)}, 85%, 50%, 0.85)`;
+    ctx.stroke();
+}
+
 function drawErrorMessage(ctx, canvas, message) {
     ctx.fillStyle = '#1a1a1a';
     ctx.fillRect(0, 0, canvas.width, canvas.height);
@@ -117,26 +196,47 @@ function drawGrassBackground(ctx, width, height) {
     }
 }
 
+function edgePath(edge) {
+    // Polyline of a road through its bend points, with cumulative lengths, cached on the edge.
+    if (!edge._path) {
+        const pts = [edge.from, ...(edge.points || []), edge.to];
+        const cum = [0];
+        for (let i = 1; i < pts.length; i++) {
+            cum.push(cum[i - 1] + Math.hypot(pts[i].x - pts[i - 1].x, pts[i].y - pts[i - 1].y));
+        }
+        edge._path = { pts, cum, total: cum[cum.length - 1] };
+    }
+    return edge._path;
+}
+
+function tracePath(ctx, pts) {
+    ctx.beginPath();
+    ctx.moveTo(pts[0].x, pts[0].y);
+    for (let i = 1; i < pts.length; i++) {
+        ctx.lineTo(pts[i].x, pts[i].y);
+    }
+}
+
 function drawRealisticRoad(ctx, edge, transform, scale) {
-    const from = transform(edge.from.x, edge.from.y);
-    const to = transform(edge.to.x, edge.to.y);
+    const pts = edgePath(edge).pts.map(p => transform(p.x, p.y));
+    const from = pts[0];
+    const to = pts[pts.length - 1];
 
-    const roadWidth = 28 * scale;
+    // One lane's width each way per lane; opposing edges share the polyline
+    const roadWidth = 28 * scale * (edge.lanes || 1);
     const dx = to.x - from.x;
     const dy = to.y - from.y;
     const angle = Math.atan2(dy, dx);
 
     ctx.lineCap = 'butt';
-    ctx.lineJoin = 'miter';
+    ctx.lineJoin = pts.length > 2 ? 'round' : 'miter';
 
     ctx.shadowColor = 'rgba(0, 0, 0, 0.3)';
     ctx.shadowBlur = 8 * scale;
     ctx.shadowOffsetX = 0;
     ctx.shadowOffsetY = 4 * scale;
 
-    ctx.beginPath();
-    ctx.moveTo(from.x, from.y);
-    ctx.lineTo(to.x, to.y);
+    tracePath(ctx, pts);
     ctx.lineWidth = roadWidth + 6;
     ctx.strokeStyle = '#2a2a2a';
     ctx.stroke();
@@ -156,25 +256,19 @@ function drawRealisticRoad(ctx, edge, transform, scale) {
     gradient.addColorStop(0.5, '#3a3a3a');
     gradient.addColorStop(1, '#4a4a4a');
 
-    ctx.beginPath();
-    ctx.moveTo(from.x, from.y);
-    ctx.lineTo(to.x, to.y);
+    tracePath(ctx, pts);
     ctx.lineWidth = roadWidth;
     ctx.strokeStyle = gradient;
     ctx.stroke();
 
-    ctx.beginPath();
-    ctx.moveTo(from.x, from.y);
-    ctx.lineTo(to.x, to.y);
+    tracePath(ctx, pts);
     ctx.lineWidth = 2.5 * scale;
     ctx.strokeStyle = '#fbbf24';
     ctx.setLineDash([14 * scale, 10 * scale]);
     ctx.stroke();
     ctx.setLineDash([]);
 
-    ctx.beginPath();
-    ctx.moveTo(from.x, from.y);
-    ctx.lineTo(to.x, to.y);
+    tracePath(ctx, pts);
     ctx.lineWidth = roadWidth + 2;
     ctx.strokeStyle = 'rgba(0, 0, 0, 0.2)';
     ctx.stroke();
@@ -320,26 +414,35 @@ function drawRealisticTrafficLight(ctx, node, transform, scale) {
     });
 }
 
-function drawRealisticVehicle(ctx, car, edges, transform, scale) {
+function drawRealisticVehicle(ctx, car, edges, transform, scale, edgeById) {
     if (!edges || edges.length === 0) return;
 
-    const edge = edges.find(e => e.id === car.edge_id);
+    const edge = edgeById ? edgeById.get(car.edge_id) : edges.find(e => e.id === car.edge_id);
     if (!edge) {
         return;
     }
 
     const t = (car.p) / (edge.length || 1);
-    const dx = edge.to.x - edge.from.x;
-    const dy = edge.to.y - edge.from.y;
-    const x = edge.from.x + t * dx;
-    const y = edge.from.y + t * dy;
-    const pos = transform(x, y);
+    const path = edgePath(edge);
+    const d = t * path.total;
+    let i = 1;
+    while (i < path.pts.length - 1 && path.cum[i] < d) i++;
+    const a = path.pts[i - 1];
+    const b = path.pts[i];
+    const dx = b.x - a.x;
+    const dy = b.y - a.y;
+    const seg = path.cum[i] - path.cum[i - 1];
+    const f = seg > 0 ? (d - path.cum[i - 1]) / seg : 0;
+    const pos = transform(a.x + f * dx, a.y + f * dy);
 
     ctx.save();
     ctx.translate(pos.x, pos.y);
 
     const angle = Math.atan2(dy, dx);
     ctx.rotate(angle);
+    // Lanes sit right of the centreline, lane 0 outermost
+    const lanes = edge.lanes || 1;
+    ctx.translate(0, (lanes - (car.l || 0) - 0.5) * 14 * scale);
 
     const carLength = 26 * scale;
     const carWidth = 13 * scale;
@@ -350,7 +453,7 @@ function drawRealisticVehicle(ctx, car, edges, transform, scale) {
     ctx.shadowOffsetY = 4;
 
     const carColors = ['#ef4444', '#3b82f6', '#fbbf24', '#22c55e', '#8b5cf6', '#ec4899', '#f97316', '#06b6d4'];
-    const carIdNum = parseInt(car.id.split('_')[1]) || 0;
+    const carIdNum = typeof car.id === 'number' ? car.id : (parseInt(car.id.split('_')[1]) || 0);
     const baseColor = carColors[carIdNum % carColors.length];
 
     const bodyGradient = ctx.createLinearGradient(0, -carWidth / 2, 0, carWidth / 2);